@@ -0,0 +1,445 @@
+import asyncio
+import concurrent.futures
+import http.client
+import io
+import json
+import signal
+import time
+from http import HTTPStatus
+
+from events import EVENTS_BUFFER_SIZE, LAST_CHUNK, Subscriber, chunk, event_hub
+from metrics import PHASES, metrics
+from server import (
+    APIHandler,
+    KEEPALIVE_TIMEOUT,
+    MAX_BODY_SIZE,
+    MAX_KEEPALIVE_REQUESTS,
+    SERVER_QUEUE_SIZE,
+    SERVER_WORKERS,
+    auth,
+    db,
+)
+
+# Ограничение на размер заголовков; тела - MAX_BODY_SIZE из server.
+# Постоянные соединения - KEEPALIVE_TIMEOUT и MAX_KEEPALIVE_REQUESTS из
+# server, как у движка threads
+MAX_HEADER_SIZE = 64 * 1024
+# Сколько ждать завершения начатых запросов при остановке
+SHUTDOWN_TIMEOUT = 30.0
+
+# Заголовки соединения выставляет движок, а не обработчик
+HOP_BY_HOP = {"connection", "content-length", "keep-alive", "transfer-encoding"}
+
+
+class BufferedAPIHandler(APIHandler):
+    """APIHandler без сокета: запрос уже разобран, ответ собирается в память.
+
+    Маршруты и проверки прав те же, что в потоковом сервере; меняется
+    только транспорт. Статус и заголовки запоминаются, тело пишется в
+    буфер, а отправкой по сети занимается цикл событий.
+    """
+
+    def __init__(
+        self,
+        command,
+        path,
+        headers,
+        body,
+        client_address,
+        request_version="HTTP/1.1",
+        send_chunk=None,
+    ):
+        self.command = command
+        self.path = path
+        self.headers = headers
+        self.client_address = client_address
+        self.server = None
+        self.request_version = request_version
+        self.requestline = f"{command} {path} {request_version}"
+        self.close_connection = False
+        self.rfile = io.BytesIO(body)
+        self.wfile = io.BytesIO()
+        self._body = None
+        self.status = HTTPStatus.INTERNAL_SERVER_ERROR
+        self.response_headers = []
+        # Потоковый ответ уходит в сеть частями через цикл событий
+        self._send_chunk = send_chunk
+        self.streamed = False
+        self._phases = dict.fromkeys(PHASES, 0.0)
+        self._response_bytes = 0
+        # Данные токена подписчика /api/events: поток ведет цикл событий
+        self.events = None
+
+    def send_response(self, code, message=None):
+        self.status = HTTPStatus(code)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() not in HOP_BY_HOP:
+            self.response_headers.append((keyword, value))
+
+    def end_headers(self):
+        pass
+
+    def _write_chunk(self, data):
+        if self._send_chunk is None:
+            self.wfile.write(data)
+            return
+        self.streamed = True
+        self._send_chunk(self.status, self.response_headers, data)
+
+    def _subscribe_events(self, token_data):
+        self.events = token_data
+
+    def handle_request(self):
+        """Выполнить запрос и вернуть (статус, заголовки, тело)"""
+        # Заголовки разобрал цикл событий; время считается с момента,
+        # когда запрос взял рабочий поток
+        self._started = time.perf_counter()
+        method = getattr(self, f"do_{self.command}", None)
+        if method is None:
+            self._send_error("Метод не поддерживается", 501)
+        else:
+            method()
+        return self.status, self.response_headers, self.wfile.getvalue()
+
+
+class AsyncSubscriber(Subscriber):
+    """Подписчик на соединении asyncio-сервера.
+
+    Хаб вызывает push из своего потока, а запись и проверка буфера
+    транспорта идут в цикле событий. Закрытие (сервером или хабом)
+    завершает корутину соединения через done.
+    """
+
+    def __init__(self, loop, writer, user_id, role):
+        super().__init__(user_id, role)
+        self.loop = loop
+        self.writer = writer
+        self.done = asyncio.Event()
+
+    def push(self, data):
+        try:
+            self.loop.call_soon_threadsafe(self._write, chunk(data))
+        except RuntimeError:
+            # Цикл событий уже остановлен
+            return False
+        return not self.closed
+
+    def _write(self, data):
+        if self.closed:
+            return
+        if self.writer.transport.get_write_buffer_size() > EVENTS_BUFFER_SIZE:
+            self.overflowed = True
+            self.finish()
+            return
+        self.writer.write(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.finish)
+        except RuntimeError:
+            super().close()
+
+    def finish(self):
+        """Завершить поток (в цикле событий)"""
+        if not self.closed and not self.writer.is_closing():
+            self.writer.write(LAST_CHUNK)
+        super().close()
+        self.done.set()
+
+
+class AsyncAPIServer:
+    """HTTP/1.1 сервер API на asyncio.
+
+    Соединения обслуживает цикл событий, поэтому открытое, но молчащее
+    keep-alive соединение стоит одной корутины, а не потока. Обработчики
+    маршрутов с блокирующими вызовами SQLite выполняются в пуле потоков
+    ограниченного размера; если пул и очередь к нему заняты, клиент
+    сразу получает 503.
+    """
+
+    def __init__(
+        self,
+        host="",
+        port=5000,
+        workers=SERVER_WORKERS,
+        queue_size=SERVER_QUEUE_SIZE,
+        reuse_port=False,
+        idle_timeout=KEEPALIVE_TIMEOUT,
+    ):
+        self.host = host or None
+        self.port = port
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.reuse_port = reuse_port
+        self.idle_timeout = idle_timeout
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="api-worker"
+        )
+        self._pending = 0
+        self._idle = set()
+        self._connections = set()
+        self._server = None
+        self._stopping = None
+
+    async def serve(self):
+        """Обслуживать соединения до вызова stop()"""
+        self._stopping = asyncio.Event()
+        self._server = await asyncio.start_server(
+            self._handle_connection,
+            self.host,
+            self.port,
+            reuse_address=True,
+            reuse_port=self.reuse_port or None,
+            limit=MAX_HEADER_SIZE,
+        )
+        await self._stopping.wait()
+
+        # Новые соединения не принимаем, молчащие закрываем,
+        # а на занятых даем доделать текущий запрос
+        self._server.close()
+        for writer in list(self._idle):
+            writer.close()
+        if self._connections:
+            await asyncio.wait(list(self._connections), timeout=SHUTDOWN_TIMEOUT)
+        self.executor.shutdown(wait=True)
+
+    def stop(self):
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        handled = 0
+        try:
+            while not self._stopping.is_set():
+                self._idle.add(writer)
+                try:
+                    request = await asyncio.wait_for(
+                        self._read_request(reader, writer), self.idle_timeout
+                    )
+                finally:
+                    self._idle.discard(writer)
+
+                if request is None:
+                    break
+
+                *request, keep_alive = request
+                handled += 1
+                keep_alive = keep_alive and handled < MAX_KEEPALIVE_REQUESTS
+                keep_alive = await self._respond(reader, writer, *request, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _read_request(self, reader, writer):
+        """Разобрать запрос; None, если клиент закрыл соединение"""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise
+            return None
+        except asyncio.LimitOverrunError:
+            await self._write_error(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+            return None
+
+        request_line, _, raw_headers = head.partition(b"\r\n")
+        try:
+            command, path, version = request_line.decode("latin-1").split()
+        except ValueError:
+            await self._write_error(writer, HTTPStatus.BAD_REQUEST)
+            return None
+
+        headers = http.client.parse_headers(io.BytesIO(raw_headers))
+        # Тело без Content-Length (chunked) не поддерживается, как и в
+        # движке threads: 411 и закрытие соединения
+        if "Transfer-Encoding" in headers:
+            await self._write_error(writer, HTTPStatus.LENGTH_REQUIRED)
+            return None
+        try:
+            length = int(headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            await self._write_error(writer, HTTPStatus.BAD_REQUEST)
+            return None
+        if length > MAX_BODY_SIZE:
+            await self._write_error(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            return None
+
+        body = await reader.readexactly(length) if length else b""
+
+        connection = headers.get("Connection", "").lower()
+        if version == "HTTP/1.1":
+            keep_alive = connection != "close"
+        else:
+            keep_alive = connection == "keep-alive"
+
+        return command, path, version, headers, body, keep_alive
+
+    async def _respond(
+        self, reader, writer, command, path, version, headers, body, keep_alive
+    ):
+        if self._pending >= self.workers + self.queue_size:
+            metrics.request_rejected()
+            await self._write_error(writer, HTTPStatus.SERVICE_UNAVAILABLE)
+            return False
+
+        loop = asyncio.get_running_loop()
+        handler = BufferedAPIHandler(
+            command,
+            path,
+            headers,
+            body,
+            writer.get_extra_info("peername"),
+            version,
+            self._chunk_sender(loop, writer, version, keep_alive),
+        )
+        self._pending += 1
+        try:
+            status, response_headers, response_body = await loop.run_in_executor(
+                self.executor, handler.handle_request
+            )
+        except Exception as e:
+            print(f"Ошибка обработки {command} {path}: {e}")
+            if handler.streamed:
+                return False
+            await self._write_error(writer, HTTPStatus.INTERNAL_SERVER_ERROR)
+            return False
+        finally:
+            self._pending -= 1
+
+        if handler.events is not None:
+            await self._stream_events(
+                reader, writer, version, status, response_headers, handler.events
+            )
+            return False
+
+        if handler.streamed:
+            # Ответ уже отправлен частями из рабочего потока
+            return (
+                keep_alive
+                and not handler.close_connection
+                and not self._stopping.is_set()
+            )
+
+        keep_alive = keep_alive and not self._stopping.is_set()
+        writer.write(
+            self._format_head(
+                version, status, response_headers, response_body, keep_alive
+            )
+            + response_body
+        )
+        await writer.drain()
+        return keep_alive
+
+    async def _stream_events(self, reader, writer, version, status, headers, token):
+        """Держать поток /api/events, пока клиент или хаб его не закроют"""
+        writer.write(self._format_head(version, status, headers, None, False))
+        await writer.drain()
+
+        subscriber = AsyncSubscriber(
+            asyncio.get_running_loop(), writer, token["user_id"], token["role"]
+        )
+        if not event_hub.subscribe(subscriber):
+            return
+
+        # При остановке сервера поток закрывается, как молчащее соединение
+        self._idle.add(writer)
+        done = asyncio.ensure_future(subscriber.done.wait())
+        try:
+            while True:
+                read = asyncio.ensure_future(reader.read(4096))
+                finished, _ = await asyncio.wait(
+                    {read, done}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if done in finished:
+                    read.cancel()
+                    break
+                # Клиент потока ничего не присылает: пустое чтение - он ушел
+                if not read.result():
+                    break
+        finally:
+            done.cancel()
+            self._idle.discard(writer)
+            subscriber.finish()
+
+    def _chunk_sender(self, loop, writer, version, keep_alive):
+        """Функция для рабочего потока: отправить часть chunked-ответа.
+
+        Поток ждет, пока часть уйдет в сокет, поэтому медленный клиент
+        притормаживает чтение из базы, а не копит ответ в памяти.
+        """
+        head_sent = False
+
+        async def write(data):
+            writer.write(data)
+            await writer.drain()
+
+        def send_chunk(status, headers, data):
+            nonlocal head_sent
+            frame = b"%X\r\n%s\r\n" % (len(data), data)
+            if not head_sent:
+                head_sent = True
+                alive = keep_alive and not self._stopping.is_set()
+                frame = self._format_head(version, status, headers, None, alive) + frame
+            asyncio.run_coroutine_threadsafe(write(frame), loop).result()
+
+        return send_chunk
+
+    def _format_head(self, version, status, headers, body, keep_alive):
+        """Строка статуса и заголовки; body=None означает chunked-ответ"""
+        lines = [f"{version} {status.value} {status.phrase}"]
+        lines.extend(f"{name}: {value}" for name, value in headers)
+        if body is None:
+            lines.append("Transfer-Encoding: chunked")
+        else:
+            lines.append(f"Content-Length: {len(body)}")
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def _write_error(self, writer, status):
+        body = json.dumps({"error": status.phrase}).encode("utf-8")
+        headers = [("Content-type", "application/json")]
+        if status == HTTPStatus.SERVICE_UNAVAILABLE:
+            headers.append(("Retry-After", "1"))
+        writer.write(self._format_head("HTTP/1.1", status, headers, body, False) + body)
+        await writer.drain()
+
+
+def serve_async(
+    port=5000, workers=SERVER_WORKERS, queue_size=SERVER_QUEUE_SIZE, reuse_port=False
+):
+    """Запустить asyncio-сервер в текущем процессе до Ctrl+C или SIGTERM"""
+    server = AsyncAPIServer("", port, workers, queue_size, reuse_port)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, server.stop)
+            except (NotImplementedError, RuntimeError):
+                # Windows: остановка только по KeyboardInterrupt
+                pass
+        await server.serve()
+
+    auth.start()
+    db.start_backfill()
+    event_hub.start()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        event_hub.stop()
+        auth.stop()
+        db.close()
+    return server
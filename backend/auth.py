@@ -1,12 +1,265 @@
+import base64
 import hashlib
+import heapq
+import hmac
+import os
+import secrets
 import time
 import json
+import threading
+
+from passwords import password_hasher
+
+
+# Время жизни токена
+SESSION_TTL = int(os.environ.get("STRAHOVOCHKA_SESSION_TTL", "86400"))
+# Сколько отдельно отозванных токенов одного пользователя держать. Сверх
+# этого старшая половина сворачивается в отметку "выданные до", поэтому
+# список в памяти растет не быстрее числа пользователей, а не выходов
+MAX_REVOKED_PER_USER = int(os.environ.get("STRAHOVOCHKA_MAX_REVOKED_PER_USER", "100"))
+SWEEP_INTERVAL = int(os.environ.get("STRAHOVOCHKA_SWEEP_INTERVAL", "60"))
+
+# Ключ отзыва всех токенов пользователя, выданных до revoked_at
+USER_KEY_PREFIX = "user:"
+
+
+class RevocationList:
+    """Отозванные токены в памяти до истечения их срока.
+
+    Ключ записи - jti отдельного токена или "user:<id>" для всех токенов
+    пользователя, выданных до revoked_at. Сроки лежат в куче, поэтому истекшие записи снимаются с
+    ее вершины за O(log n): фоновым потоком и при каждом добавлении.
+    Отзыв всех токенов пользователя убирает его отдельные отзывы, сделанные
+    не позже: они им уже покрыты (токен выдан раньше, чем отозван). Записи
+    не вытесняются - забытый отзыв снова пропустил бы токен; отметка
+    пользователя только сдвигается вперед.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        # user_id -> {jti: None}: отдельные отзывы токенов пользователя
+        self._by_user = {}
+        # (expires, key); записи удаленных отзывов убираются лениво
+        self._heap = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sweeper = None
+        self._counters = {"expired": 0, "covered": 0}
+
+    def add(self, key, data):
+        """Добавить отзыв (data: user_id, revoked_at, expires)"""
+        with self._lock:
+            self._expire(time.time())
+            if key in self._entries:
+                if key.startswith(USER_KEY_PREFIX):
+                    current = self._entries[key]
+                    data = {
+                        "user_id": data["user_id"],
+                        "revoked_at": max(data["revoked_at"], current["revoked_at"]),
+                        "expires": max(data["expires"], current["expires"]),
+                    }
+                self._remove(key, None)
+
+            self._entries[key] = data
+            heapq.heappush(self._heap, (data["expires"], key))
+            if key.startswith(USER_KEY_PREFIX):
+                tokens = self._by_user.get(data["user_id"], {})
+                for token in [
+                    token
+                    for token in tokens
+                    if self._entries[token]["revoked_at"] <= data["revoked_at"]
+                ]:
+                    self._remove(token, "covered")
+            else:
+                self._by_user.setdefault(data["user_id"], {})[key] = None
+            self._compact()
+
+    def get(self, key):
+        """Запись отзыва; None, если ее нет. Просроченная удаляется"""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None and time.time() > data["expires"]:
+                self._remove(key, "expired")
+                return None
+            return data
+
+    def tokens_of(self, user_id):
+        """Сколько отдельных токенов пользователя отозвано"""
+        with self._lock:
+            return len(self._by_user.get(user_id, ()))
+
+    def oldest_of(self, user_id, count):
+        """Самый поздний отзыв и самый дальний срок среди count старших
+        отдельных отзывов пользователя: (revoked_at, expires) или None"""
+        with self._lock:
+            entries = sorted(
+                (self._entries[key] for key in self._by_user.get(user_id, ())),
+                key=lambda data: data["revoked_at"],
+            )[:count]
+        if not entries:
+            return None
+        return entries[-1]["revoked_at"], max(data["expires"] for data in entries)
+
+    def sweep(self):
+        """Удалить все просроченные отзывы, вернуть их количество"""
+        with self._lock:
+            return self._expire(time.time())
+
+    def start_sweeper(self, interval=SWEEP_INTERVAL, on_sweep=None):
+        """Запустить фоновую очистку просроченных отзывов.
+
+        on_sweep вызывается в том же потоке после каждой очистки.
+        """
+        if self._sweeper is not None:
+            return
+
+        self._stop.clear()
+        self._sweeper = threading.Thread(
+            target=self._sweep_loop,
+            args=(interval, on_sweep),
+            name="revocation-sweeper",
+            daemon=True,
+        )
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        if self._sweeper is None:
+            return
+
+        self._stop.set()
+        self._sweeper.join()
+        self._sweeper = None
+
+    def metrics(self):
+        """Число записей и счетчики удаленных по причинам"""
+        with self._lock:
+            result = dict(self._counters)
+            result["live"] = len(self._entries)
+            return result
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _sweep_loop(self, interval, on_sweep):
+        while not self._stop.wait(interval):
+            self.sweep()
+            if on_sweep is not None:
+                try:
+                    on_sweep()
+                except Exception as e:
+                    print(f"⚠️ Ошибка фоновой очистки отзывов: {e}")
+
+    def _expire(self, now):
+        expired = 0
+        while self._heap and self._heap[0][0] <= now:
+            expires, key = heapq.heappop(self._heap)
+            data = self._entries.get(key)
+            if data is not None and data["expires"] == expires:
+                self._remove(key, "expired")
+                expired += 1
+        return expired
+
+    def _remove(self, key, reason):
+        data = self._entries.pop(key)
+        if not key.startswith(USER_KEY_PREFIX):
+            tokens = self._by_user.get(data["user_id"])
+            if tokens is not None:
+                tokens.pop(key, None)
+                if not tokens:
+                    del self._by_user[data["user_id"]]
+        if reason is not None:
+            self._counters[reason] += 1
+
+    def _compact(self):
+        # После замены и покрытия отзывов в куче копятся лишние записи
+        if len(self._heap) > 2 * len(self._entries) + 1024:
+            self._heap = [(data["expires"], key) for key, data in self._entries.items()]
+            heapq.heapify(self._heap)
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=")
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+def _load_secret():
+    """Ключ подписи токенов из конфигурации"""
+    secret = os.environ.get("SECRET_KEY") or os.environ.get("STRAHOVOCHKA_SECRET_KEY")
+    if secret:
+        return secret.encode("utf-8")
+
+    # Без ключа токены не переживут перезапуск, но процессы, порожденные
+    # из этого, получат тот же ключ
+    print("⚠️ SECRET_KEY не задан, используется случайный ключ")
+    return secrets.token_bytes(32)
+
+
+SECRET_KEY = _load_secret()
+
+# Как часто подтягивать отзывы токенов, сделанные другими процессами
+REVOCATION_SYNC_INTERVAL = float(
+    os.environ.get("STRAHOVOCHKA_REVOCATION_SYNC_INTERVAL", "1")
+)
 
 
 class Auth:
-    def __init__(self, db):
+    """Вход и проверка подписанных токенов.
+
+    Токен самодостаточен: в нем лежат id пользователя, роль и срок
+    действия, подписанные HMAC-SHA256. Проверить его может любой процесс
+    сервера с тем же ключом, без общей таблицы сессий. Выход и отзыв
+    записываются в список отозванных (таблица revoked_tokens), который
+    каждый процесс держит в памяти до истечения срока записей. Когда у
+    пользователя больше MAX_REVOKED_PER_USER отдельных отзывов, старшая
+    половина сворачивается в отметку "токены, выданные до": токены,
+    выданные после свернутых выходов, продолжают действовать, а список
+    ограничен числом пользователей.
+    """
+
+    def __init__(self, db, secret=SECRET_KEY):
         self.db = db
-        self.tokens = {}
+        self.secret = secret
+        # Отозванные токены ("jti") и пользователи ("user:<id>")
+        self.denylist = RevocationList()
+        self._synced_rowid = 0
+        self._synced_at = 0
+        self._sync_lock = threading.Lock()
+
+    def issue_token(self, user):
+        """Подписанный токен для пользователя"""
+        now = time.time()
+        payload = {
+            "sub": user["id"],
+            "usr": user["username"],
+            "role": user["role"],
+            # С миллисекундами: токен, выданный сразу после отзыва, действует
+            "iat": round(now, 3),
+            "exp": int(now) + SESSION_TTL,
+            "jti": secrets.token_hex(8),
+        }
+        body = _b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+        return (body + b"." + self._sign(body)).decode("ascii")
+
+    def _sign(self, body):
+        return _b64encode(hmac.new(self.secret, body, hashlib.sha256).digest())
+
+    def _decode(self, token):
+        """Содержимое токена, если подпись верна, иначе None"""
+        try:
+            body, signature = token.encode("ascii").split(b".")
+        except (UnicodeEncodeError, ValueError):
+            return None
+
+        if not hmac.compare_digest(self._sign(body), signature):
+            return None
+
+        try:
+            return json.loads(_b64decode(body))
+        except ValueError:
+            return None
 
     def login(self, username, password):
         user = self.db.verify_user(username, password)
@@ -14,36 +267,111 @@ class Auth:
         if not user:
             return None, "Неверный логин или пароль"
 
-        token = hashlib.sha256(
-            f"{user['id']}{user['username']}{time.time()}".encode()
-        ).hexdigest()
-
-        self.tokens[token] = {
-            "user_id": user["id"],
-            "username": user["username"],
-            "role": user["role"],
-            "expires": time.time() + 86400,
-        }
-
-        return {"token": token, "user": user}, None
+        return {"token": self.issue_token(user), "user": user}, None
 
     def verify_token(self, token):
-        if token not in self.tokens:
+        payload = self._decode(token)
+        if payload is None:
             return None, "Неверный токен"
 
-        token_data = self.tokens[token]
-
-        if time.time() > token_data["expires"]:
-            del self.tokens[token]
+        if time.time() > payload["exp"]:
             return None, "Токен истек"
 
-        return token_data, None
+        self._sync_revocations()
+        if self.denylist.get(payload["jti"]) is not None:
+            return None, "Токен отозван"
+
+        revoked_user = self.denylist.get(f"{USER_KEY_PREFIX}{payload['sub']}")
+        if revoked_user is not None and payload["iat"] <= revoked_user["revoked_at"]:
+            return None, "Токен отозван"
+
+        return {
+            "user_id": payload["sub"],
+            "username": payload["usr"],
+            "role": payload["role"],
+            "expires": payload["exp"],
+        }, None
 
     def logout(self, token):
-        if token in self.tokens:
-            del self.tokens[token]
+        payload = self._decode(token)
+        if payload is not None:
+            self._revoke(payload["jti"], payload["sub"], payload["exp"])
         return True
 
+    def revoke_user(self, user_id):
+        """Отозвать все ранее выданные токены пользователя"""
+        self._revoke(f"{USER_KEY_PREFIX}{user_id}", user_id, time.time() + SESSION_TTL)
+
+    def _revoke(self, key, user_id, expires):
+        revoked_at = time.time()
+        self.db.revoke_token(key, user_id, revoked_at, expires)
+        self.denylist.add(
+            key, {"user_id": user_id, "revoked_at": revoked_at, "expires": expires}
+        )
+        if self.denylist.tokens_of(user_id) > MAX_REVOKED_PER_USER:
+            self._fold(user_id)
+
+    def _fold(self, user_id):
+        """Свернуть старшие отзывы токенов пользователя в отметку.
+
+        Отметка - время самого позднего из свернутых выходов: все
+        свернутые токены выданы раньше него. Отдельными остаются
+        MAX_REVOKED_PER_USER // 2 последних отзывов, так что сворачивание
+        случается раз в столько выходов.
+        """
+        count = self.denylist.tokens_of(user_id) - MAX_REVOKED_PER_USER // 2
+        oldest = self.denylist.oldest_of(user_id, count)
+        if oldest is None:
+            return
+
+        watermark, expires = oldest
+        # База и список берут наибольшую отметку: отзыв всех токенов,
+        # сделанный раньше, не откатывается
+        key = f"{USER_KEY_PREFIX}{user_id}"
+        self.db.revoke_token(key, user_id, watermark, expires)
+        self.denylist.add(
+            key, {"user_id": user_id, "revoked_at": watermark, "expires": expires}
+        )
+
+    def _sync_revocations(self):
+        """Подтянуть отзывы, сделанные другими процессами"""
+        now = time.time()
+        if now - self._synced_at < REVOCATION_SYNC_INTERVAL:
+            return
+        # Синхронизирует один поток, остальные не ждут
+        if not self._sync_lock.acquire(blocking=False):
+            return
+
+        try:
+            for row in self.db.get_revoked_tokens(self._synced_rowid) or []:
+                self.denylist.add(row["key"], row)
+                self._synced_rowid = max(self._synced_rowid, row["rowid"])
+            self._synced_at = now
+        finally:
+            self._sync_lock.release()
+
+    def start(self):
+        """Процессы хеширования паролей и фоновая очистка отозванных токенов.
+
+        Пул процессов запускается первым, пока в процессе меньше потоков.
+        """
+        password_hasher.start()
+        # Удаление из таблицы берет блокировку записи: делаем его в фоне,
+        # а не при проверке токена
+        self.denylist.start_sweeper(on_sweep=self._purge)
+
+    def stop(self):
+        self.denylist.stop_sweeper()
+        password_hasher.stop()
+
+    def _purge(self):
+        """Удалить из базы отзывы с истекшим сроком (поток очистки)"""
+        self.db.purge_revoked_tokens(time.time())
+
+    def get_metrics(self):
+        """Метрики списка отозванных токенов"""
+        return self.denylist.metrics()
+
     def register(self, user_data):
         existing = self.db.get_user_by_username(user_data["username"])
         if existing:
@@ -0,0 +1,76 @@
+import hashlib
+import threading
+
+from compression import compress
+
+
+class CachedResponse:
+    """Готовое тело ответа, его ETag и версия данных, из которых оно собрано"""
+
+    def __init__(self, body, version):
+        self.body = body
+        self.version = version
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self._variants = {}
+
+    def encoded(self, encoding):
+        """Тело и ETag ответа в кодировке encoding (None - без сжатия).
+
+        Сжатый вариант собирается один раз на запись кэша и получает
+        свой ETag: разные байты не должны делить один валидатор.
+        """
+        if encoding is None:
+            return self.body, self.etag
+
+        variant = self._variants.get(encoding)
+        if variant is None:
+            variant = (compress(self.body, encoding), f'{self.etag[:-1]}-{encoding}"')
+            self._variants[encoding] = variant
+        return variant
+
+
+class ResponseCache:
+    """Кэш закодированных ответов для редко меняющихся данных.
+
+    Запись действительна, пока не изменилась версия данных, из которых
+    она собрана. Версию передает вызывающий код, поэтому кэш сам не
+    знает, откуда берутся данные.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, version, build):
+        """Ответ из кэша или новый, собранный функцией build()"""
+        entry = self._entries.get(key)
+        if entry is not None and entry.version == version:
+            return entry
+
+        entry = CachedResponse(build(), version)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def invalidate(self, key=None):
+        """Сбросить одну запись или весь кэш"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+def etag_matches(if_none_match, etag):
+    """Совпадает ли ETag с заголовком If-None-Match"""
+    if not if_none_match:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return etag in candidates or f"W/{etag}" in candidates
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,54 @@
+import os
+import zlib
+
+# Уровень сжатия zlib (1 - быстрее, 9 - плотнее); 0 отключает сжатие
+COMPRESSION_LEVEL = int(os.environ.get("STRAHOVOCHKA_COMPRESSION_LEVEL", "6"))
+# Ответы короче этого размера отдаются без сжатия: выигрыш в байтах
+# меньше заголовков gzip и затрат процессора
+COMPRESSION_MIN_SIZE = int(os.environ.get("STRAHOVOCHKA_COMPRESSION_MIN_SIZE", "1024"))
+
+# Поддерживаемые кодировки в порядке предпочтения при равном q, и
+# параметр wbits для zlib: gzip-обертка или zlib-поток (deflate в HTTP)
+ENCODINGS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+
+def choose_encoding(accept_encoding, level=COMPRESSION_LEVEL):
+    """Кодировка из ENCODINGS, которую клиент принимает с наибольшим q.
+
+    None, если сжатие выключено или клиент не принимает ни одну из них.
+    """
+    if not accept_encoding or level <= 0:
+        return None
+
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            weights[name] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compressor(encoding, level=COMPRESSION_LEVEL):
+    """Объект zlib для сжатия ответа частями"""
+    return zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+
+
+def compress(body, encoding, level=COMPRESSION_LEVEL):
+    """Сжать готовое тело ответа"""
+    stream = compressor(encoding, level)
+    return stream.compress(body) + stream.flush()
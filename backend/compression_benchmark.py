@@ -0,0 +1,152 @@
+import argparse
+import atexit
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+# Замер идет на временной базе, рабочая strahovochka.db не трогается
+_tmp_dir = tempfile.mkdtemp(prefix="strahovochka_bench_")
+atexit.register(shutil.rmtree, _tmp_dir, True)
+os.environ["STRAHOVOCHKA_DB"] = os.path.join(_tmp_dir, "bench.db")
+
+from compression import COMPRESSION_LEVEL, ENCODINGS, compress  # noqa: E402
+from database import Database  # noqa: E402
+
+# Уровни zlib, которые сравниваются с настроенным
+LEVELS = (1, 6, 9)
+
+SUBTYPES = ["легковой", "грузовой", "квартира", "дом", "жизнь", "здоровье"]
+MODELS = ["Toyota Camry", "Лада Веста", "Kia Rio", "Hyundai Solaris", "Skoda Octavia"]
+
+
+def seed(db, users, applications):
+    """Наполнить базу клиентами и заявками, похожими на настоящие"""
+    rng = random.Random(42)
+    conn = sqlite3.connect(db.db_path)
+    conn.executemany(
+        """
+        INSERT INTO users (username, password, role, full_name, email, phone, address)
+        VALUES (?, ?, 'client', ?, ?, ?, ?)
+        """,
+        [
+            (
+                f"bench{i}",
+                "x",
+                f"Клиентов Клиент Клиентович {i}",
+                f"bench{i}@strahovochka.ru",
+                f"+7 900 {i:07d}",
+                f"г. Москва, ул. Тестовая, д. {i % 200}, кв. {i % 97}",
+            )
+            for i in range(users)
+        ],
+    )
+    client_ids = [
+        row[0] for row in conn.execute("SELECT id FROM users WHERE role = 'client'")
+    ]
+    type_ids = [row[0] for row in conn.execute("SELECT id FROM insurance_types")]
+    conn.executemany(
+        """
+        INSERT INTO applications (client_id, insurance_type_id, insurance_subtype, details, status)
+        VALUES (?, ?, ?, ?, 'В процессе')
+        """,
+        [
+            (
+                rng.choice(client_ids),
+                rng.choice(type_ids),
+                rng.choice(SUBTYPES),
+                json.dumps(
+                    {
+                        "model": rng.choice(MODELS),
+                        "year": rng.randint(2000, 2024),
+                        "number": f"А{rng.randint(100, 999)}БВ{rng.randint(10, 199)}",
+                    }
+                ),
+            )
+            for _ in range(applications)
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+
+def route_payloads(db):
+    """Тела ответов маршрутов в том виде, в каком их отдает сервер"""
+    routes = [
+        ("/api/insurance-types", {"insurance_types": db.get_insurance_types()}),
+        ("/api/managers", {"managers": db.get_managers()}),
+        ("/api/me", {"user": db.get_user_by_id(1)}),
+        ("/api/users", {"users": db.get_all_users()}),
+        (
+            "/api/applications (admin)",
+            {"applications": db.get_applications(1, "admin")},
+        ),
+    ]
+    page, next_cursor = db.get_applications_page(1, "admin", 50)
+    routes.append(
+        (
+            "/api/applications?limit=50",
+            {"applications": page, "next_cursor": next_cursor},
+        )
+    )
+    return [
+        (route, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+        for route, data in routes
+    ]
+
+
+def measure(body, encoding, level, min_time=0.2):
+    """Размер сжатого тела и время процессора на одно сжатие, мс"""
+    compressed = compress(body, encoding, level)
+    runs = 0
+    start = time.process_time()
+    while True:
+        compress(body, encoding, level)
+        runs += 1
+        elapsed = time.process_time() - start
+        if elapsed >= min_time:
+            break
+    return len(compressed), elapsed / runs * 1000
+
+
+def run_benchmark(users, applications):
+    db = Database()
+    db.init_db()
+    seed(db, users, applications)
+    print(f"📦 Данные: {users} клиентов, {applications} заявок")
+    print(f"⚙️ Настроенный уровень сжатия: {COMPRESSION_LEVEL}\n")
+
+    levels = sorted(set(LEVELS) | ({COMPRESSION_LEVEL} if COMPRESSION_LEVEL else set()))
+    print(f"{'Маршрут':<30} {'Сжатие':<10} {'Байт':>12} {'Доля':>7} {'ЦП, мс':>9}")
+    print("-" * 72)
+    for route, body in route_payloads(db):
+        print(f"{route:<30} {'нет':<10} {len(body):>12} {'100%':>7} {0:>9.2f}")
+        for encoding in ENCODINGS:
+            for level in levels:
+                size, cpu_ms = measure(body, encoding, level)
+                share = f"{size / len(body):.0%}"
+                label = f"{encoding}-{level}"
+                print(f"{'':<30} {label:<10} {size:>12} {share:>7} {cpu_ms:>9.2f}")
+        print()
+
+    db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Объем ответов API и затраты на их сжатие по маршрутам"
+    )
+    parser.add_argument("--users", type=int, default=1000, help="число клиентов")
+    parser.add_argument("--applications", type=int, default=10000, help="число заявок")
+    args = parser.parse_args()
+
+    print("=" * 50)
+    print("Сжатие ответов API проекта 'Страховочка'")
+    print("=" * 50)
+
+    run_benchmark(args.users, args.applications)
+    sys.exit(0)
@@ -1,35 +1,732 @@
 import sqlite3
 import json
-import hashlib  # Используем стандартную библиотеку
+import os
+import re
 from datetime import datetime
-import hmac
 import base64
+import threading
+import time
+import contextlib
+import queue
+from concurrent.futures import Future
+
+from passwords import HasherBusy, needs_upgrade, password_hasher
+from query_stats import QueryStats
+
+
+DB_PATH = os.environ.get("STRAHOVOCHKA_DB", "strahovochka.db")
+
+# Настройки соединений: сколько ждать блокировку и размер кэша страниц
+BUSY_TIMEOUT_MS = int(os.environ.get("STRAHOVOCHKA_DB_BUSY_TIMEOUT_MS", "5000"))
+CACHE_SIZE_KB = int(os.environ.get("STRAHOVOCHKA_DB_CACHE_KB", "16384"))
+# Размер страницы списков по умолчанию и максимальный
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Групповая фиксация: сколько миллисекунд собирать записи разных
+# запросов в одну транзакцию (0 - каждая запись фиксируется сама)
+GROUP_COMMIT_MS = float(os.environ.get("STRAHOVOCHKA_GROUP_COMMIT_MS", "0"))
+# Больше записей в одну группу не берем, чтобы не держать блокировку долго
+GROUP_COMMIT_MAX_BATCH = 256
+# Сколько id подставлять в один WHERE id IN (...): старые сборки SQLite
+# ограничивают число параметров запроса 999
+IN_CHUNK_SIZE = 500
+# Сколько строк читать из курсора за раз при потоковой выдаче списков
+STREAM_BATCH_SIZE = 256
+
+# Полнотекстовый поиск: сколько слов запроса учитывать
+MAX_SEARCH_TERMS = 10
+# Текст для индекса из details: значения JSON без ключей (модель, год,
+# госномер). Строку, которая не является JSON, индексируем как есть
+_FTS_DETAILS = (
+    "CASE WHEN json_valid({0}) THEN (SELECT group_concat(value, ' ') "
+    "FROM json_tree({0}) WHERE type NOT IN ('object', 'array')) ELSE {0} END"
+)
+
+# Поля details, которые копируются в application_fields для фильтров:
+# выражение SQL от текста details. Некорректный JSON дает NULL, а год
+# берется, только если он записан целым числом
+DETAILS_FIELDS = {
+    "model": "CASE WHEN json_valid({0}) THEN json_extract({0}, '$.model') END",
+    "year": (
+        "CASE WHEN json_valid({0}) THEN CASE json_type({0}, '$.year') "
+        "WHEN 'integer' THEN json_extract({0}, '$.year') END END"
+    ),
+    "number": "CASE WHEN json_valid({0}) THEN json_extract({0}, '$.number') END",
+}
+# Фильтры списка заявок: параметр -> (поле, оператор)
+APPLICATION_FILTERS = {
+    "model": ("model", "="),
+    "number": ("number", "="),
+    "year": ("year", "="),
+    "year_from": ("year", ">="),
+    "year_to": ("year", "<="),
+}
+# Фоновый перенос полей старых заявок: строк за одну транзакцию и пауза
+# между транзакциями, чтобы запись запросов API не ждала блокировку
+BACKFILL_BATCH_SIZE = int(os.environ.get("STRAHOVOCHKA_BACKFILL_BATCH", "1000"))
+BACKFILL_PAUSE = 0.05
+
+
+def _details_fields_select(column):
+    """Выражения полей details через запятую и условие "есть хоть одно" """
+    values = [DETAILS_FIELDS[field].format(column) for field in DETAILS_FIELDS]
+    return ", ".join(values), f"coalesce({', '.join(values)}) IS NOT NULL"
+
+
+_FIELDS_VALUES, _FIELDS_PRESENT = _details_fields_select("NEW.details")
+_BACKFILL_VALUES, _BACKFILL_PRESENT = _details_fields_select("details")
+
+# Сводка application_stats с нуля по всем заявкам (миграция и проверка)
+APPLICATION_STATS_FILL = """
+    INSERT INTO application_stats (status, insurance_type_id, manager_id, count)
+    SELECT status, insurance_type_id, coalesce(manager_id, 0), count(*)
+    FROM applications
+    GROUP BY 1, 2, 3
+"""
+
+
+def _stats_increment(row):
+    return f"""
+        INSERT INTO application_stats (status, insurance_type_id, manager_id, count)
+        VALUES ({row}.status, {row}.insurance_type_id, coalesce({row}.manager_id, 0), 1)
+        ON CONFLICT (status, insurance_type_id, manager_id)
+        DO UPDATE SET count = count + 1;
+    """
+
+
+def _stats_decrement(row):
+    # Пустые группы удаляются, чтобы размер сводки зависел только от
+    # числа встречающихся комбинаций
+    key = (
+        f"status = {row}.status AND insurance_type_id = {row}.insurance_type_id "
+        f"AND manager_id = coalesce({row}.manager_id, 0)"
+    )
+    return f"""
+        UPDATE application_stats SET count = count - 1 WHERE {key};
+        DELETE FROM application_stats WHERE {key} AND count <= 0;
+    """
+
+
+def _change_seq_bump(row):
+    """Тело триггера: следующий номер изменения и время для заявки row"""
+    return f"""
+        UPDATE data_versions SET version = version + 1
+        WHERE name = 'applications';
+        UPDATE applications
+        SET change_seq = (
+                SELECT version FROM data_versions WHERE name = 'applications'
+            ),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = {row}.id;
+    """
+
+
+# Миграции схемы по версиям. Текущая версия хранится в PRAGMA user_version,
+# при запуске применяются только миграции с большим номером
+MIGRATIONS = [
+    (
+        1,
+        [
+            # Список заявок клиента и менеджера с сортировкой по дате
+            "CREATE INDEX IF NOT EXISTS idx_applications_client_created "
+            "ON applications (client_id, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_applications_manager_created "
+            "ON applications (manager_id, created_at)",
+            # Общий список администратора
+            "CREATE INDEX IF NOT EXISTS idx_applications_created "
+            "ON applications (created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_applications_status "
+            "ON applications (status)",
+            # Список менеджеров и список пользователей
+            "CREATE INDEX IF NOT EXISTS idx_users_role_name "
+            "ON users (role, full_name)",
+            "CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_insurance_types_category_name "
+            "ON insurance_types (category, name)",
+        ],
+    ),
+    (
+        2,
+        [
+            # Версии справочных данных для кэша ответов. Триггеры меняют
+            # версию в той же транзакции, что и сами данные
+            """
+            CREATE TABLE IF NOT EXISTS data_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+            """,
+            "INSERT OR IGNORE INTO data_versions (name) "
+            "VALUES ('users'), ('insurance_types')",
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_users_version_insert
+            AFTER INSERT ON users
+            BEGIN
+                UPDATE data_versions SET version = version + 1
+                WHERE name = 'users';
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_users_version_update
+            AFTER UPDATE OF role, full_name, email ON users
+            BEGIN
+                UPDATE data_versions SET version = version + 1
+                WHERE name = 'users';
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_users_version_delete
+            AFTER DELETE ON users
+            BEGIN
+                UPDATE data_versions SET version = version + 1
+                WHERE name = 'users';
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_insurance_types_version_insert
+            AFTER INSERT ON insurance_types
+            BEGIN
+                UPDATE data_versions SET version = version + 1
+                WHERE name = 'insurance_types';
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_insurance_types_version_update
+            AFTER UPDATE ON insurance_types
+            BEGIN
+                UPDATE data_versions SET version = version + 1
+                WHERE name = 'insurance_types';
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_insurance_types_version_delete
+            AFTER DELETE ON insurance_types
+            BEGIN
+                UPDATE data_versions SET version = version + 1
+                WHERE name = 'insurance_types';
+            END
+            """,
+        ],
+    ),
+    (
+        3,
+        [
+            # Отозванные токены: хранятся только до истечения их срока
+            """
+            CREATE TABLE IF NOT EXISTS revoked_tokens (
+                key TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                revoked_at REAL NOT NULL,
+                expires REAL NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires "
+            "ON revoked_tokens (expires)",
+        ],
+    ),
+    (
+        4,
+        [
+            # Полнотекстовый индекс заявок: rowid совпадает с id заявки.
+            # Имя клиента хранится в индексе, поэтому таблица отдельная,
+            # а не external content
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS applications_fts USING fts5(
+                details, insurance_subtype, client_name,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+            """,
+            # Совпадение в модели или госномере важнее, чем в подтипе и имени
+            "INSERT INTO applications_fts (applications_fts, rank) "
+            "VALUES ('rank', 'bm25(2.0, 1.0, 1.0)')",
+            f"""
+            INSERT INTO applications_fts (rowid, details, insurance_subtype, client_name)
+            SELECT a.id, {_FTS_DETAILS.format("a.details")}, a.insurance_subtype, u.full_name
+            FROM applications a LEFT JOIN users u ON a.client_id = u.id
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_applications_fts_insert
+            AFTER INSERT ON applications
+            BEGIN
+                INSERT INTO applications_fts (rowid, details, insurance_subtype, client_name)
+                VALUES (
+                    NEW.id,
+                    {_FTS_DETAILS.format("NEW.details")},
+                    NEW.insurance_subtype,
+                    (SELECT full_name FROM users WHERE id = NEW.client_id)
+                );
+            END
+            """,
+            # Смена статуса индекс не трогает
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_applications_fts_update
+            AFTER UPDATE OF details, insurance_subtype, client_id ON applications
+            BEGIN
+                UPDATE applications_fts SET
+                    details = {_FTS_DETAILS.format("NEW.details")},
+                    insurance_subtype = NEW.insurance_subtype,
+                    client_name = (SELECT full_name FROM users WHERE id = NEW.client_id)
+                WHERE rowid = NEW.id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_applications_fts_delete
+            AFTER DELETE ON applications
+            BEGIN
+                DELETE FROM applications_fts WHERE rowid = OLD.id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_users_fts_update
+            AFTER UPDATE OF full_name ON users
+            BEGIN
+                UPDATE applications_fts SET client_name = NEW.full_name
+                WHERE rowid IN (SELECT id FROM applications WHERE client_id = NEW.id);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_users_fts_delete
+            AFTER DELETE ON users
+            BEGIN
+                UPDATE applications_fts SET client_name = NULL
+                WHERE rowid IN (SELECT id FROM applications WHERE client_id = OLD.id);
+            END
+            """,
+        ],
+    ),
+    (
+        5,
+        [
+            # Поля из details для фильтров списка заявок. Строка есть только
+            # у заявок, где задано хотя бы одно поле
+            """
+            CREATE TABLE IF NOT EXISTS application_fields (
+                application_id INTEGER PRIMARY KEY,
+                model TEXT COLLATE NOCASE,
+                year INTEGER,
+                number TEXT
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_application_fields_model "
+            "ON application_fields (model)",
+            "CREATE INDEX IF NOT EXISTS idx_application_fields_year "
+            "ON application_fields (year)",
+            "CREATE INDEX IF NOT EXISTS idx_application_fields_number "
+            "ON application_fields (number)",
+            # Новые и измененные заявки обновляют триггеры, а существующие
+            # переносятся в фоне порциями до target (см. backfill_application_fields)
+            """
+            CREATE TABLE IF NOT EXISTS background_migrations (
+                name TEXT PRIMARY KEY,
+                position INTEGER NOT NULL DEFAULT 0,
+                target INTEGER NOT NULL
+            )
+            """,
+            "INSERT OR IGNORE INTO background_migrations (name, target) "
+            "SELECT 'application_fields', coalesce(max(id), 0) FROM applications",
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_application_fields_insert
+            AFTER INSERT ON applications
+            BEGIN
+                INSERT OR REPLACE INTO application_fields (application_id, model, year, number)
+                SELECT NEW.id, {_FIELDS_VALUES} WHERE {_FIELDS_PRESENT};
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_application_fields_update
+            AFTER UPDATE OF details ON applications
+            BEGIN
+                DELETE FROM application_fields WHERE application_id = OLD.id;
+                INSERT INTO application_fields (application_id, model, year, number)
+                SELECT NEW.id, {_FIELDS_VALUES} WHERE {_FIELDS_PRESENT};
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_application_fields_delete
+            AFTER DELETE ON applications
+            BEGIN
+                DELETE FROM application_fields WHERE application_id = OLD.id;
+            END
+            """,
+        ],
+    ),
+    (
+        6,
+        [
+            # Сводка для панели администратора: число заявок в каждой
+            # комбинации статуса, типа и менеджера (0 - не назначен).
+            # Триггеры меняют ее в той же транзакции, что и заявки
+            """
+            CREATE TABLE IF NOT EXISTS application_stats (
+                status TEXT NOT NULL,
+                insurance_type_id INTEGER NOT NULL,
+                manager_id INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (status, insurance_type_id, manager_id)
+            ) WITHOUT ROWID
+            """,
+            APPLICATION_STATS_FILL,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_application_stats_insert
+            AFTER INSERT ON applications
+            BEGIN
+                {_stats_increment("NEW")}
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_application_stats_update
+            AFTER UPDATE OF status, insurance_type_id, manager_id ON applications
+            WHEN OLD.status IS NOT NEW.status
+                OR OLD.insurance_type_id IS NOT NEW.insurance_type_id
+                OR OLD.manager_id IS NOT NEW.manager_id
+            BEGIN
+                {_stats_decrement("OLD")}
+                {_stats_increment("NEW")}
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_application_stats_delete
+            AFTER DELETE ON applications
+            BEGIN
+                {_stats_decrement("OLD")}
+            END
+            """,
+        ],
+    ),
+    (
+        7,
+        [
+            # Номер последнего изменения заявок для синхронизации по since=.
+            # Столбец с постоянным значением по умолчанию добавляется без
+            # перезаписи таблицы; старые заявки остаются с change_seq = 0
+            "ALTER TABLE applications ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE applications ADD COLUMN updated_at TIMESTAMP",
+            "CREATE INDEX IF NOT EXISTS idx_applications_change_seq "
+            "ON applications (change_seq)",
+            "INSERT OR IGNORE INTO data_versions (name) VALUES ('applications')",
+            # Удаленные заявки: клиенту с локальной копией нужно знать,
+            # какие строки убрать
+            """
+            CREATE TABLE IF NOT EXISTS application_tombstones (
+                application_id INTEGER PRIMARY KEY,
+                client_id INTEGER,
+                change_seq INTEGER NOT NULL,
+                deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_application_tombstones_seq "
+            "ON application_tombstones (change_seq)",
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_applications_change_insert
+            AFTER INSERT ON applications
+            BEGIN
+                {_change_seq_bump("NEW")}
+            END
+            """,
+            # Условие пропускает собственное UPDATE триггера, которое
+            # меняет change_seq
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_applications_change_update
+            AFTER UPDATE ON applications
+            WHEN OLD.change_seq IS NEW.change_seq
+            BEGIN
+                {_change_seq_bump("NEW")}
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_applications_change_delete
+            AFTER DELETE ON applications
+            BEGIN
+                UPDATE data_versions SET version = version + 1
+                WHERE name = 'applications';
+                INSERT OR REPLACE INTO application_tombstones
+                    (application_id, client_id, change_seq)
+                SELECT OLD.id, OLD.client_id, version
+                FROM data_versions WHERE name = 'applications';
+            END
+            """,
+        ],
+    ),
+    (
+        8,
+        [
+            # Менеджер удаленной заявки: событие об удалении получают те,
+            # кому она была видна. У старых записей NULL - видны всем
+            "ALTER TABLE application_tombstones ADD COLUMN manager_id INTEGER",
+            "DROP TRIGGER IF EXISTS trg_applications_change_delete",
+            """
+            CREATE TRIGGER trg_applications_change_delete
+            AFTER DELETE ON applications
+            BEGIN
+                UPDATE data_versions SET version = version + 1
+                WHERE name = 'applications';
+                INSERT OR REPLACE INTO application_tombstones
+                    (application_id, client_id, manager_id, change_seq)
+                SELECT OLD.id, OLD.client_id, OLD.manager_id, version
+                FROM data_versions WHERE name = 'applications';
+            END
+            """,
+        ],
+    ),
+]
+
+
+def application_visible(row, user_id, user_role):
+    """Видна ли заявка пользователю: те же правила, что в _applications_role_query"""
+    if user_role == "client":
+        return row["client_id"] == user_id
+    if user_role == "manager":
+        return row["manager_id"] in (user_id, None)
+    return True
+
+
+def encode_cursor(created_at, row_id):
+    """Курсор страницы: позиция последней выданной записи"""
+    raw = json.dumps([created_at, row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Разбор курсора страницы, ValueError для некорректного"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise ValueError("Некорректный курсор")
+
+    if not isinstance(created_at, str) or not isinstance(row_id, int):
+        raise ValueError("Некорректный курсор")
+    return created_at, row_id
+
+
+# Список всех пользователей: для полной и для потоковой выдачи
+ALL_USERS_QUERY = """
+    SELECT id, username, role, full_name, email, phone, address, created_at
+    FROM users
+    ORDER BY created_at DESC, id DESC
+"""
+
+
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+def fts_query(text):
+    """Запрос FTS5 из строки поиска: все слова, каждое как префикс.
+
+    Берутся только буквы и цифры, поэтому синтаксис FTS5 (кавычки,
+    NEAR, OR, скобки) из пользовательского ввода не попадает в запрос.
+    None, если слов нет.
+    """
+    terms = re.findall(r"\w+", text)[:MAX_SEARCH_TERMS]
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def _is_write(query):
+    """Изменяет ли запрос данные (по первому ключевому слову)"""
+    words = query.split(None, 1)
+    return bool(words) and words[0].upper() in WRITE_STATEMENTS
+
+
+class GroupCommitWriter:
+    """Поток записи с групповой фиксацией.
+
+    Записи из разных потоков ставятся в очередь. Поток записи берет
+    первую, несколько миллисекунд добирает остальные и выполняет все в
+    одной транзакции, каждую под своей точкой сохранения. Ошибка одной
+    записи откатывает только ее. Один COMMIT (и один fsync) приходится
+    на всю группу, а каждый вызывающий получает свой результат только
+    после фиксации.
+    """
+
+    def __init__(self, database, window, max_batch=GROUP_COMMIT_MAX_BATCH):
+        self.database = database
+        self.window = window
+        self.max_batch = max_batch
+        self.groups = 0
+        self.statements = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, query, params=None, fetchone=False, fetchall=False):
+        """Выполнить запись в ближайшей группе и дождаться фиксации"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((query, params, fetchone, fetchall, future))
+        return future.result()
+
+    def _ensure_started(self):
+        # Поток не переживает fork: в дочернем процессе запускаем свой
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="db-group-commit", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Зафиксировать то, что уже в очереди, и остановить поток"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            thread.join()
+
+    def _collect(self, first):
+        """Первая запись и те, что успели прийти за окно сбора"""
+        group = [first]
+        deadline = time.monotonic() + self.window
+        while len(group) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=max(remaining, 0))
+            except queue.Empty:
+                break
+            if item is None:
+                # Остановка: группу дописываем, поток завершится следом
+                self._queue.put(None)
+                break
+            group.append(item)
+        return group
+
+    def _run(self):
+        conn = self.database.conn
+        # Запись подтверждается только после fsync; групповая фиксация
+        # делит его стоимость на всю группу
+        conn.execute("PRAGMA synchronous = FULL")
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            self._commit_group(conn, self._collect(first))
+        self.database.release_connection()
+
+    def _commit_group(self, conn, group):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for query, params, fetchone, fetchall, _ in group:
+                results.append(self._execute(conn, query, params, fetchone, fetchall))
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            print(f"❌ Ошибка групповой фиксации: {e}")
+            results = [None] * len(group)
+
+        self.groups += 1
+        self.statements += len(group)
+        for item, result in zip(group, results):
+            item[-1].set_result(result)
+
+    def _execute(self, conn, query, params, fetchone, fetchall):
+        """Одна запись группы под своей точкой сохранения"""
+        conn.execute("SAVEPOINT group_item")
+        try:
+            cursor = conn.execute(query, params or ())
+            if fetchone:
+                row = cursor.fetchone()
+                result = dict(row) if row else None
+            elif fetchall:
+                result = [dict(row) for row in cursor.fetchall()]
+            else:
+                result = None
+            cursor.close()
+        except sqlite3.Error as e:
+            conn.execute("ROLLBACK TO group_item")
+            conn.execute("RELEASE group_item")
+            print(f"❌ Ошибка SQL: {e}")
+            print(f"Запрос: {query}")
+            return None
+
+        conn.execute("RELEASE group_item")
+        return result
 
 
 class Database:
-    def __init__(self, db_path="strahovochka.db"):
+    def __init__(self, db_path=DB_PATH, group_commit_ms=GROUP_COMMIT_MS):
         self.db_path = db_path
-        self.conn = None
+        # Пул соединений: у каждого потока свое соединение с SQLite
+        self._local = threading.local()
+        self._pool = {}
+        self._pool_lock = threading.Lock()
+        self._writer = None
+        # Время каждого SQL-запроса и журнал медленных
+        self.query_stats = QueryStats()
+        # Фоновый перенос полей details старых заявок
+        self._fields_ready = False
+        self._backfill_stop = threading.Event()
+        self._backfill_thread = None
+        if group_commit_ms > 0:
+            self._writer = GroupCommitWriter(self, group_commit_ms / 1000)
         self.connect()
         self.init_db()
 
+    @property
+    def conn(self):
+        """Соединение текущего потока (открывается при первом обращении)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open_connection()
+        return conn
+
+    def _open_connection(self):
+        """Открыть соединение для текущего потока и добавить его в пул"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        # WAL: читатели не ждут писателя, а писатель не ждет читателей
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+
+        current = threading.current_thread()
+        with self._pool_lock:
+            # Соединения завершившихся потоков больше никому не нужны
+            for thread in [t for t in self._pool if not t.is_alive()]:
+                self._pool.pop(thread).close()
+            self._pool[current] = conn
+
+        self._local.conn = conn
+        return conn
+
     def connect(self):
         """Подключение к базе данных SQLite"""
         try:
-            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            self.conn.row_factory = sqlite3.Row
+            self.conn
             print("✅ Подключение к SQLite успешно!")
         except Exception as e:
             print(f"❌ Ошибка подключения: {e}")
 
+    def release_connection(self):
+        """Закрыть соединение текущего потока"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+
+        with self._pool_lock:
+            self._pool.pop(threading.current_thread(), None)
+        self._local.conn = None
+        conn.close()
+
     def _hash_password(self, password):
-        """Хеширование пароля с использованием SHA256"""
-        salt = "strahovochka_salt_2024"
-        return hashlib.sha256((password + salt).encode()).hexdigest()
+        """Хеширование пароля (PBKDF2 со своей солью, в пуле процессов)"""
+        return password_hasher.hash(password)
 
     def _check_password(self, password, hashed):
         """Проверка пароля"""
-        return self._hash_password(password) == hashed
+        return password_hasher.verify(password, hashed)
 
     def init_db(self):
         """Инициализация базы данных и создание таблиц"""
@@ -87,6 +784,9 @@ class Database:
             """
             )
 
+            self.conn.commit()
+            self._migrate()
+
             # Добавляем типы страховок если их нет
             self._seed_data()
 
@@ -96,6 +796,33 @@ class Database:
         except Exception as e:
             print(f"❌ Ошибка инициализации БД: {e}")
 
+    def _migrate(self):
+        """Применение миграций схемы, которых еще нет в базе"""
+        conn = self.conn
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+        for target, statements in MIGRATIONS:
+            if target <= version:
+                continue
+
+            try:
+                # DDL не открывает транзакцию сама: начинаем ее явно,
+                # чтобы миграция и номер версии применились вместе
+                conn.execute("BEGIN")
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {target}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+            print(f"✅ Схема БД обновлена до версии {target}")
+
+    def schema_version(self):
+        """Текущая версия схемы БД"""
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
     def _seed_data(self):
         """Заполнение начальными данными"""
         cursor = self.conn.cursor()
@@ -131,41 +858,24 @@ class Database:
                 ins_type,
             )
 
-        # Хеш пароля 'password123'
-        hashed_password = self._hash_password("password123")
-
-        # Тестовые пользователи
+        # Тестовые пользователи с паролем 'password123'
         users = [
-            (
-                "admin",
-                hashed_password,
-                "admin",
-                "Администратор Системы",
-                "admin@strahovochka.ru",
-            ),
-            (
-                "manager1",
-                hashed_password,
-                "manager",
-                "Иванов Иван Иванович",
-                "manager@strahovochka.ru",
-            ),
-            (
-                "client1",
-                hashed_password,
-                "client",
-                "Петров Петр Петрович",
-                "client@mail.ru",
-            ),
+            ("admin", "admin", "Администратор Системы", "admin@strahovochka.ru"),
+            ("manager1", "manager", "Иванов Иван Иванович", "manager@strahovochka.ru"),
+            ("client1", "client", "Петров Петр Петрович", "client@mail.ru"),
         ]
 
-        for user in users:
+        for username, role, full_name, email in users:
+            # Хеш дорогой: считаем его только для недостающих пользователей
+            cursor.execute("SELECT 1 FROM users WHERE username = ?", (username,))
+            if cursor.fetchone():
+                continue
             cursor.execute(
                 """
                 INSERT OR IGNORE INTO users (username, password, role, full_name, email)
                 VALUES (?, ?, ?, ?, ?)
             """,
-                user,
+                (username, self._hash_password("password123"), role, full_name, email),
             )
 
         # Тестовые заявки
@@ -191,10 +901,54 @@ class Database:
                 ),
             )
 
+    def db_time(self):
+        """Сколько секунд текущий поток провел в запросах к базе.
+
+        Счетчик только растет: время запроса к API - разность значений
+        до и после обработки.
+        """
+        return getattr(self._local, "db_time", 0.0)
+
+    def _add_db_time(self, seconds):
+        self._local.db_time = getattr(self._local, "db_time", 0.0) + seconds
+
+    def _record_query(self, query, params, seconds):
+        """Учесть время запроса; медленный записать в журнал с планом"""
+        if not self.query_stats.record(query, seconds):
+            return
+        plan = self.query_stats.known_plan(query)
+        if plan is None:
+            plan = self._explain(query, params)
+        self.query_stats.log_slow(query, params, seconds, plan)
+
+    def _explain(self, query, params):
+        """Строки EXPLAIN QUERY PLAN для запроса"""
+        try:
+            rows = self.conn.execute("EXPLAIN QUERY PLAN " + query, params or ())
+            return [row[3] for row in rows]
+        except sqlite3.Error as e:
+            return [f"план недоступен: {e}"]
+
     def execute_query(self, query, params=None, fetchone=False, fetchall=False):
         """Выполнение SQL запроса"""
+        start = time.perf_counter()
         try:
-            cursor = self.conn.cursor()
+            return self._execute_query(query, params, fetchone, fetchall)
+        finally:
+            elapsed = time.perf_counter() - start
+            # Внутри transaction() время запроса учитывает сама транзакция
+            if not getattr(self._local, "transaction", False):
+                self._add_db_time(elapsed)
+            self._record_query(query, params, elapsed)
+
+    def _execute_query(self, query, params, fetchone, fetchall):
+        in_transaction = getattr(self._local, "transaction", False)
+        if self._writer is not None and not in_transaction and _is_write(query):
+            return self._writer.submit(query, params, fetchone, fetchall)
+
+        conn = self.conn
+        try:
+            cursor = conn.cursor()
 
             if params:
                 cursor.execute(query, params)
@@ -209,16 +963,81 @@ class Database:
                 result = [dict(row) for row in rows]
             else:
                 result = None
-                self.conn.commit()
 
             cursor.close()
+            # INSERT/UPDATE ... RETURNING тоже открывают транзакцию:
+            # фиксируем сразу, чтобы не держать блокировку записи.
+            # Внутри transaction() фиксирует сама транзакция
+            if conn.in_transaction and not in_transaction:
+                conn.commit()
             return result
 
         except Exception as e:
+            if in_transaction:
+                raise
+            if conn.in_transaction:
+                conn.rollback()
             print(f"❌ Ошибка SQL: {e}")
             print(f"Запрос: {query}")
             return None
 
+    @contextlib.contextmanager
+    def transaction(self, read_only=False):
+        """Явная транзакция: изменения внутри фиксируются одним коммитом.
+
+        BEGIN IMMEDIATE сразу берет блокировку записи, поэтому ожидание
+        других писателей происходит до первой вставки, а не посреди.
+        read_only=True начинает BEGIN DEFERRED без блокировки записи: все
+        чтения блока видят один снимок базы, а писатели (в режиме WAL) не
+        ждут. execute_query внутри блока не фиксирует и не подавляет
+        ошибки: любая ошибка откатывает всю транзакцию. Все время блока
+        считается временем базы (db_time).
+        """
+        start = time.perf_counter()
+        conn = self.conn
+        conn.execute("BEGIN DEFERRED" if read_only else "BEGIN IMMEDIATE")
+        self._local.transaction = True
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+        finally:
+            self._local.transaction = False
+            self._add_db_time(time.perf_counter() - start)
+
+    def iter_query(self, query, params=None, batch_size=STREAM_BATCH_SIZE):
+        """Строки результата SELECT по одной, без загрузки всего списка.
+
+        Из курсора читается по batch_size строк, поэтому память не растет
+        с размером таблицы. Ошибка SQL не подавляется: вызывающий должен
+        узнать о ней до того, как начнет отдавать ответ.
+        """
+        start = time.perf_counter()
+        total = 0.0
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(query, params or ())
+            while True:
+                rows = [dict(row) for row in cursor.fetchmany(batch_size)]
+                # Время между порциями тратит вызывающий, а не база
+                elapsed = time.perf_counter() - start
+                self._add_db_time(elapsed)
+                total += elapsed
+                if not rows:
+                    break
+                yield from rows
+                start = time.perf_counter()
+            self._record_query(query, params, total)
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка SQL: {e}")
+            print(f"Запрос: {query}")
+            raise
+        finally:
+            cursor.close()
+
     def get_user_by_username(self, username):
         """Получить пользователя по логину"""
         return self.execute_query(
@@ -262,9 +1081,28 @@ class Database:
         """Проверка логина и пароля"""
         user = self.get_user_by_username(username)
         if not user:
+            # Без PBKDF2 ответ для неизвестного логина приходил бы сразу,
+            # и по времени ответа было бы видно, какие логины существуют
+            self._check_password(password, password_hasher.dummy_hash)
             return None
 
         if self._check_password(password, user["password"]):
+            # Хеш старого формата или с устаревшими параметрами
+            # пересчитываем, пока пароль известен. Это необязательная
+            # работа: при занятом пуле вход проходит, пересчет - при
+            # следующем входе
+            if needs_upgrade(user["password"], password_hasher.iterations):
+                try:
+                    self.execute_query(
+                        "UPDATE users SET password = ? WHERE id = ?",
+                        (self._hash_password(password), user["id"]),
+                    )
+                except HasherBusy:
+                    print(
+                        f"⚠️ Пересчет хеша пароля пользователя {user['id']} "
+                        "отложен: пул хеширования занят"
+                    )
+
             # Убираем пароль из данных пользователя
             user_dict = dict(user)
             user_dict.pop("password", None)
@@ -272,41 +1110,258 @@ class Database:
 
         return None
 
-    def get_applications(self, user_id=None, user_role=None):
-        """Получить заявки с фильтрацией по роли"""
+    def _applications_query(
+        self, user_id=None, user_role=None, filters=None, limited=True
+    ):
+        """SELECT заявок и условия видимости для роли и фильтров"""
+        select, conditions, params = self._applications_role_query(
+            user_id, user_role, limited
+        )
+        if filters:
+            filter_conditions, filter_params = self._filter_conditions(filters)
+            conditions = conditions + filter_conditions
+            params = params + filter_params
+        return select, conditions, params
+
+    def _filter_conditions(self, filters):
+        """Условия WHERE для фильтров по полям details (APPLICATION_FILTERS)"""
+        conditions, params = [], []
+        if self.application_fields_ready():
+            for name, value in filters.items():
+                field, operator = APPLICATION_FILTERS[name]
+                conditions.append(f"{field} {operator} ?")
+                params.append(value)
+            subquery = "SELECT application_id FROM application_fields WHERE "
+            return [f"a.id IN ({subquery}{' AND '.join(conditions)})"], params
+
+        # Пока старые заявки не перенесены, фильтруем по самому details:
+        # медленнее, но результат тот же
+        for name, value in filters.items():
+            field, operator = APPLICATION_FILTERS[name]
+            expression = DETAILS_FIELDS[field].format("a.details")
+            collate = " COLLATE NOCASE" if field == "model" else ""
+            conditions.append(f"({expression}){collate} {operator} ?")
+            params.append(value)
+        return conditions, params
+
+    def _applications_role_query(self, user_id=None, user_role=None, limited=True):
+        """SELECT заявок и условия видимости для роли пользователя.
+
+        limited=False - запрос всего списка без LIMIT: для него условия
+        менеджера должны использовать индекс по manager_id.
+        """
         if user_role == "client":
-            query = """
+            select = """
                 SELECT a.*, it.name as insurance_name, u.full_name as manager_name
                 FROM applications a
                 LEFT JOIN insurance_types it ON a.insurance_type_id = it.id
                 LEFT JOIN users u ON a.manager_id = u.id
-                WHERE a.client_id = ?
-                ORDER BY a.created_at DESC
             """
-            return self.execute_query(query, (user_id,), fetchall=True)
+            return select, ["a.client_id = ?"], [user_id]
 
         elif user_role == "manager":
-            query = """
+            select = """
                 SELECT a.*, it.name as insurance_name, u.full_name as client_name
                 FROM applications a
                 LEFT JOIN insurance_types it ON a.insurance_type_id = it.id
                 LEFT JOIN users u ON a.client_id = u.id
-                WHERE a.manager_id = ? OR a.manager_id IS NULL
-                ORDER BY a.created_at DESC
             """
-            return self.execute_query(query, (user_id,), fetchall=True)
+            if not limited:
+                # Весь список: MULTI-INDEX OR читает только заявки менеджера
+                # и неназначенные, а не всю таблицу, и сортирует их
+                return select, ["(a.manager_id = ? OR a.manager_id IS NULL)"], [user_id]
+
+            # Унарный плюс отключает индекс по manager_id: обход индекса по
+            # created_at сразу дает нужный порядок и останавливается на LIMIT,
+            # а MULTI-INDEX OR сортировал бы все найденные заявки
+            condition = "(+a.manager_id = ? OR +a.manager_id IS NULL)"
+            return select, [condition], [user_id]
 
         else:  # admin
-            query = """
+            select = """
                 SELECT a.*, it.name as insurance_name, 
                        uc.full_name as client_name, um.full_name as manager_name
                 FROM applications a
                 LEFT JOIN insurance_types it ON a.insurance_type_id = it.id
                 LEFT JOIN users uc ON a.client_id = uc.id
                 LEFT JOIN users um ON a.manager_id = um.id
-                ORDER BY a.created_at DESC
             """
-            return self.execute_query(query, fetchall=True)
+            return select, [], []
+
+    def _fetch_page(self, select, conditions, params, prefix, limit, cursor):
+        """Страница списка по ключу (created_at, id), от новых к старым.
+
+        Вместо OFFSET продолжаем с последней выданной записи, поэтому
+        стоимость страницы не зависит от ее номера.
+        """
+        conditions = list(conditions)
+        params = list(params)
+
+        if cursor:
+            created_at, row_id = decode_cursor(cursor)
+            conditions.append(f"({prefix}created_at, {prefix}id) < (?, ?)")
+            params.extend([created_at, row_id])
+
+        query = select
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" ORDER BY {prefix}created_at DESC, {prefix}id DESC LIMIT ?"
+        # Одна лишняя строка показывает, есть ли следующая страница
+        params.append(limit + 1)
+
+        rows = self.execute_query(query, tuple(params), fetchall=True)
+        if rows is None:
+            return None, None
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+
+        return rows, next_cursor
+
+    def _applications_list_query(self, user_id=None, user_role=None, filters=None):
+        """Запрос полного списка заявок, видимых пользователю"""
+        select, conditions, params = self._applications_query(
+            user_id, user_role, filters, limited=False
+        )
+
+        query = select
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY a.created_at DESC, a.id DESC"
+        return query, tuple(params)
+
+    def get_applications(self, user_id=None, user_role=None, filters=None):
+        """Получить заявки с фильтрацией по роли и полям details"""
+        query, params = self._applications_list_query(user_id, user_role, filters)
+        return self.execute_query(query, params, fetchall=True)
+
+    def iter_applications(self, user_id=None, user_role=None, filters=None):
+        """Заявки с фильтрацией по роли, по одной (для потоковой выдачи)"""
+        query, params = self._applications_list_query(user_id, user_role, filters)
+        return self.iter_query(query, params)
+
+    def get_applications_page(
+        self, user_id=None, user_role=None, limit=PAGE_SIZE, cursor=None, filters=None
+    ):
+        """Страница заявок с фильтрацией по роли и курсор следующей"""
+        select, conditions, params = self._applications_query(
+            user_id, user_role, filters
+        )
+        return self._fetch_page(select, conditions, params, "a.", limit, cursor)
+
+    def search_applications(
+        self, user_id=None, user_role=None, text="", limit=PAGE_SIZE, offset=0
+    ):
+        """Поиск заявок по модели, госномеру, подтипу и имени клиента.
+
+        Заявки упорядочены по релевантности (bm25) и видны по тем же
+        правилам, что и в списке. Возвращает (заявки, смещение следующей
+        страницы или None); None вместо списка - ошибка запроса.
+        """
+        match = fts_query(text)
+        if match is None:
+            return [], None
+
+        select, conditions, params = self._applications_query(user_id, user_role)
+        # Без алиаса: FTS5 понимает MATCH только по имени таблицы
+        query = f"""
+            {select}
+            JOIN applications_fts ON applications_fts.rowid = a.id
+            WHERE {" AND ".join(["applications_fts MATCH ?"] + conditions)}
+            ORDER BY applications_fts.rank
+            LIMIT ? OFFSET ?
+        """
+        rows = self.execute_query(
+            query, [match] + params + [limit + 1, offset], fetchall=True
+        )
+        if rows is None:
+            return None, None
+        if len(rows) > limit:
+            return rows[:limit], offset + limit
+        return rows, None
+
+    def get_application_changes(
+        self, user_id=None, user_role=None, since=0, limit=MAX_PAGE_SIZE
+    ):
+        """Заявки, измененные после номера since, и id исчезнувших.
+
+        Возвращает {"applications", "removed", "seq", "more"} или None при
+        ошибке запроса. seq - номер, с которого продолжать следующую
+        синхронизацию; more=True, если изменений больше limit и нужно
+        сразу запросить продолжение.
+        """
+        seq = self.get_data_version("applications")
+        if seq is None:
+            return None
+
+        # Номер читается до строк: изменения, зафиксированные между двумя
+        # запросами, попадут в следующую синхронизацию, а не потеряются
+        select, conditions, params = self._applications_query(user_id, user_role)
+        query = f"""
+            {select}
+            WHERE {" AND ".join(conditions + ["a.change_seq > ?", "a.change_seq <= ?"])}
+            ORDER BY a.change_seq
+            LIMIT ?
+        """
+        rows = self.execute_query(
+            query, params + [since, seq, limit + 1], fetchall=True
+        )
+        if rows is None:
+            return None
+
+        more = len(rows) > limit
+        if more:
+            rows = rows[:limit]
+            seq = rows[-1]["change_seq"]
+
+        removed = self.get_application_tombstones(since, seq, user_id, user_role)
+        if removed is None:
+            return None
+        removed = [row["application_id"] for row in removed]
+
+        if user_role == "manager":
+            # Заявка, которую взял другой менеджер, для этого пропадает
+            hidden = self.execute_query(
+                """
+                SELECT id FROM applications
+                WHERE change_seq > ? AND change_seq <= ?
+                    AND manager_id IS NOT NULL AND manager_id != ?
+                """,
+                (since, seq, user_id),
+                fetchall=True,
+            )
+            if hidden is None:
+                return None
+            removed += [row["id"] for row in hidden]
+
+        return {
+            "applications": rows,
+            "removed": sorted(removed),
+            "seq": seq,
+            "more": more,
+        }
+
+    def get_application_tombstones(self, since, seq, user_id=None, user_role=None):
+        """Заявки, удаленные после since и не позже seq.
+
+        Для клиента и менеджера - только те, что были им видны (правила
+        application_visible); без роли - все.
+        """
+        query = """
+            SELECT application_id, client_id, manager_id, change_seq
+            FROM application_tombstones
+            WHERE change_seq > ? AND change_seq <= ?
+        """
+        params = [since, seq]
+        if user_role == "client":
+            query += " AND client_id = ?"
+            params.append(user_id)
+        elif user_role == "manager":
+            query += " AND (manager_id = ? OR manager_id IS NULL)"
+            params.append(user_id)
+        return self.execute_query(query, params, fetchall=True)
 
     def create_application(self, application_data):
         """Создать новую заявку"""
@@ -325,6 +1380,42 @@ class Database:
             fetchone=True,
         )
 
+    def create_applications(self, client_id, applications):
+        """Создать заявки одной транзакцией и вернуть их id по порядку.
+
+        Все строки вставляются одним executemany и фиксируются одним
+        коммитом. Пока транзакция держит блокировку записи, AUTOINCREMENT
+        выдает id подряд, поэтому их можно восстановить по последнему.
+        """
+        rows = [
+            (
+                client_id,
+                application["insurance_type_id"],
+                application["insurance_subtype"],
+                json.dumps(application["details"]),
+            )
+            for application in applications
+        ]
+        if not rows:
+            return []
+
+        query = """
+            INSERT INTO applications (client_id, insurance_type_id, insurance_subtype, details, status)
+            VALUES (?, ?, ?, ?, 'В процессе')
+        """
+        try:
+            with self.transaction() as conn:
+                start = time.perf_counter()
+                conn.executemany(query, rows)
+                # Весь пакет учитывается как одно выполнение запроса
+                self._record_query(query, rows[0], time.perf_counter() - start)
+                last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка SQL: {e}")
+            return None
+
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+
     def update_application_status(self, app_id, status, manager_id=None):
         """Обновить статус заявки"""
         query = """
@@ -342,16 +1433,58 @@ class Database:
 
         return self.execute_query(query, tuple(params), fetchone=True)
 
+    def update_applications_status(self, updates, manager_id, own_only=False):
+        """Сменить статусы нескольких заявок одной транзакцией.
+
+        updates - пары (id заявки, новый статус). При own_only меняются
+        только заявки этого менеджера и еще не назначенные. Возвращает
+        измененные строки или None при ошибке.
+        """
+        by_status = {}
+        for app_id, status in updates:
+            by_status.setdefault(status, []).append(app_id)
+
+        processed_at = datetime.now().isoformat()
+        changed = []
+        try:
+            with self.transaction():
+                for status, ids in by_status.items():
+                    for start in range(0, len(ids), IN_CHUNK_SIZE):
+                        chunk = ids[start : start + IN_CHUNK_SIZE]
+                        query = f"""
+                            UPDATE applications
+                            SET status = ?, processed_at = ?, manager_id = ?
+                            WHERE id IN ({", ".join("?" * len(chunk))})
+                        """
+                        params = [status, processed_at, manager_id, *chunk]
+                        if own_only:
+                            query += " AND (manager_id = ? OR manager_id IS NULL)"
+                            params.append(manager_id)
+                        query += " RETURNING id, status, manager_id, processed_at"
+                        changed.extend(
+                            self.execute_query(query, tuple(params), fetchall=True)
+                        )
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка SQL: {e}")
+            return None
+
+        return sorted(changed, key=lambda row: row["id"])
+
     def get_all_users(self):
         """Получить всех пользователей"""
-        return self.execute_query(
-            """
-            SELECT id, username, role, full_name, email, phone, address, created_at 
-            FROM users 
-            ORDER BY created_at DESC
-        """,
-            fetchall=True,
-        )
+        return self.execute_query(ALL_USERS_QUERY, fetchall=True)
+
+    def iter_all_users(self):
+        """Все пользователи по одному (для потоковой выдачи)"""
+        return self.iter_query(ALL_USERS_QUERY)
+
+    def get_all_users_page(self, limit=PAGE_SIZE, cursor=None):
+        """Страница пользователей и курсор следующей"""
+        select = """
+            SELECT id, username, role, full_name, email, phone, address, created_at
+            FROM users
+        """
+        return self._fetch_page(select, [], [], "", limit, cursor)
 
     def get_managers(self):
         """Получить всех менеджеров"""
@@ -371,14 +1504,286 @@ class Database:
             "SELECT * FROM insurance_types ORDER BY category, name", fetchall=True
         )
 
+    def get_data_version(self, name):
+        """Версия данных ('users', 'insurance_types', 'applications')"""
+        row = self.execute_query(
+            "SELECT version FROM data_versions WHERE name = ?", (name,), fetchone=True
+        )
+        return row["version"] if row else None
+
+    def revoke_token(self, key, user_id, revoked_at, expires):
+        """Добавить токен (или все токены пользователя) в список отозванных.
+
+        Для уже отозванного ключа остаются наибольшие revoked_at и expires.
+        REPLACE дает строке новый rowid, и другие процессы ее подтянут.
+        """
+        return self.execute_query(
+            """
+            INSERT OR REPLACE INTO revoked_tokens (key, user_id, revoked_at, expires)
+            SELECT ?, ?, max(?, coalesce(old.revoked_at, 0)),
+                max(?, coalesce(old.expires, 0))
+            FROM (SELECT 1) LEFT JOIN revoked_tokens old ON old.key = ?
+        """,
+            (key, user_id, revoked_at, expires, key),
+        )
+
+    def get_revoked_tokens(self, after_rowid=0):
+        """Действующие отзывы, добавленные после записи after_rowid"""
+        return self.execute_query(
+            """
+            SELECT rowid, key, user_id, revoked_at, expires
+            FROM revoked_tokens
+            WHERE rowid > ?
+            ORDER BY rowid
+        """,
+            (after_rowid,),
+            fetchall=True,
+        )
+
+    def purge_revoked_tokens(self, now):
+        """Удалить отзывы токенов, срок которых уже истек"""
+        return self.execute_query(
+            "DELETE FROM revoked_tokens WHERE expires < ?", (now,)
+        )
+
     def delete_user(self, user_id):
         """Удалить пользователя"""
-        return self.execute_query("DELETE FROM users WHERE id = ?", (user_id,))
+        return self.execute_query(
+            "DELETE FROM users WHERE id = ? RETURNING id", (user_id,), fetchone=True
+        )
+
+    def get_application_stats(self):
+        """Число заявок по статусам, типам страховки и менеджерам.
+
+        Читается только сводка application_stats, поэтому время не
+        зависит от числа заявок. None при ошибке запроса.
+        """
+        rows = self.execute_query(
+            """
+            SELECT application_stats.*,
+                   it.name AS insurance_name, u.full_name AS manager_name
+            FROM application_stats
+            LEFT JOIN insurance_types it
+                ON application_stats.insurance_type_id = it.id
+            LEFT JOIN users u ON application_stats.manager_id = u.id
+            """,
+            fetchall=True,
+        )
+        if rows is None:
+            return None
+
+        by_status = {}
+        by_type = {}
+        by_manager = {}
+        for row in rows:
+            count = row["count"]
+            by_status[row["status"]] = by_status.get(row["status"], 0) + count
+
+            item = by_type.setdefault(
+                row["insurance_type_id"],
+                {
+                    "id": row["insurance_type_id"],
+                    "name": row["insurance_name"],
+                    "count": 0,
+                },
+            )
+            item["count"] += count
+
+            manager_id = row["manager_id"] or None
+            item = by_manager.setdefault(
+                manager_id,
+                {"id": manager_id, "full_name": row["manager_name"], "count": 0},
+            )
+            item["count"] += count
+
+        return {
+            "total": sum(by_status.values()),
+            "by_status": by_status,
+            "by_insurance_type": sorted(by_type.values(), key=lambda item: item["id"]),
+            "by_manager": sorted(by_manager.values(), key=lambda item: -item["count"]),
+        }
+
+    def get_application_status_counts(self, user_id, user_role):
+        """Число видимых пользователю заявок по статусам: {"total", "by_status"}.
+
+        Менеджеру считаем по сводке application_stats (его заявки и
+        неназначенные), клиенту - по индексу своих заявок. None при ошибке.
+        """
+        if user_role == "manager":
+            rows = self.execute_query(
+                """
+                SELECT status, sum(count) AS count FROM application_stats
+                WHERE manager_id IN (?, 0)
+                GROUP BY status
+                """,
+                (user_id,),
+                fetchall=True,
+            )
+        else:
+            rows = self.execute_query(
+                """
+                SELECT status, count(*) AS count FROM applications
+                WHERE client_id = ?
+                GROUP BY status
+                """,
+                (user_id,),
+                fetchall=True,
+            )
+        if rows is None:
+            return None
+
+        by_status = {row["status"]: row["count"] for row in rows}
+        return {"total": sum(by_status.values()), "by_status": by_status}
+
+    def check_application_stats(self, rebuild=True):
+        """Сверить сводку application_stats с заявками.
+
+        Считает группы заново по всей таблице applications (это долго,
+        поэтому только по запросу администратора) и возвращает список
+        расхождений. Пересчет идет в снимке для чтения и не держит
+        блокировку записи. Если расхождения есть и rebuild=True, сводка
+        пересобирается с нуля уже в транзакции записи - по данным на ее
+        начало, так что изменения после снимка тоже учтены.
+        """
+        key = ("status", "insurance_type_id", "manager_id")
+        with self.transaction(read_only=True):
+            expected = {
+                tuple(row[name] for name in key): row["count"]
+                for row in self.execute_query(
+                    """
+                    SELECT status, insurance_type_id,
+                           coalesce(manager_id, 0) AS manager_id, count(*) AS count
+                    FROM applications
+                    GROUP BY 1, 2, 3
+                    """,
+                    fetchall=True,
+                )
+            }
+            actual = {
+                tuple(row[name] for name in key): row["count"]
+                for row in self.execute_query(
+                    "SELECT status, insurance_type_id, manager_id, count "
+                    "FROM application_stats",
+                    fetchall=True,
+                )
+            }
+
+            mismatches = [
+                dict(
+                    zip(key, group),
+                    expected=expected.get(group, 0),
+                    actual=actual.get(group, 0),
+                )
+                for group in sorted(set(expected) | set(actual), key=str)
+                if expected.get(group, 0) != actual.get(group, 0)
+            ]
+        if mismatches and rebuild:
+            with self.transaction():
+                self.execute_query("DELETE FROM application_stats")
+                self.execute_query(APPLICATION_STATS_FILL)
+        return mismatches
+
+    def application_fields_ready(self):
+        """Перенесены ли поля details всех заявок в application_fields"""
+        if not self._fields_ready:
+            row = self.execute_query(
+                "SELECT position >= target AS done FROM background_migrations "
+                "WHERE name = 'application_fields'",
+                fetchone=True,
+            )
+            self._fields_ready = bool(row and row["done"])
+        return self._fields_ready
+
+    def backfill_application_fields(self, batch_size=BACKFILL_BATCH_SIZE):
+        """Перенести поля details следующей порции старых заявок.
+
+        Каждая порция - отдельная короткая транзакция, а позиция
+        сохраняется в background_migrations, поэтому перенос можно
+        прервать и продолжить после перезапуска. Заявки, которые успел
+        обновить триггер, не перезаписываются. True, когда все перенесено.
+        """
+        with self.transaction():
+            state = self.execute_query(
+                "SELECT position, target FROM background_migrations "
+                "WHERE name = 'application_fields'",
+                fetchone=True,
+            )
+            if state is None or state["position"] >= state["target"]:
+                return True
+
+            row = self.execute_query(
+                """
+                SELECT max(id) AS last_id FROM (
+                    SELECT id FROM applications WHERE id > ? AND id <= ?
+                    ORDER BY id LIMIT ?
+                )
+                """,
+                (state["position"], state["target"], batch_size),
+                fetchone=True,
+            )
+            end = row["last_id"] if row["last_id"] is not None else state["target"]
+            self.execute_query(
+                f"""
+                INSERT OR IGNORE INTO application_fields (application_id, model, year, number)
+                SELECT id, {_BACKFILL_VALUES} FROM applications
+                WHERE id > ? AND id <= ? AND {_BACKFILL_PRESENT}
+                """,
+                (state["position"], end),
+            )
+            self.execute_query(
+                "UPDATE background_migrations SET position = ? "
+                "WHERE name = 'application_fields'",
+                (end,),
+            )
+        return end >= state["target"]
+
+    def start_backfill(self):
+        """Запустить фоновый перенос полей details, если он не завершен"""
+        if self.application_fields_ready() or self._backfill_thread is not None:
+            return
+        self._backfill_stop.clear()
+        self._backfill_thread = threading.Thread(
+            target=self._backfill_loop, name="fields-backfill", daemon=True
+        )
+        self._backfill_thread.start()
+
+    def _backfill_loop(self):
+        started = time.perf_counter()
+        try:
+            while not self._backfill_stop.is_set():
+                pause = BACKFILL_PAUSE
+                try:
+                    if self.backfill_application_fields():
+                        self._fields_ready = True
+                        print(
+                            "✅ Поля заявок перенесены в application_fields "
+                            f"за {time.perf_counter() - started:.1f} с"
+                        )
+                        break
+                except sqlite3.Error as e:
+                    # Например, база занята дольше busy_timeout: повторим позже
+                    print(f"❌ Ошибка переноса полей заявок: {e}")
+                    pause = 5.0
+                self._backfill_stop.wait(pause)
+        finally:
+            self.release_connection()
 
     def close(self):
-        """Закрыть соединение с БД"""
-        if self.conn:
-            self.conn.close()
+        """Закрыть все соединения пула"""
+        if self._backfill_thread is not None:
+            self._backfill_stop.set()
+            self._backfill_thread.join()
+            self._backfill_thread = None
+        if self._writer is not None:
+            self._writer.stop()
+        with self._pool_lock:
+            connections = list(self._pool.values())
+            self._pool.clear()
+        # Новый threading.local: закрытые соединения больше не выдаются
+        self._local = threading.local()
+
+        for conn in connections:
+            conn.close()
 
 
 # Глобальный экземпляр базы данных
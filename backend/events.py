@@ -0,0 +1,381 @@
+import abc
+import json
+import os
+import selectors
+import socket
+import threading
+import time
+
+from database import application_visible, db
+
+# Как часто проверять, не изменились ли заявки, секунды
+EVENTS_POLL_INTERVAL = float(os.environ.get("STRAHOVOCHKA_EVENTS_POLL_INTERVAL", "1"))
+# Пинг молчащему потоку, чтобы прокси и браузер не закрыли его по таймауту
+EVENTS_HEARTBEAT = float(os.environ.get("STRAHOVOCHKA_EVENTS_HEARTBEAT", "15"))
+# Подписчиков /api/events в одном процессе; сверх этого - 503
+MAX_SUBSCRIBERS = int(os.environ.get("STRAHOVOCHKA_MAX_SUBSCRIBERS", "10000"))
+# Сколько неотправленных байт держать для одного подписчика. Клиент,
+# который не успевает читать, отключается и после переподключения
+# догоняет пропущенное через GET /api/applications?since=
+EVENTS_BUFFER_SIZE = 64 * 1024
+# Сколько изменений читать из базы за один запрос
+EVENTS_BATCH_SIZE = 500
+
+HEARTBEAT = b": ping\n\n"
+# Завершающая часть chunked-ответа
+LAST_CHUNK = b"0\r\n\r\n"
+
+
+def event_frame(event, data, event_id=None):
+    """Событие в формате text/event-stream"""
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    lines.append(f"event: {event}")
+    # json.dumps экранирует переводы строк, данные остаются одной строкой
+    lines.append("data: " + json.dumps(data, ensure_ascii=False))
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+def chunk(data):
+    """Часть ответа с Transfer-Encoding: chunked"""
+    return b"%X\r\n%s\r\n" % (len(data), data)
+
+
+class Subscriber(abc.ABC):
+    """Подписчик потока событий: кому показывать заявки и куда писать.
+
+    Методы вызываются только из потока хаба. push возвращает False, если
+    подписчика пора отключить; overflowed - причина в переполненном буфере.
+    """
+
+    # Сокет для selectors или None, если доставкой занимается кто-то другой
+    fileobj = None
+
+    def __init__(self, user_id, role):
+        self.user_id = user_id
+        self.role = role
+        self.closed = False
+        self.overflowed = False
+
+    @abc.abstractmethod
+    def push(self, data):
+        """Отправить данные подписчику; False - подписчика пора отключить"""
+
+    def close(self):
+        self.closed = True
+
+
+class SocketSubscriber(Subscriber):
+    """Подписчик потокового сервера: неблокирующий сокет и свой буфер"""
+
+    def __init__(self, sock, user_id, role):
+        super().__init__(user_id, role)
+        sock.setblocking(False)
+        self.fileobj = sock
+        self.pending = bytearray()
+
+    def push(self, data):
+        self.pending += chunk(data)
+        return self.flush()
+
+    def flush(self):
+        """Отправить столько, сколько примет сокет"""
+        try:
+            while self.pending:
+                sent = self.fileobj.send(self.pending)
+                del self.pending[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            return False
+
+        if len(self.pending) > EVENTS_BUFFER_SIZE:
+            self.overflowed = True
+            return False
+        return True
+
+    def close(self):
+        if not self.closed and not self.pending:
+            try:
+                self.fileobj.send(LAST_CHUNK)
+            except OSError:
+                pass
+        super().close()
+        try:
+            self.fileobj.close()
+        except OSError:
+            pass
+
+
+class EventHub:
+    """Рассылка событий об изменениях заявок подписчикам /api/events.
+
+    Один поток на процесс раз в poll_interval читает изменения заявок по
+    номеру change_seq и раздает события тем подписчикам, которым заявка
+    видна по правилам списка заявок. Сокеты подписчиков неблокирующие и
+    обслуживаются через selectors в этом же потоке, поэтому молчащий
+    подписчик стоит только сокета и буфера, а не потока пула. Опрос базы,
+    а не сигналы из обработчиков, видит и изменения из других процессов
+    (--processes). Пока подписчиков нет, база не опрашивается.
+    """
+
+    def __init__(
+        self,
+        db,
+        poll_interval=EVENTS_POLL_INTERVAL,
+        heartbeat=EVENTS_HEARTBEAT,
+        max_subscribers=MAX_SUBSCRIBERS,
+    ):
+        self.db = db
+        self.poll_interval = poll_interval
+        self.heartbeat = heartbeat
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        # Новые подписчики от обработчиков; забирает их поток хаба
+        self._new = []
+        self._count = 0
+        self._subscribers = set()
+        self._selector = None
+        self._wake_r = self._wake_w = None
+        self._thread = None
+        self._stop = threading.Event()
+        # Номер изменения, до которого события уже разосланы
+        self._seq = None
+        self.sent = 0
+        self._closed = {"disconnected": 0, "slow": 0}
+
+    def start(self):
+        """Запустить поток рассылки"""
+        if self._thread is not None:
+            return
+
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="event-hub", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Остановить рассылку и закрыть потоки всех подписчиков"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+
+        self._stop.set()
+        self._wake()
+        thread.join()
+        self._selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
+
+    def accepting(self):
+        """Можно ли принять еще одного подписчика"""
+        with self._lock:
+            return self._thread is not None and self._count < self.max_subscribers
+
+    def subscribe(self, subscriber):
+        """Передать подписчика потоку рассылки; False, если хаб остановлен"""
+        with self._lock:
+            if self._thread is None:
+                return False
+            self._count += 1
+            self._new.append(subscriber)
+        self._wake()
+        return True
+
+    def get_metrics(self):
+        """Число подписчиков, отправленные события и отключения по причинам"""
+        with self._lock:
+            return {
+                "subscribers": self._count,
+                "sent": self.sent,
+                "closed": dict(self._closed),
+            }
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            # Буфер полон: поток и так проснется
+            pass
+
+    def _run(self):
+        next_poll = next_heartbeat = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                timeout = None
+                if self._subscribers:
+                    timeout = max(0, min(next_poll, next_heartbeat) - time.monotonic())
+
+                for key, mask in self._selector.select(timeout):
+                    if key.fileobj is self._wake_r:
+                        self._drain_wake()
+                    else:
+                        self._handle_socket(key.data, mask)
+
+                self._add_new()
+                now = time.monotonic()
+                if now >= next_poll:
+                    self._poll()
+                    next_poll = now + self.poll_interval
+                if now >= next_heartbeat:
+                    for subscriber in list(self._subscribers):
+                        self._deliver(subscriber, HEARTBEAT)
+                    next_heartbeat = now + self.heartbeat
+
+                # Подписчики asyncio-сервера закрываются в цикле событий
+                for subscriber in [s for s in self._subscribers if s.closed]:
+                    self._drop(subscriber)
+        finally:
+            with self._lock:
+                new, self._new = self._new, []
+            for subscriber in list(self._subscribers) + new:
+                self._drop(subscriber)
+            self.db.release_connection()
+
+    def _drain_wake(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _handle_socket(self, subscriber, mask):
+        if mask & selectors.EVENT_READ:
+            # Клиент потока ничего не присылает: пустое чтение - он ушел
+            try:
+                if not subscriber.fileobj.recv(4096):
+                    self._drop(subscriber)
+                    return
+            except BlockingIOError:
+                pass
+            except OSError:
+                self._drop(subscriber)
+                return
+
+        if mask & selectors.EVENT_WRITE:
+            if not subscriber.flush():
+                self._drop(subscriber)
+            elif not subscriber.pending:
+                self._selector.modify(
+                    subscriber.fileobj, selectors.EVENT_READ, subscriber
+                )
+
+    def _add_new(self):
+        with self._lock:
+            new, self._new = self._new, []
+        if not new:
+            return
+
+        if self._seq is None:
+            self._seq = self.db.get_data_version("applications")
+        for subscriber in new:
+            if subscriber.fileobj is not None:
+                self._selector.register(
+                    subscriber.fileobj, selectors.EVENT_READ, subscriber
+                )
+            self._subscribers.add(subscriber)
+            # С этого номера клиент может догнать пропущенное через since=
+            self._deliver(subscriber, event_frame("ready", {"seq": self._seq}))
+
+    def _deliver(self, subscriber, data):
+        if subscriber.closed:
+            return
+        if not subscriber.push(data):
+            self._drop(subscriber)
+            return
+
+        pending = getattr(subscriber, "pending", None)
+        if pending:
+            self._selector.modify(
+                subscriber.fileobj,
+                selectors.EVENT_READ | selectors.EVENT_WRITE,
+                subscriber,
+            )
+
+    def _drop(self, subscriber):
+        if subscriber in self._subscribers:
+            self._subscribers.discard(subscriber)
+            if subscriber.fileobj is not None:
+                self._selector.unregister(subscriber.fileobj)
+        reason = "slow" if subscriber.overflowed else "disconnected"
+        subscriber.close()
+        with self._lock:
+            self._count -= 1
+            self._closed[reason] += 1
+
+    def _poll(self):
+        """Разослать изменения заявок после self._seq"""
+        if not self._subscribers:
+            # Новые подписчики начнут с текущего номера
+            self._seq = None
+            return
+        if self._seq is None:
+            return
+
+        more = True
+        while more:
+            changes = self.db.get_application_changes(
+                None, "admin", self._seq, EVENTS_BATCH_SIZE
+            )
+            if changes is None:
+                return
+            tombstones = []
+            if changes["removed"]:
+                tombstones = (
+                    self.db.get_application_tombstones(self._seq, changes["seq"]) or []
+                )
+            self._publish(changes["applications"], tombstones)
+            self._seq = changes["seq"]
+            more = changes["more"]
+
+    def _publish(self, rows, tombstones):
+        events = []
+        for row in rows:
+            # Смена статуса всегда заполняет processed_at
+            name = "application_created"
+            if row["processed_at"] is not None:
+                name = "application_status"
+            hidden = None
+            if row["manager_id"] is not None:
+                # Заявку взял менеджер: у остальных она пропадает из списка
+                hidden = event_frame(
+                    "application_removed", {"id": row["id"]}, row["change_seq"]
+                )
+            events.append((row, event_frame(name, row, row["change_seq"]), hidden))
+
+        removed = [
+            (
+                row,
+                event_frame(
+                    "application_removed",
+                    {"id": row["application_id"]},
+                    row["change_seq"],
+                ),
+            )
+            for row in tombstones
+        ]
+        if not events and not removed:
+            return
+
+        for subscriber in list(self._subscribers):
+            parts = []
+            for row, frame, hidden in events:
+                if application_visible(row, subscriber.user_id, subscriber.role):
+                    parts.append(frame)
+                elif subscriber.role == "manager":
+                    parts.append(hidden)
+            for row, frame in removed:
+                if application_visible(row, subscriber.user_id, subscriber.role):
+                    parts.append(frame)
+
+            if parts:
+                with self._lock:
+                    self.sent += len(parts)
+                self._deliver(subscriber, b"".join(parts))
+
+
+event_hub = EventHub(db)
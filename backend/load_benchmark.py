@@ -0,0 +1,495 @@
+import argparse
+import atexit
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Нагрузка идет на временную базу, рабочая strahovochka.db не трогается
+_tmp_dir = tempfile.mkdtemp(prefix="strahovochka_load_")
+atexit.register(shutil.rmtree, _tmp_dir, True)
+os.environ["STRAHOVOCHKA_DB"] = os.path.join(_tmp_dir, "load.db")
+
+from database import Database  # noqa: E402
+from passwords import password_hasher  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, "load_baseline.json")
+PASSWORD = "password123"
+STATUSES = ("В процессе", "Обработана", "Отклонена")
+SUBTYPES = ["легковой", "грузовой", "квартира", "дом", "жизнь", "здоровье"]
+MODELS = ["Toyota Camry", "Лада Веста", "Kia Rio", "Hyundai Solaris", "Skoda Octavia"]
+
+# Сценарии: доли операций в смеси
+SCENARIOS = {
+    "login": {"login": 1},
+    "dashboard": {"dashboard": 1},
+    "create": {"create": 1},
+    "status": {"status": 1},
+    "mixed": {"login": 2, "dashboard": 60, "create": 20, "status": 18},
+}
+# Во сколько раз может ухудшиться показатель, прежде чем это регрессия
+DEFAULT_TOLERANCE = 0.2
+
+
+def seed(db_path, clients, managers, applications):
+    """Наполнить базу пользователями и заявками пакетными вставками.
+
+    У всех пользователей один пароль PASSWORD; хеш считается один раз.
+    Возвращает id заявок и id типов страховок из базы.
+    """
+    rng = random.Random(42)
+    password = password_hasher.hash(PASSWORD)
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        """
+        INSERT INTO users (username, password, role, full_name, email, phone, address)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                f"load_{role}{i}",
+                password,
+                role,
+                f"Нагрузочный {role} {i}",
+                f"load_{role}{i}@strahovochka.ru",
+                f"+7 900 {i:07d}",
+                f"г. Москва, ул. Тестовая, д. {i % 200}",
+            )
+            for role, count in (("client", clients), ("manager", managers))
+            for i in range(count)
+        ],
+    )
+    client_ids = [
+        row[0] for row in conn.execute("SELECT id FROM users WHERE role = 'client'")
+    ]
+    type_ids = [row[0] for row in conn.execute("SELECT id FROM insurance_types")]
+    conn.executemany(
+        """
+        INSERT INTO applications (client_id, insurance_type_id, insurance_subtype, details, status)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                rng.choice(client_ids),
+                rng.choice(type_ids),
+                rng.choice(SUBTYPES),
+                json.dumps(
+                    {
+                        "model": rng.choice(MODELS),
+                        "year": rng.randint(2000, 2024),
+                        "number": f"А{rng.randint(100, 999)}БВ{rng.randint(10, 199)}",
+                    }
+                ),
+                rng.choice(STATUSES),
+            )
+            for _ in range(applications)
+        ],
+    )
+    conn.commit()
+    app_ids = [row[0] for row in conn.execute("SELECT id FROM applications")]
+    conn.close()
+    return app_ids, type_ids
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ServerProcess:
+    """Сервер (run_server) в отдельном процессе на временной базе"""
+
+    def __init__(self, engine, workers, processes):
+        self.port = _free_port()
+        self.args = [
+            sys.executable,
+            os.path.join(BACKEND_DIR, "server.py"),
+            "--port",
+            str(self.port),
+            "--engine",
+            engine,
+            "--processes",
+            str(processes),
+        ]
+        if workers:
+            self.args += ["--workers", str(workers)]
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            self.args,
+            cwd=_tmp_dir,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("Сервер завершился при запуске")
+            try:
+                socket.create_connection(("127.0.0.1", self.port), 0.2).close()
+                return self
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError("Сервер не начал принимать соединения")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def peak_rss_mb(self):
+        """Пиковый RSS сервера и его дочерних процессов (только Linux)"""
+        pids = [self.process.pid] + _children(self.process.pid)
+        total = 0
+        for pid in pids:
+            try:
+                with open(f"/proc/{pid}/status") as status:
+                    for line in status:
+                        if line.startswith("VmHWM:"):
+                            total += int(line.split()[1])
+            except OSError:
+                continue
+        return round(total / 1024, 1) if total else None
+
+
+def _children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as children:
+            pids = [int(child) for child in children.read().split()]
+    except OSError:
+        return []
+    return pids + [grandchild for child in pids for grandchild in _children(child)]
+
+
+class Client:
+    """Пользователь API на одном постоянном соединении"""
+
+    def __init__(self, port, username):
+        self.port = port
+        self.username = username
+        self.token = None
+        self.conn = None
+
+    def request(self, method, path, body=None, token=True):
+        headers = {"Accept-Encoding": "gzip"}
+        if token and self.token:
+            headers["Authorization"] = "Bearer " + self.token
+        if body is not None:
+            body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(
+                    "127.0.0.1", self.port, timeout=30
+                )
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                # Сервер закрыл постоянное соединение: повторяем на новом
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+                continue
+            if response.getheader("Connection", "").lower() == "close":
+                self.conn.close()
+                self.conn = None
+            return response.status, data
+
+    def login(self):
+        status, data = self.request(
+            "POST",
+            "/api/login",
+            {"username": self.username, "password": PASSWORD},
+            token=False,
+        )
+        if status == 200:
+            self.token = json.loads(data)["token"]
+        return status
+
+
+def _operation(name, clients, managers, app_ids, type_ids, rng):
+    """Один запрос операции name: (клиент, метод, путь, тело)"""
+    if name == "login":
+        client = rng.choice(clients + managers)
+        return client, "POST", "/api/login", None
+    if name == "dashboard":
+        return rng.choice(managers), "GET", "/api/applications?limit=50", None
+    if name == "create":
+        body = {
+            "insurance_type_id": rng.choice(type_ids),
+            "insurance_subtype": rng.choice(SUBTYPES),
+            "details": {"model": rng.choice(MODELS), "year": rng.randint(2000, 2024)},
+        }
+        return rng.choice(clients), "POST", "/api/applications", body
+    app_id = rng.choice(app_ids)
+    body = {"status": rng.choice(STATUSES)}
+    return rng.choice(managers), "PUT", f"/api/applications/{app_id}/status", body
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_scenario(
+    name, port, users, app_ids, type_ids, concurrency, duration, seed_value
+):
+    """Нагрузить сервер смесью операций сценария на duration секунд"""
+    mix = SCENARIOS[name]
+    operations = list(mix)
+    weights = [mix[operation] for operation in operations]
+
+    # PBKDF2 нарочно медленный: входим заранее небольшим набором
+    # пользователей, а потоки нагрузки делят их токены
+    rng = random.Random(seed_value)
+    tokens = {}
+    for role, count in (("client", 8), ("manager", 4)):
+        for username in rng.sample(users[role], min(count, len(users[role]))):
+            client = Client(port, username)
+            if client.login() != 200:
+                raise RuntimeError(f"Не удалось войти как {username}")
+            tokens[username] = (role, client.token)
+
+    # У каждого потока нагрузки свои соединения
+    per_thread = []
+    for index in range(concurrency):
+        clients, managers = [], []
+        for username, (role, token) in tokens.items():
+            client = Client(port, username)
+            client.token = token
+            (clients if role == "client" else managers).append(client)
+        per_thread.append((random.Random(seed_value + index + 1), clients, managers))
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def worker(rng, clients, managers):
+        local_latencies = []
+        local_statuses = {}
+        while time.perf_counter() < deadline:
+            operation = rng.choices(operations, weights)[0]
+            client, method, path, body = _operation(
+                operation, clients, managers, app_ids, type_ids, rng
+            )
+            began = time.perf_counter()
+            try:
+                if operation == "login":
+                    status = client.login()
+                else:
+                    status, _ = client.request(method, path, body)
+            except (http.client.HTTPException, OSError):
+                status = "error"
+            local_latencies.append(time.perf_counter() - began)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=worker, args=args) for args in per_thread]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    failed = sum(
+        count
+        for status, count in statuses.items()
+        if not (isinstance(status, int) and status < 400)
+    )
+    return {
+        "requests": len(latencies),
+        "errors": failed,
+        "statuses": {
+            str(status): count for status, count in sorted(statuses.items(), key=str)
+        },
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": _ms(_percentile(latencies, 0.5)),
+        "p95_ms": _ms(_percentile(latencies, 0.95)),
+        "p99_ms": _ms(_percentile(latencies, 0.99)),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def compare(results, baseline, tolerance):
+    """Регрессии относительно базовых замеров: список строк"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        if base["rps"] and result["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {base['rps']} -> {result['rps']}")
+        for key in ("p50_ms", "p95_ms", "p99_ms", "peak_rss_mb"):
+            old, new = base.get(key), result.get(key)
+            if old and new and new > old * (1 + tolerance):
+                regressions.append(f"{name}: {key} {old} -> {new}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Нагрузочный замер API: пропускная способность, задержки, память"
+    )
+    parser.add_argument("--clients", type=int, default=500, help="число клиентов")
+    parser.add_argument("--managers", type=int, default=20, help="число менеджеров")
+    parser.add_argument("--applications", type=int, default=10000, help="число заявок")
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help=f"сценарии через запятую из: {', '.join(SCENARIOS)}",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="параллельных клиентов"
+    )
+    parser.add_argument("--duration", type=float, default=10, help="секунд на сценарий")
+    parser.add_argument("--engine", default="threads", help="движок сервера")
+    parser.add_argument("--workers", type=int, default=0, help="обработчиков сервера")
+    parser.add_argument("--processes", type=int, default=1, help="процессов сервера")
+    parser.add_argument(
+        "--save-baseline",
+        nargs="?",
+        const=DEFAULT_BASELINE,
+        metavar="PATH",
+        help="сохранить результаты как базовые",
+    )
+    parser.add_argument(
+        "--compare",
+        nargs="?",
+        const=DEFAULT_BASELINE,
+        metavar="PATH",
+        help="сравнить с базовыми и вернуть код 1 при регрессии",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="допустимое ухудшение, доля (0.2 = 20%%)",
+    )
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(unknown)}")
+
+    print("=" * 50)
+    print("Нагрузочный замер API проекта 'Страховочка'")
+    print("=" * 50)
+
+    db = Database()
+    db.close()
+    started = time.perf_counter()
+    app_ids, type_ids = seed(db.db_path, args.clients, args.managers, args.applications)
+    print(
+        f"📦 Данные: {args.clients} клиентов, {args.managers} менеджеров, "
+        f"{args.applications} заявок ({time.perf_counter() - started:.1f} с)"
+    )
+    print(
+        f"⚙️ Движок: {args.engine}, процессов: {args.processes}, "
+        f"параллельных клиентов: {args.concurrency}, {args.duration:g} с на сценарий\n"
+    )
+    users = {
+        role: [f"load_{role}{i}" for i in range(count)]
+        for role, count in (("client", args.clients), ("manager", args.managers))
+    }
+
+    # Сервер перезапускается для каждого сценария: пиковый RSS - его собственный
+    results = {}
+    print(
+        f"{'Сценарий':<12} {'Запросов':>9} {'Ошибок':>7} {'rps':>8} "
+        f"{'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'RSS, МБ':>9}"
+    )
+    print("-" * 80)
+    for index, name in enumerate(scenarios):
+        with ServerProcess(args.engine, args.workers, args.processes) as server:
+            result = run_scenario(
+                name,
+                server.port,
+                users,
+                app_ids,
+                type_ids,
+                args.concurrency,
+                args.duration,
+                seed_value=index * 1000,
+            )
+            result["peak_rss_mb"] = server.peak_rss_mb()
+        results[name] = result
+        print(
+            f"{name:<12} {result['requests']:>9} {result['errors']:>7} "
+            f"{result['rps']:>8} {result['p50_ms']:>9} {result['p95_ms']:>9} "
+            f"{result['p99_ms']:>9} {str(result['peak_rss_mb']):>9}"
+        )
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            key: getattr(args, key)
+            for key in (
+                "clients",
+                "managers",
+                "applications",
+                "concurrency",
+                "duration",
+                "engine",
+                "workers",
+                "processes",
+            )
+        },
+        "scenarios": results,
+    }
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            print(
+                "\n⚠️ Параметры замера отличаются от базовых, сравнение приблизительное"
+            )
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ Регрессии (допуск {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"   {line}")
+            exit_code = 1
+        else:
+            print(f"\n✅ Регрессий нет (допуск {args.tolerance:.0%})")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Базовые замеры сохранены: {args.save_baseline}")
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
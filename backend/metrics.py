@@ -0,0 +1,255 @@
+import bisect
+import threading
+
+# Границы корзин гистограмм длительности, секунды
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+# Фазы обработки запроса, для которых ведутся отдельные гистограммы
+PHASES = ("parse", "auth", "db", "encode")
+# Метка маршрута для запросов, не совпавших ни с одним маршрутом
+UNMATCHED_ROUTE = "unmatched"
+
+PREFIX = "strahovochka"
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами (без блокировки, ее держит владелец)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Пары (граница, число наблюдений не больше нее), последняя - +Inf"""
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+
+class RouteStats:
+    """Счетчики и гистограммы одного маршрута"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statuses = {}
+        self.duration = Histogram()
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+
+class Metrics:
+    """Метрики HTTP-запросов по маршрутам.
+
+    Запись одного запроса - это одна короткая блокировка статистики
+    его маршрута, поэтому сбор можно не выключать в продакшене.
+    Маршрут берется из шаблона (/api/users/<int:user_id>), а не из пути,
+    чтобы число рядов не росло с числом пользователей и заявок.
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.rejected = 0
+        # Дополнительные источники: функции, возвращающие строки метрик
+        self._collectors = []
+
+    def _stats(self, method, route):
+        key = (method, route)
+        stats = self._routes.get(key)
+        if stats is None:
+            with self._lock:
+                stats = self._routes.setdefault(key, RouteStats())
+        return stats
+
+    def request_started(self):
+        with self._lock:
+            self._in_flight += 1
+
+    def request_finished(
+        self, method, route, status, duration, phases, request_bytes, response_bytes
+    ):
+        """Учесть завершенный запрос"""
+        with self._lock:
+            self._in_flight -= 1
+
+        stats = self._stats(method, route or UNMATCHED_ROUTE)
+        with stats.lock:
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.duration.observe(duration)
+            for phase, seconds in phases.items():
+                stats.phases[phase].observe(seconds)
+            stats.request_bytes += request_bytes
+            stats.response_bytes += response_bytes
+
+    def request_rejected(self):
+        """Запрос отклонен с 503 до обработки: пул и очередь заняты"""
+        with self._lock:
+            self.rejected += 1
+
+    def add_collector(self, collector):
+        """Добавить функцию, которая возвращает строки метрик для вывода.
+
+        Повторная регистрация той же функции ничего не меняет: иначе ее
+        метрики попали бы в вывод дважды, и Prometheus отверг бы его.
+        """
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        with self._lock:
+            routes = sorted(self._routes.items())
+            in_flight = self._in_flight
+            rejected = self.rejected
+
+        requests = []
+        durations = []
+        phases = []
+        request_bytes = []
+        response_bytes = []
+        for (method, route), stats in routes:
+            labels = f'method="{method}",route="{_escape(route)}"'
+            with stats.lock:
+                for status, count in sorted(stats.statuses.items()):
+                    requests.append(
+                        f'{PREFIX}_http_requests_total{{{labels},status="{status}"}} {count}'
+                    )
+                durations.extend(
+                    _histogram(
+                        f"{PREFIX}_http_request_duration_seconds",
+                        labels,
+                        stats.duration,
+                    )
+                )
+                for phase in PHASES:
+                    phases.extend(
+                        _histogram(
+                            f"{PREFIX}_http_request_phase_seconds",
+                            f'{labels},phase="{phase}"',
+                            stats.phases[phase],
+                        )
+                    )
+                request_bytes.append(
+                    f"{PREFIX}_http_request_size_bytes_total{{{labels}}} {stats.request_bytes}"
+                )
+                response_bytes.append(
+                    f"{PREFIX}_http_response_size_bytes_total{{{labels}}} {stats.response_bytes}"
+                )
+
+        lines = []
+        lines += _family(
+            "http_requests_total", "counter", "Обработанные запросы", requests
+        )
+        lines += _family(
+            "http_request_duration_seconds",
+            "histogram",
+            "Полное время обработки запроса",
+            durations,
+        )
+        lines += _family(
+            "http_request_phase_seconds",
+            "histogram",
+            "Время фаз обработки: разбор, проверка токена, база, кодирование ответа",
+            phases,
+        )
+        lines += _family(
+            "http_request_size_bytes_total",
+            "counter",
+            "Байты тел запросов",
+            request_bytes,
+        )
+        lines += _family(
+            "http_response_size_bytes_total",
+            "counter",
+            "Байты тел ответов (после сжатия)",
+            response_bytes,
+        )
+        lines += _family(
+            "http_requests_in_flight",
+            "gauge",
+            "Запросы в обработке",
+            [f"{PREFIX}_http_requests_in_flight {in_flight}"],
+        )
+        lines += _family(
+            "http_requests_rejected_total",
+            "counter",
+            "Запросы, отклоненные с 503 из-за заполненной очереди",
+            [f"{PREFIX}_http_requests_rejected_total {rejected}"],
+        )
+        for collector in self._collectors:
+            lines += collector()
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _family(name, kind, help_text, samples):
+    """Заголовки HELP/TYPE и значения одной метрики"""
+    return [
+        f"# HELP {PREFIX}_{name} {help_text}",
+        f"# TYPE {PREFIX}_{name} {kind}",
+    ] + samples
+
+
+def gauge(name, help_text, value, labels=None):
+    """Строки одной метрики-значения для сборщиков"""
+    return _family(name, "gauge", help_text, [_sample(name, value, labels)])
+
+
+def counter(name, help_text, values):
+    """Строки счетчика; values - пары (метки, значение)"""
+    return _family(
+        name,
+        "counter",
+        help_text,
+        [_sample(name, value, labels) for labels, value in values],
+    )
+
+
+def _sample(name, value, labels=None):
+    if labels:
+        rendered = ",".join(
+            f'{key}="{_escape(str(val))}"' for key, val in labels.items()
+        )
+        return f"{PREFIX}_{name}{{{rendered}}} {value}"
+    return f"{PREFIX}_{name} {value}"
+
+
+def _histogram(name, labels, histogram):
+    lines = []
+    for bound, count in histogram.cumulative():
+        le = "+Inf" if bound == float("inf") else repr(bound)
+        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {count}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
+
+
+metrics = Metrics()
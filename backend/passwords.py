@@ -0,0 +1,166 @@
+import base64
+import concurrent.futures
+import hashlib
+import hmac
+import multiprocessing
+import os
+import secrets
+import signal
+import threading
+import time
+
+# Число итераций PBKDF2-SHA256 для новых хешей. Хеши с меньшим числом
+# итераций пересчитываются при следующем успешном входе
+PBKDF2_ITERATIONS = int(os.environ.get("STRAHOVOCHKA_PBKDF2_ITERATIONS", "600000"))
+# Процессы для хеширования и сколько задач может ждать сверх них. Поток
+# обработчика ждет свой хеш, поэтому их сумма должна быть заметно меньше
+# числа обработчиков сервера: иначе вход займет их все
+HASH_WORKERS = int(
+    os.environ.get("STRAHOVOCHKA_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2)))
+)
+HASH_QUEUE_SIZE = int(os.environ.get("STRAHOVOCHKA_HASH_QUEUE_SIZE", "2"))
+
+ALGORITHM = "pbkdf2_sha256"
+SALT_BYTES = 16
+# Старый формат: SHA-256 с общей для всех солью
+LEGACY_SALT = "strahovochka_salt_2024"
+
+
+class HasherBusy(Exception):
+    """Все процессы хеширования заняты и очередь к ним заполнена"""
+
+
+def _pbkdf2(password, salt, iterations):
+    # Выполняется в процессе пула, поэтому функция верхнего уровня
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+
+
+def _init_worker(parent_pid):
+    """Настройка процесса пула после fork"""
+    # Обработчики сигналов сервера здесь не нужны: останавливает пул
+    # сервер, а Ctrl+C получает он же
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Процесс пула завершается, если сервер умер, даже по SIGKILL
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def _legacy_hash(password):
+    return hashlib.sha256((password + LEGACY_SALT).encode()).hexdigest()
+
+
+def parse_hash(stored):
+    """(итерации, соль, хеш) из строки хеша; None для старого формата"""
+    parts = stored.split("$")
+    if len(parts) != 4 or parts[0] != ALGORITHM:
+        return None
+    try:
+        return int(parts[1]), base64.b64decode(parts[2]), base64.b64decode(parts[3])
+    except ValueError:
+        return None
+
+
+def needs_upgrade(stored, iterations=PBKDF2_ITERATIONS):
+    """Нужно ли пересчитать хеш с текущими параметрами"""
+    parsed = parse_hash(stored)
+    return parsed is None or parsed[0] < iterations
+
+
+class PasswordHasher:
+    """Хеширование паролей в отдельных процессах.
+
+    PBKDF2 нарочно тратит сотни миллисекунд процессора. В потоке
+    обработчика это держало бы GIL и тормозило все остальные запросы,
+    поэтому хеши считает пул процессов. Задач одновременно не больше,
+    чем процессов плюс HASH_QUEUE_SIZE: при всплеске входов лишние
+    запросы сразу получают HasherBusy, а не занимают все обработчики.
+
+    До start() хеши считаются в вызывающем потоке (скрипты, миграции).
+    """
+
+    def __init__(
+        self,
+        workers=HASH_WORKERS,
+        queue_size=HASH_QUEUE_SIZE,
+        iterations=PBKDF2_ITERATIONS,
+    ):
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.iterations = iterations
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._executor = None
+        self.rejected = 0
+        # Хеш, с которым сверяется пароль несуществующего пользователя:
+        # те же параметры, что у настоящих, и ни один пароль не подходит
+        self.dummy_hash = "$".join(
+            [
+                ALGORITHM,
+                str(iterations),
+                _b64encode(secrets.token_bytes(SALT_BYTES)),
+                _b64encode(secrets.token_bytes(hashlib.sha256().digest_size)),
+            ]
+        )
+
+    def start(self):
+        """Запустить процессы пула заранее, до приема запросов"""
+        if self._executor is not None:
+            return
+        # fork: процессам пула не нужно заново импортировать сервер
+        # (на Windows fork нет, там используется способ по умолчанию)
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(method),
+            initializer=_init_worker,
+            initargs=(os.getpid(),),
+        )
+        # С fork пул создает все процессы при первой задаче
+        self._executor.submit(_pbkdf2, "", b"", 1).result()
+
+    def stop(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _derive(self, password, salt, iterations):
+        executor = self._executor
+        if executor is None:
+            return _pbkdf2(password, salt, iterations)
+
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HasherBusy()
+        try:
+            return executor.submit(_pbkdf2, password, salt, iterations).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        """Хеш пароля со своей солью: pbkdf2_sha256$итерации$соль$хеш"""
+        salt = secrets.token_bytes(SALT_BYTES)
+        derived = self._derive(password, salt, self.iterations)
+        return "$".join(
+            [ALGORITHM, str(self.iterations), _b64encode(salt), _b64encode(derived)]
+        )
+
+    def verify(self, password, stored):
+        """Совпадает ли пароль с сохраненным хешем (новым или старым)"""
+        parsed = parse_hash(stored)
+        if parsed is None:
+            return hmac.compare_digest(_legacy_hash(password), stored)
+
+        iterations, salt, expected = parsed
+        return hmac.compare_digest(self._derive(password, salt, iterations), expected)
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,252 @@
+import atexit
+import inspect
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+# Проверка идет на временной базе, рабочая strahovochka.db не трогается
+_tmp_dir = tempfile.mkdtemp(prefix="strahovochka_plans_")
+atexit.register(shutil.rmtree, _tmp_dir, True)
+os.environ["STRAHOVOCHKA_DB"] = os.path.join(_tmp_dir, "plans.db")
+
+from database import Database, encode_cursor  # noqa: E402
+
+# Полный проход по таблице без индекса
+TABLE_SCAN = re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+# Проход по индексу целиком (без SEARCH по ключу): читается вся таблица,
+# индекс только задает порядок
+INDEX_SCAN = re.compile(r"^SCAN (\w+)(?: AS \w+)? USING (?:COVERING )?INDEX ")
+
+# Методы Database, которые сами не обращаются к таблицам
+SKIPPED_METHODS = {
+    "close",
+    "connect",
+    "conn",
+    "db_time",
+    "execute_query",
+    "init_db",
+    "iter_query",
+    "release_connection",
+    "schema_version",
+    "start_backfill",
+    "transaction",
+}
+
+# Методы, которые намеренно читают таблицу целиком: сверка сводки с заявками
+FULL_SCAN_METHODS = {"check_application_stats"}
+# Сводные таблицы: их размер зависит от числа групп, а не от числа
+# заявок, поэтому полный проход по ним допустим
+SUMMARY_TABLES = {"application_stats"}
+
+# Вызовы, которым разрешен проход по индексу целиком. Полные списки
+# администратора и справочник типов возвращают всю таблицу, индекс
+# только дает порядок без сортировки. Первая страница менеджера идет по
+# индексу created_at и останавливается на LIMIT
+INDEX_SCAN_CALLS = [
+    ("get_applications", (1, "admin")),
+    ("iter_applications", (1, "admin")),
+    ("get_applications_page", (2, "manager", 10)),
+    ("get_all_users", ()),
+    ("iter_all_users", ()),
+    ("get_insurance_types", ()),
+]
+
+# Курсор заведомо после всех записей: проверяется запрос следующей страницы
+LAST_PAGE_CURSOR = encode_cursor("9999-12-31 23:59:59", 2**31)
+
+# Вызовы всех методов Database, которые выполняют запросы
+CALLS = [
+    ("get_user_by_username", ("admin",)),
+    ("get_user_by_id", (1,)),
+    (
+        "create_user",
+        (
+            {
+                "username": "plan_client",
+                "password": "password123",
+                "role": "client",
+                "full_name": "Проверка Плана",
+                "email": "plan@strahovochka.ru",
+            },
+        ),
+    ),
+    ("verify_user", ("admin", "password123")),
+    ("get_applications", (1, "client")),
+    ("get_applications", (2, "manager")),
+    ("get_applications", (1, "admin")),
+    ("iter_applications", (1, "client")),
+    ("iter_applications", (2, "manager")),
+    ("iter_applications", (1, "admin")),
+    ("get_applications_page", (1, "client", 10, LAST_PAGE_CURSOR)),
+    ("get_applications_page", (2, "manager", 10)),
+    ("get_applications_page", (2, "manager", 10, LAST_PAGE_CURSOR)),
+    ("get_applications_page", (1, "admin", 10, LAST_PAGE_CURSOR)),
+    ("get_applications_page", (2, "manager", 10, None, {"model": "Toyota Camry"})),
+    ("get_applications_page", (1, "admin", 10, None, {"number": "А123БВ777"})),
+    ("iter_applications", (1, "admin", {"year_from": 2015, "year_to": 2020})),
+    ("get_applications", (3, "client", {"year": 2020})),
+    ("application_fields_ready", ()),
+    ("get_application_stats", ()),
+    ("get_application_status_counts", (2, "manager")),
+    ("get_application_status_counts", (3, "client")),
+    ("backfill_application_fields", (100,)),
+    ("search_applications", (3, "client", "Toyota А123", 10)),
+    ("search_applications", (2, "manager", "Петров", 10)),
+    ("search_applications", (1, "admin", "легковой", 10, 10)),
+    ("get_application_changes", (3, "client", 5, 10)),
+    ("get_application_changes", (2, "manager", 5, 10)),
+    ("get_application_changes", (1, "admin", 5, 10)),
+    ("get_application_tombstones", (5, 10)),
+    ("get_application_tombstones", (5, 10, 3, "client")),
+    ("get_application_tombstones", (5, 10, 2, "manager")),
+    (
+        "create_application",
+        (
+            {
+                "client_id": 3,
+                "insurance_type_id": 1,
+                "insurance_subtype": "квартира",
+                "details": {"area": 54},
+            },
+        ),
+    ),
+    (
+        "create_applications",
+        (
+            3,
+            [
+                {
+                    "insurance_type_id": 1,
+                    "insurance_subtype": "дом",
+                    "details": {"area": 120},
+                },
+            ],
+        ),
+    ),
+    ("update_application_status", (1, "Обработана", 2)),
+    (
+        "update_applications_status",
+        ([(1, "Обработана"), (2, "Отклонена")], 2, True),
+    ),
+    ("update_applications_status", ([(1, "В процессе")], 1)),
+    ("get_all_users", ()),
+    ("iter_all_users", ()),
+    ("get_all_users_page", (10, LAST_PAGE_CURSOR)),
+    ("get_managers", ()),
+    ("get_insurance_types", ()),
+    ("get_data_version", ("users",)),
+    ("revoke_token", ("plan-token", 1, 0.0, 1.0)),
+    ("get_revoked_tokens", (0,)),
+    ("purge_revoked_tokens", (2.0,)),
+    ("delete_user", (4,)),
+]
+
+
+class RecordingDatabase(Database):
+    """Database, запоминающая каждый выполненный запрос"""
+
+    def __init__(self, *args, **kwargs):
+        self.recorded = []
+        super().__init__(*args, **kwargs)
+
+    def execute_query(self, query, params=None, fetchone=False, fetchall=False):
+        self.recorded.append((query, params))
+        return super().execute_query(query, params, fetchone, fetchall)
+
+    def iter_query(self, query, params=None, *args, **kwargs):
+        self.recorded.append((query, params))
+        return super().iter_query(query, params, *args, **kwargs)
+
+
+def collect_queries(db):
+    """Выполнить все вызовы из CALLS.
+
+    Возвращает {запрос: (параметры, вызовы, которые его сделали)}.
+    """
+    public = {
+        name
+        for name in dir(Database)
+        if not name.startswith("_")
+        and name not in SKIPPED_METHODS
+        and name not in FULL_SCAN_METHODS
+    }
+    missing = public - {name for name, _ in CALLS}
+    if missing:
+        print(f"❌ Нет проверочных вызовов для: {', '.join(sorted(missing))}")
+        return None
+
+    unique = {}
+    for name, args in CALLS:
+        db.recorded = []
+        result = getattr(db, name)(*args)
+        # Потоковые методы выполняют запрос только при чтении
+        if inspect.isgenerator(result):
+            list(result)
+
+        for query, params in db.recorded:
+            _, calls = unique.setdefault(" ".join(query.split()), (params, []))
+            calls.append((name, args))
+    return unique
+
+
+def explain(db, query, params):
+    """Строки EXPLAIN QUERY PLAN для запроса"""
+    rows = db.conn.execute(f"EXPLAIN QUERY PLAN {query}", params or ()).fetchall()
+    return [row["detail"] for row in rows]
+
+
+def check_query_plans():
+    """Проверка, что ни один запрос Database не читает таблицу целиком"""
+    print("🔍 Проверка планов запросов...")
+
+    db = RecordingDatabase()
+    print(f"📐 Версия схемы: {db.schema_version()}")
+
+    queries = collect_queries(db)
+    if queries is None:
+        return False
+
+    failed = 0
+    for query, (params, calls) in queries.items():
+        plan = explain(db, query, params)
+        scans = [
+            line
+            for line in plan
+            if (match := TABLE_SCAN.match(line))
+            and match.group(1) not in SUMMARY_TABLES
+        ]
+        # Проход по индексу допустим, только если все вызовы с этим
+        # запросом перечислены в INDEX_SCAN_CALLS
+        if not all(call in INDEX_SCAN_CALLS for call in calls):
+            scans += [line for line in plan if INDEX_SCAN.match(line)]
+        sorts = [line for line in plan if "TEMP B-TREE" in line]
+
+        if scans:
+            failed += 1
+            print(f"\n❌ {query}")
+            for line in plan:
+                print(f"     {line}")
+        elif sorts:
+            print(f"\n⚠️ Сортировка без индекса: {query}")
+
+    db.close()
+
+    if failed:
+        print(
+            f"\n❌ Полный проход по таблице или индексу в {failed} "
+            f"из {len(queries)} запросов"
+        )
+        return False
+
+    print(f"✅ Все {len(queries)} запросов используют индексы!")
+    return True
+
+
+if __name__ == "__main__":
+    print("=" * 50)
+    print("Проверка планов запросов проекта 'Страховочка'")
+    print("=" * 50)
+
+    sys.exit(0 if check_query_plans() else 1)
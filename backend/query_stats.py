@@ -0,0 +1,144 @@
+import collections
+import functools
+import os
+import re
+import threading
+import time
+
+# Запросы дольше порога пишутся в журнал медленных вместе с планом;
+# 0 отключает журнал
+SLOW_QUERY_MS = float(os.environ.get("STRAHOVOCHKA_SLOW_QUERY_MS", "100"))
+# Сколько последних замеров каждого запроса хранить для процентилей
+QUERY_SAMPLES = 1024
+# Сколько последних медленных запросов держать в памяти
+SLOW_QUERY_LOG_SIZE = 100
+# Параметров больше этого числа показываем сводкой по типам
+MAX_SHAPE_PARAMS = 10
+
+_WHITESPACE = re.compile(r"\s+")
+# Списки WHERE id IN (?, ?, ...) разной длины - это один и тот же запрос.
+# Только после IN: VALUES (?, ?, ?) разных вставок должны остаться разными
+_PLACEHOLDER_LIST = re.compile(r"(\bIN\s*\(\s*)\?(?:\s*,\s*\?)*(\s*\))", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize(query):
+    """Текст запроса без лишних пробелов и с одним ? вместо списка"""
+    query = _WHITESPACE.sub(" ", query).strip()
+    return _PLACEHOLDER_LIST.sub(r"\1?, ...\2", query)
+
+
+def param_shape(params):
+    """Типы параметров без их значений: в журнал не попадут пароли и ПДн"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+
+    names = [type(value).__name__ for value in params]
+    if len(names) <= MAX_SHAPE_PARAMS:
+        return names
+    counts = collections.Counter(names)
+    return [f"{name} x {count}" for name, count in counts.items()]
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class _QueryTiming:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = collections.deque(maxlen=QUERY_SAMPLES)
+
+
+class QueryStats:
+    """Время выполнения SQL по нормализованному тексту запроса.
+
+    Для каждого запроса копятся число вызовов, суммарное и максимальное
+    время, а процентили считаются по последним QUERY_SAMPLES замерам
+    только при чтении статистики. Запросы дольше slow_ms попадают в
+    журнал медленных с типами параметров и планом выполнения.
+    """
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS):
+        self.slow_ms = slow_ms
+        self._queries = {}
+        self._lock = threading.Lock()
+        self._slow = collections.deque(maxlen=SLOW_QUERY_LOG_SIZE)
+        # План одного и того же запроса не меняется, EXPLAIN выполняется раз
+        self._plans = {}
+
+    def record(self, query, seconds):
+        """Учесть выполнение запроса; True, если он медленный"""
+        key = normalize(query)
+        with self._lock:
+            timing = self._queries.get(key)
+            if timing is None:
+                timing = self._queries[key] = _QueryTiming()
+            timing.count += 1
+            timing.total += seconds
+            timing.max = max(timing.max, seconds)
+            timing.samples.append(seconds)
+        return 0 < self.slow_ms <= seconds * 1000
+
+    def known_plan(self, query):
+        """Сохраненный план запроса или None"""
+        return self._plans.get(normalize(query))
+
+    def log_slow(self, query, params, seconds, plan):
+        """Записать медленный запрос в журнал и вывести его"""
+        key = normalize(query)
+        self._plans[key] = plan
+        entry = {
+            "query": key,
+            "params": param_shape(params),
+            "ms": round(seconds * 1000, 3),
+            "plan": plan,
+            "at": time.time(),
+        }
+        with self._lock:
+            self._slow.append(entry)
+
+        print(f"🐢 Медленный запрос ({entry['ms']} мс): {key}")
+        print(f"   Параметры: {entry['params']}")
+        for line in plan:
+            print(f"   План: {line}")
+
+    def snapshot(self):
+        """Статистика запросов, начиная с самых затратных по сумме"""
+        with self._lock:
+            items = [
+                (key, timing.count, timing.total, timing.max, sorted(timing.samples))
+                for key, timing in self._queries.items()
+            ]
+
+        result = []
+        for key, count, total, longest, ordered in items:
+            result.append(
+                {
+                    "query": key,
+                    "count": count,
+                    "total_ms": round(total * 1000, 3),
+                    "avg_ms": round(total / count * 1000, 3),
+                    "p50_ms": round(_percentile(ordered, 0.5) * 1000, 3),
+                    "p95_ms": round(_percentile(ordered, 0.95) * 1000, 3),
+                    "p99_ms": round(_percentile(ordered, 0.99) * 1000, 3),
+                    "max_ms": round(longest * 1000, 3),
+                }
+            )
+        result.sort(key=lambda item: item["total_ms"], reverse=True)
+        return result
+
+    def slow_queries(self):
+        """Последние медленные запросы, новые в конце"""
+        with self._lock:
+            return list(self._slow)
+
+    def reset(self):
+        with self._lock:
+            self._queries.clear()
+            self._slow.clear()
+            self._plans.clear()
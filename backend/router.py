@@ -0,0 +1,125 @@
+def _parse_int(segment):
+    # int() принял бы и "+5", и " 5", и цифры других алфавитов
+    if not (segment.isascii() and segment.isdigit()):
+        raise ValueError(segment)
+    return int(segment)
+
+
+class Route:
+    """Маршрут: обработчик и требования к пользователю"""
+
+    def __init__(self, method, pattern, handler, auth=True, roles=None):
+        self.method = method
+        self.pattern = pattern
+        self.handler = handler
+        self.auth = auth
+        self.roles = frozenset(roles) if roles else None
+
+
+class _Node:
+    """Узел дерева маршрутов: один сегмент пути"""
+
+    def __init__(self):
+        self.children = {}
+        # Сегменты-параметры: (имя, преобразование, узел)
+        self.params = []
+        self.routes = {}
+
+
+class Router:
+    """Таблица маршрутов API.
+
+    Пути без параметров ищутся в словаре по (метод, путь). Пути с
+    параметрами вида <int:app_id> разбираются при регистрации в дерево
+    по сегментам, так что поиск не зависит от числа маршрутов, а
+    значения параметров сразу приводятся к нужному типу.
+    """
+
+    CONVERTERS = {"int": _parse_int, "str": str}
+
+    def __init__(self):
+        self._static = {}
+        self._root = _Node()
+
+    def add(self, method, pattern, handler, auth=True, roles=None):
+        """Зарегистрировать обработчик для метода и шаблона пути"""
+        route = Route(method, pattern, handler, auth, roles)
+        segments = pattern.strip("/").split("/")
+
+        if not any(segment.startswith("<") for segment in segments):
+            if (method, pattern) in self._static:
+                raise ValueError(f"Маршрут {method} {pattern} уже задан")
+            self._static[(method, pattern)] = route
+            return route
+
+        node = self._root
+        for segment in segments:
+            if segment.startswith("<") and segment.endswith(">"):
+                node = self._param_node(node, segment[1:-1], pattern)
+            else:
+                node = node.children.setdefault(segment, _Node())
+
+        if method in node.routes:
+            raise ValueError(f"Маршрут {method} {pattern} уже задан")
+        node.routes[method] = route
+        return route
+
+    def route(self, method, pattern, auth=True, roles=None):
+        """Декоратор для add()"""
+
+        def decorator(handler):
+            self.add(method, pattern, handler, auth, roles)
+            return handler
+
+        return decorator
+
+    def _param_node(self, node, spec, pattern):
+        converter_name, _, name = spec.rpartition(":")
+        converter = self.CONVERTERS.get(converter_name or "str")
+        if converter is None or not name.isidentifier():
+            raise ValueError(f"Некорректный параметр <{spec}> в {pattern}")
+
+        for param_name, param_converter, child in node.params:
+            if param_name == name and param_converter is converter:
+                return child
+
+        child = _Node()
+        node.params.append((name, converter, child))
+        return child
+
+    def match(self, method, path):
+        """Найти маршрут для запроса: (маршрут, параметры) или (None, None)"""
+        route = self._static.get((method, path))
+        if route is not None:
+            return route, {}
+
+        params = {}
+        route = self._match(self._root, method, path.strip("/").split("/"), 0, params)
+        if route is None:
+            return None, None
+        return route, params
+
+    def _match(self, node, method, segments, index, params):
+        if index == len(segments):
+            return node.routes.get(method)
+
+        segment = segments[index]
+        child = node.children.get(segment)
+        if child is not None:
+            found = self._match(child, method, segments, index + 1, params)
+            if found is not None:
+                return found
+
+        for name, converter, child in node.params:
+            if not segment:
+                break
+            try:
+                params[name] = converter(segment)
+            except ValueError:
+                continue
+            found = self._match(child, method, segments, index + 1, params)
+            if found is not None:
+                return found
+            del params[name]
+
+        return None
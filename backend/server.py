@@ -1,24 +1,281 @@
+import argparse
 import http.server
+import itertools
+import socket
 import socketserver
 import json
+import os
+import queue
+import selectors
+import signal
+import sys
+import threading
+import time
 import urllib.parse
-from database import db
+from database import db, decode_cursor, APPLICATION_FILTERS, MAX_PAGE_SIZE, PAGE_SIZE
 from auth import Auth
+from cache import etag_matches, response_cache
+from compression import COMPRESSION_MIN_SIZE, choose_encoding, compress, compressor
+from events import SocketSubscriber, event_hub
+from metrics import PHASES, counter, gauge, metrics
+from passwords import HasherBusy, password_hasher
+from router import Router
+
+if __name__ == "__main__":
+    # "python server.py": async_server делает "from server import ...", и без
+    # этого модуль выполнился бы второй раз - со своими auth, router и
+    # сборщиком метрик. Регистрируем запущенный модуль под его именем
+    sys.modules.setdefault("server", sys.modules[__name__])
 
 auth = Auth(db)
 
+# Размер пула обработчиков и длина очереди ожидающих соединений
+SERVER_WORKERS = int(os.environ.get("STRAHOVOCHKA_WORKERS", "8"))
+SERVER_QUEUE_SIZE = int(os.environ.get("STRAHOVOCHKA_QUEUE_SIZE", "64"))
+# Число процессов; больше одного включает многопроцессный режим
+SERVER_PROCESSES = int(os.environ.get("STRAHOVOCHKA_PROCESSES", "1"))
+# Пауза перед перезапуском процесса, упавшего сразу после старта
+WORKER_RESTART_DELAY = 1.0
+# Постоянные соединения: время ожидания следующего запроса и
+# максимальное число запросов на одном соединении
+KEEPALIVE_TIMEOUT = float(os.environ.get("STRAHOVOCHKA_KEEPALIVE_TIMEOUT", "5"))
+MAX_KEEPALIVE_REQUESTS = int(os.environ.get("STRAHOVOCHKA_KEEPALIVE_REQUESTS", "100"))
+# Очередь соединений в ядре до accept(); не связана с очередью к
+# обработчикам, чтобы при всплеске клиенты сразу получали 503, а не
+# повторяли SYN с нарастающей паузой
+LISTEN_BACKLOG = 1024
+# Допустимые статусы заявки
+APPLICATION_STATUSES = ("В процессе", "Обработана", "Отклонена")
+# Сколько заявок можно прислать в одном пакетном запросе
+MAX_BATCH_SIZE = int(os.environ.get("STRAHOVOCHKA_MAX_BATCH_SIZE", "5000"))
+# Наибольший размер поля details заявки в JSON, байты
+MAX_DETAILS_SIZE = 4 * 1024
+# Наибольшее тело запроса, байты (для обоих движков): полный пакет
+# заявок плюс запас на остальные поля каждой заявки
+MAX_BODY_SIZE = MAX_BATCH_SIZE * (MAX_DETAILS_SIZE + 1024)
+# Размер части потокового ответа (Transfer-Encoding: chunked)
+STREAM_CHUNK_SIZE = 16 * 1024
+# Движок: "threads" (socketserver и пул потоков) или "asyncio"
+SERVER_ENGINE = os.environ.get("STRAHOVOCHKA_ENGINE", "threads")
+ENGINES = ("threads", "asyncio")
+# /api/metrics без токена (для сборщика Prometheus во внутренней сети);
+# по умолчанию метрики видит только администратор
+METRICS_PUBLIC = os.environ.get("STRAHOVOCHKA_METRICS_PUBLIC", "0") == "1"
+
+
+class BadRequest(Exception):
+    """Ошибка во входных данных клиента: ответ с текстом ошибки (обычно 400)"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _json_list_chunks(key, rows, phases, extra=None):
+    """JSON {key: [...]} частями не меньше STREAM_CHUNK_SIZE (кроме последней).
+
+    Поля extra дописываются в объект после списка. Время сериализации
+    строк добавляется в phases["encode"].
+    """
+    buffer = bytearray(b"{%s: [" % json.dumps(key).encode("utf-8"))
+    separator = b""
+    for row in rows:
+        start = time.perf_counter()
+        buffer += separator + json.dumps(row, ensure_ascii=False).encode("utf-8")
+        phases["encode"] += time.perf_counter() - start
+        separator = b", "
+        if len(buffer) >= STREAM_CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b"]"
+    for name, value in (extra or {}).items():
+        buffer += b", %s: %s" % (
+            json.dumps(name).encode("utf-8"),
+            json.dumps(value).encode("utf-8"),
+        )
+    buffer += b"}"
+    yield bytes(buffer)
+
+
+def _validate_details(details):
+    """Ошибка в поле details заявки или None"""
+    if not isinstance(details, dict):
+        return "Поле details должно быть объектом"
+    size = len(json.dumps(details, ensure_ascii=False).encode("utf-8"))
+    if size > MAX_DETAILS_SIZE:
+        return f"Поле details не должно превышать {MAX_DETAILS_SIZE} байт"
+    return None
+
+
+def _validate_application(application, insurance_type_ids):
+    """Ошибка в заявке из пакета или None, если заявка корректна"""
+    if not isinstance(application, dict):
+        return "Заявка должна быть объектом"
+
+    for field in ["insurance_type_id", "insurance_subtype", "details"]:
+        if not application.get(field):
+            return f"Поле {field} обязательно"
+
+    # Список или объект в "in" по множеству дали бы TypeError на весь пакет
+    type_id = application["insurance_type_id"]
+    if not isinstance(type_id, int) or isinstance(type_id, bool):
+        return "Поле insurance_type_id должно быть числом"
+    if type_id not in insurance_type_ids:
+        return "Неизвестный тип страховки"
+    if not isinstance(application["insurance_subtype"], str):
+        return "Поле insurance_subtype должно быть строкой"
+    return _validate_details(application["details"])
+
+
+def _service_metrics():
+    """Метрики сессий, хеширования паролей и групповой фиксации"""
+    denylist = auth.get_metrics()
+    lines = gauge(
+        "revoked_tokens",
+        "Отозванные токены в памяти до истечения их срока",
+        denylist["live"],
+    )
+    lines += counter(
+        "revoked_tokens_removed_total",
+        "Записи, удаленные из списка отозванных токенов",
+        [
+            ({"reason": reason}, count)
+            for reason, count in sorted(denylist.items())
+            if reason != "live"
+        ],
+    )
+    lines += counter(
+        "password_hash_rejected_total",
+        "Входы и регистрации, отклоненные из-за занятого пула хеширования",
+        [(None, password_hasher.rejected)],
+    )
+    events = event_hub.get_metrics()
+    lines += gauge(
+        "event_subscribers",
+        "Подписчики потока событий /api/events",
+        events["subscribers"],
+    )
+    lines += counter(
+        "events_sent_total",
+        "События, отправленные подписчикам",
+        [(None, events["sent"])],
+    )
+    lines += counter(
+        "event_subscribers_closed_total",
+        "Отключенные подписчики событий: ушли сами или не успевали читать",
+        [
+            ({"reason": reason}, count)
+            for reason, count in sorted(events["closed"].items())
+        ],
+    )
+    writer = db._writer
+    if writer is not None:
+        lines += counter(
+            "group_commit_groups_total",
+            "Транзакции групповой фиксации",
+            [(None, writer.groups)],
+        )
+        lines += counter(
+            "group_commit_statements_total",
+            "Записи, зафиксированные группами",
+            [(None, writer.statements)],
+        )
+    return lines
+
+
+metrics.add_collector(_service_metrics)
+
+# Маршруты API регистрируются декоратором router.route у методов APIHandler
+router = Router()
+
 
 class APIHandler(http.server.BaseHTTPRequestHandler):
-    def _set_headers(self, status_code=200, content_type="application/json"):
+    # Постоянные соединения: несколько запросов SPA идут по одному TCP
+    protocol_version = "HTTP/1.1"
+    # Сколько ждать следующий запрос на открытом соединении
+    timeout = KEEPALIVE_TIMEOUT
+    # Заголовки и тело уходят отдельными send(): без TCP_NODELAY ответ
+    # на постоянном соединении ждал бы отложенного ACK клиента
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        # Счетчик запросов соединения переживает ожидание в селекторе сервера
+        resume = getattr(self.server, "resume", None)
+        self.requests_handled = resume(self.connection) if resume else 0
+        super().handle()
+
+    def handle_one_request(self):
+        # Следующего запроса еще нет: соединение ждет его в селекторе
+        # сервера, а поток возвращается в пул
+        park = getattr(self.server, "park", None)
+        if park is not None and not self._request_pending():
+            park(self.connection, self.client_address, self.requests_handled)
+            self.close_connection = True
+            return
+        super().handle_one_request()
+
+    def _request_pending(self):
+        """Пришли ли байты следующего запроса (или закрытие), без ожидания"""
+        self.connection.settimeout(0)
+        try:
+            try:
+                self.connection.recv(1, socket.MSG_PEEK)
+                return True
+            except BlockingIOError:
+                pass
+            # Запрос мог уже целиком лежать в буфере rfile (конвейер)
+            return bool(self.rfile.peek(1))
+        except OSError:
+            # Ошибку сокета покажет обычное чтение запроса
+            return True
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def parse_request(self):
+        # Отсчет времени запроса начинается с прочитанной строки запроса:
+        # ожидание на постоянном соединении в него не входит
+        self._started = time.perf_counter()
+        self._body = None
+        return super().parse_request()
+
+    def _set_headers(
+        self,
+        status_code=200,
+        content_type="application/json",
+        headers=None,
+        content_length=0,
+    ):
+        # Непрочитанное тело запроса сломало бы разбор следующего запроса
+        self._read_body()
+        self._response_status = status_code
         self.send_response(status_code)
         self.send_header("Content-type", content_type)
+        if content_length is not None:
+            self.send_header("Content-Length", str(content_length))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.send_header("Access-Control-Allow-Origin", "*")
         self.send_header(
             "Access-Control-Allow-Methods", "GET, POST, PUT, DELETE, OPTIONS"
         )
         self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
+        if not self._keep_alive():
+            self.send_header("Connection", "close")
         self.end_headers()
 
+    def _keep_alive(self):
+        """Можно ли оставить соединение открытым после этого ответа"""
+        self.requests_handled = getattr(self, "requests_handled", 0) + 1
+        if self.requests_handled >= MAX_KEEPALIVE_REQUESTS:
+            return False
+        # Клиент попросил закрыть или запрос нельзя дочитать
+        if getattr(self, "close_connection", False):
+            return False
+
+        # При остановке сервер закрывает соединения после текущего ответа
+        stopping = getattr(getattr(self, "server", None), "stopping", None)
+        return not (stopping and stopping())
+
     def do_OPTIONS(self):
         self._set_headers(200)
 
@@ -39,273 +296,935 @@ class APIHandler(http.server.BaseHTTPRequestHandler):
 
         return token_data, None
 
+    def _read_body(self):
+        """Тело запроса (читается из сокета один раз)"""
+        if getattr(self, "_body", None) is None:
+            # Тело без Content-Length (chunked) не поддерживается: 411,
+            # как и в движке asyncio
+            if "Transfer-Encoding" in self.headers:
+                self._body = b""
+                self.close_connection = True
+                raise BadRequest("Нужен заголовок Content-Length", 411)
+            try:
+                content_length = int(self.headers.get("Content-Length", 0))
+            except ValueError:
+                content_length = -1
+            if content_length < 0:
+                # Где кончается тело, неизвестно: соединение не продолжить
+                self._body = b""
+                self.close_connection = True
+                raise BadRequest("Некорректный заголовок Content-Length")
+            if content_length > MAX_BODY_SIZE:
+                # Тело не читаем, поэтому соединение тоже не продолжить
+                self._body = b""
+                self.close_connection = True
+                raise BadRequest(
+                    f"Тело запроса не должно превышать {MAX_BODY_SIZE} байт", 413
+                )
+            self._body = self.rfile.read(content_length) if content_length else b""
+        return self._body
+
     def _parse_body(self):
-        content_length = int(self.headers.get("Content-Length", 0))
-        if content_length == 0:
+        body = self._read_body()
+        if not body:
             return {}
 
-        body = self.rfile.read(content_length)
+        start = time.perf_counter()
         try:
             return json.loads(body.decode("utf-8"))
         except:
             return {}
+        finally:
+            self._phases["parse"] += time.perf_counter() - start
 
-    def _send_json(self, data, status_code=200):
-        self._set_headers(status_code)
-        self.wfile.write(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+    def _get_page_params(self, query):
+        """Параметры limit и cursor из строки запроса.
 
-    def _send_error(self, message, status_code=400):
-        self._send_json({"error": message}, status_code)
-
-    def do_GET(self):
-        parsed_path = urllib.parse.urlparse(self.path)
-        path = parsed_path.path
+        Возвращает None, если клиент не просил постраничную выдачу.
+        """
+        if "limit" not in query and "cursor" not in query:
+            return None
 
         try:
-            if path == "/":
-                self._send_json(
-                    {
-                        "message": 'API системы "Страховочка"',
-                        "version": "1.0",
-                        "endpoints": [
-                            "/api/login",
-                            "/api/register",
-                            "/api/insurance-types",
-                        ],
-                    }
-                )
-                return
-
-            elif path == "/api/insurance-types":
-                types = db.get_insurance_types()
-                self._send_json({"insurance_types": types})
-                return
-
-            elif path == "/api/managers":
-                managers = db.get_managers()
-                self._send_json({"managers": managers})
-                return
-
-            token_data, error = self._authenticate()
-            if error:
-                self._send_error(error, 401)
-                return
-
-            if path == "/api/me":
-                user = db.get_user_by_id(token_data["user_id"])
-                self._send_json({"user": user})
-
-            elif path == "/api/users":
-                if token_data["role"] not in ["admin", "manager"]:
-                    self._send_error("Недостаточно прав", 403)
-                    return
-                users = db.get_all_users()
-                self._send_json({"users": users})
-
-            elif path == "/api/applications":
-                applications = db.get_applications(
-                    token_data["user_id"], token_data["role"]
-                )
-                self._send_json({"applications": applications})
+            limit = int(query.get("limit", [PAGE_SIZE])[0])
+        except ValueError:
+            raise BadRequest("Параметр limit должен быть числом")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise BadRequest(f"Параметр limit должен быть от 1 до {MAX_PAGE_SIZE}")
+
+        cursor = query.get("cursor", [None])[0]
+        if cursor:
+            try:
+                decode_cursor(cursor)
+            except ValueError as e:
+                raise BadRequest(str(e))
+        return limit, cursor
+
+    def _get_application_filters(self, query):
+        """Фильтры списка заявок по полям details из строки запроса"""
+        filters = {}
+        for name, (field, _) in APPLICATION_FILTERS.items():
+            if name not in query:
+                continue
+            value = query[name][0].strip()
+            if field == "year":
+                try:
+                    value = int(value)
+                except ValueError:
+                    raise BadRequest(f"Параметр {name} должен быть числом")
+            filters[name] = value
+        return filters or None
+
+    def _negotiate_encoding(self, size, headers):
+        """Сжатие для ответа размера size: кодировка или None.
+
+        Добавляет в headers Vary и, если клиент принимает сжатие,
+        Content-Encoding.
+        """
+        if size < COMPRESSION_MIN_SIZE:
+            return None
+
+        headers["Vary"] = "Accept-Encoding"
+        encoding = choose_encoding(self.headers.get("Accept-Encoding"))
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return encoding
+
+    def _send_body(
+        self, body, status_code=200, headers=None, content_type="application/json"
+    ):
+        headers = dict(headers or {})
+        # Ответы из кэша приходят уже сжатыми под клиента (и с Vary)
+        if "Vary" not in headers and self._negotiate_encoding(len(body), headers):
+            start = time.perf_counter()
+            body = compress(body, headers["Content-Encoding"])
+            self._phases["encode"] += time.perf_counter() - start
+
+        # У ответа 304 тела нет по определению, длину не указываем
+        content_length = None if status_code == 304 else len(body)
+        self._set_headers(
+            status_code, content_type, headers=headers, content_length=content_length
+        )
+        if body:
+            self._response_bytes += len(body)
+            self.wfile.write(body)
 
-            else:
-                self._send_error("Маршрут не найден", 404)
+    def _send_json(self, data, status_code=200):
+        start = time.perf_counter()
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self._phases["encode"] += time.perf_counter() - start
+        self._send_body(body, status_code)
+
+    def _write_chunk(self, data):
+        """Часть ответа с Transfer-Encoding: chunked; пустая завершает ответ"""
+        self.wfile.write(b"%X\r\n%s\r\n" % (len(data), data))
+
+    def _send_json_stream(self, key, rows, extra=None):
+        """Ответ {key: [...], **extra}, который пишется частями по мере чтения строк.
+
+        Ни список строк, ни JSON целиком в памяти не собираются. Если
+        список уместился в одну часть, или клиенту HTTP/1.0 chunked
+        недоступен, ответ уходит обычным образом, с Content-Length.
+        """
+        if self.request_version != "HTTP/1.1":
+            self._send_json({key: list(rows), **(extra or {})})
+            return
+
+        # Ошибка запроса проявится здесь, пока еще можно ответить 500
+        chunks = _json_list_chunks(key, rows, self._phases, extra)
+        first = next(chunks)
+        second = next(chunks, None)
+        if second is None:
+            self._send_body(first)
+            return
+
+        headers = {"Transfer-Encoding": "chunked"}
+        encoding = self._negotiate_encoding(len(first) + len(second), headers)
+        stream = compressor(encoding) if encoding else None
+        self._set_headers(headers=headers, content_length=None)
 
+        try:
+            for chunk in itertools.chain((first, second), chunks):
+                if stream is not None:
+                    start = time.perf_counter()
+                    chunk = stream.compress(chunk)
+                    self._phases["encode"] += time.perf_counter() - start
+                # Пустая часть означала бы конец ответа
+                if chunk:
+                    self._response_bytes += len(chunk)
+                    self._write_chunk(chunk)
+            if stream is not None:
+                chunk = stream.flush()
+                self._response_bytes += len(chunk)
+                self._write_chunk(chunk)
+            self._write_chunk(b"")
         except Exception as e:
-            print(f"Ошибка обработки GET {path}: {e}")
-            self._send_error("Внутренняя ошибка сервера", 500)
-
-    def do_POST(self):
-        path = urllib.parse.urlparse(self.path).path
+            # Заголовки уже ушли: обрываем соединение без завершающей части,
+            # и клиент увидит, что ответ неполный
+            print(f"Ошибка потоковой отправки {self.path}: {e}")
+            self.close_connection = True
+
+    def _send_cached(self, key, version_name, load):
+        """Ответ со справочными данными из кэша с поддержкой ETag/304"""
+        version = db.get_data_version(version_name)
+        if version is None:
+            self._send_json({key: load()})
+            return
+
+        entry = response_cache.get(
+            key,
+            version,
+            lambda: json.dumps({key: load()}, ensure_ascii=False).encode("utf-8"),
+        )
+        headers = {"Cache-Control": "no-cache"}
+        encoding = self._negotiate_encoding(len(entry.body), headers)
+        body, etag = entry.encoded(encoding)
+        headers["ETag"] = etag
 
-        try:
-            data = self._parse_body()
+        if etag_matches(self.headers.get("If-None-Match"), etag):
+            headers.pop("Content-Encoding", None)
+            self._send_body(b"", 304, headers)
+        else:
+            self._send_body(body, 200, headers)
 
-            if path == "/api/login":
-                if not data.get("username") or not data.get("password"):
-                    self._send_error("Необходимы логин и пароль", 400)
-                    return
+    def _send_error(self, message, status_code=400):
+        self._send_json({"error": message}, status_code)
 
-                result, error = auth.login(data["username"], data["password"])
-                if error:
-                    self._send_error(error, 401)
-                else:
-                    self._send_json(result, 200)
+    def _dispatch(self):
+        """Найти маршрут запроса, проверить права и вызвать обработчик.
+
+        Попутно замеряет фазы запроса для /api/metrics: разбор (путь,
+        маршрут, JSON тела), проверку токена, время в базе и кодирование
+        ответа (JSON и сжатие).
+        """
+        started = getattr(self, "_started", None) or time.perf_counter()
+        self._phases = dict.fromkeys(PHASES, 0.0)
+        self._response_status = None
+        self._response_bytes = 0
+        db_started = db.db_time()
+        route = None
+        metrics.request_started()
 
-            elif path == "/api/register":
-                required = ["username", "password", "full_name", "email", "role"]
-                for field in required:
-                    if not data.get(field):
-                        self._send_error(f"Поле {field} обязательно", 400)
-                        return
+        parsed_path = urllib.parse.urlparse(self.path)
+        path = parsed_path.path
+        self.query = urllib.parse.parse_qs(parsed_path.query)
 
-                result, error = auth.register(data)
-                if error:
-                    self._send_error(error, 400)
-                else:
-                    self._send_json(result, 201)
+        try:
+            route, params = router.match(self.command, path)
+            now = time.perf_counter()
+            self._phases["parse"] += now - started
+            if route is None:
+                self._send_error("Маршрут не найден", 404)
+                return
 
-            elif path == "/api/applications":
+            token_data = None
+            if route.auth:
                 token_data, error = self._authenticate()
+                self._phases["auth"] += time.perf_counter() - now
                 if error:
                     self._send_error(error, 401)
                     return
+                if route.roles and token_data["role"] not in route.roles:
+                    self._send_error("Недостаточно прав", 403)
+                    return
 
-                required = ["insurance_type_id", "insurance_subtype", "details"]
-                for field in required:
-                    if not data.get(field):
-                        self._send_error(f"Поле {field} обязательно", 400)
-                        return
-
-                data["client_id"] = token_data["user_id"]
-                result = db.create_application(data)
-
-                if result:
-                    self._send_json(
-                        {"message": "Заявка создана", "application_id": result["id"]},
-                        201,
-                    )
-                else:
-                    self._send_error("Ошибка создания заявки", 500)
-
-            elif path == "/api/logout":
-                token = self._get_token()
-                if token:
-                    auth.logout(token)
-                self._send_json({"message": "Выход выполнен"})
-
-            else:
-                self._send_error("Маршрут не найден", 404)
-
+            route.handler(self, token_data, **params)
+
+        except HasherBusy:
+            # Всплеск входов не должен занимать обработчики остальных запросов
+            self._send_body(
+                json.dumps(
+                    {"error": "Сервер перегружен, повторите запрос позже"},
+                    ensure_ascii=False,
+                ).encode("utf-8"),
+                503,
+                {"Retry-After": "1"},
+            )
+        except BadRequest as e:
+            self._send_error(str(e), e.status)
         except Exception as e:
-            print(f"Ошибка обработки POST {path}: {e}")
+            print(f"Ошибка обработки {self.command} {path}: {e}")
             self._send_error("Внутренняя ошибка сервера", 500)
+        finally:
+            self._phases["db"] = db.db_time() - db_started
+            metrics.request_finished(
+                self.command,
+                route.pattern if route is not None else None,
+                self._response_status or 500,
+                time.perf_counter() - started,
+                self._phases,
+                len(self._body or b""),
+                self._response_bytes,
+            )
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+    @router.route("GET", "/", auth=False)
+    def get_index(self, token_data):
+        self._send_json(
+            {
+                "message": 'API системы "Страховочка"',
+                "version": "1.0",
+                "endpoints": [
+                    "/api/login",
+                    "/api/register",
+                    "/api/insurance-types",
+                ],
+            }
+        )
 
-    def do_PUT(self):
-        path = urllib.parse.urlparse(self.path).path
+    @router.route("GET", "/api/insurance-types", auth=False)
+    def get_insurance_types(self, token_data):
+        self._send_cached("insurance_types", "insurance_types", db.get_insurance_types)
+
+    @router.route("GET", "/api/managers", auth=False)
+    def get_managers(self, token_data):
+        self._send_cached("managers", "users", db.get_managers)
+
+    @router.route("GET", "/api/me")
+    def get_me(self, token_data):
+        user = db.get_user_by_id(token_data["user_id"])
+        self._send_json({"user": user})
+
+    @router.route("GET", "/api/users", roles=("admin", "manager"))
+    def get_users(self, token_data):
+        page = self._get_page_params(self.query)
+        if page is None:
+            self._send_json_stream("users", db.iter_all_users())
+            return
+
+        limit, cursor = page
+        users, next_cursor = db.get_all_users_page(limit, cursor)
+        self._send_json({"users": users, "next_cursor": next_cursor})
+
+    @router.route("GET", "/api/applications")
+    def get_applications(self, token_data):
+        filters = self._get_application_filters(self.query)
+        if "since" in self.query:
+            self._send_application_changes(token_data, filters)
+            return
+
+        # Номер изменений берется до чтения списка: с него клиент
+        # продолжит синхронизацию через since=
+        seq = db.get_data_version("applications")
+        page = self._get_page_params(self.query)
+        if page is None:
+            self._send_json_stream(
+                "applications",
+                db.iter_applications(
+                    token_data["user_id"], token_data["role"], filters
+                ),
+                {"seq": seq},
+            )
+            return
+
+        limit, cursor = page
+        applications, next_cursor = db.get_applications_page(
+            token_data["user_id"], token_data["role"], limit, cursor, filters
+        )
+        self._send_json(
+            {"applications": applications, "next_cursor": next_cursor, "seq": seq}
+        )
 
+    def _send_application_changes(self, token_data, filters):
+        """Заявки, измененные после since, и id удаленных или скрытых"""
+        if filters or "cursor" in self.query:
+            raise BadRequest("Параметр since нельзя сочетать с фильтрами и cursor")
         try:
-            token_data, error = self._authenticate()
-            if error:
-                self._send_error(error, 401)
-                return
-
-            data = self._parse_body()
-
-            if path.startswith("/api/applications/") and "/status" in path:
-                if token_data["role"] not in ["admin", "manager"]:
-                    self._send_error("Недостаточно прав", 403)
-                    return
-
-                app_id = int(path.split("/")[3])
-                new_status = data.get("status")
-
-                if new_status not in ["В процессе", "Обработана", "Отклонена"]:
-                    self._send_error("Неверный статус", 400)
-                    return
+            since = int(self.query["since"][0])
+            limit = int(self.query.get("limit", [MAX_PAGE_SIZE])[0])
+        except ValueError:
+            raise BadRequest("Параметры since и limit должны быть числами")
+        if since < 0:
+            raise BadRequest("Параметр since не может быть отрицательным")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise BadRequest(f"Параметр limit должен быть от 1 до {MAX_PAGE_SIZE}")
+
+        changes = db.get_application_changes(
+            token_data["user_id"], token_data["role"], since, limit
+        )
+        if changes is None:
+            self._send_error("Ошибка получения изменений", 500)
+            return
+        self._send_json(changes)
+
+    @router.route("GET", "/api/applications/search")
+    def search_applications(self, token_data):
+        """Поиск заявок по словам, от более релевантных к менее"""
+        text = self.query.get("q", [""])[0].strip()
+        if not text:
+            raise BadRequest("Параметр q обязателен")
 
-                result = db.update_application_status(
-                    app_id, new_status, token_data["user_id"]
-                )
+        try:
+            limit = int(self.query.get("limit", [PAGE_SIZE])[0])
+            offset = int(self.query.get("offset", [0])[0])
+        except ValueError:
+            raise BadRequest("Параметры limit и offset должны быть числами")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise BadRequest(f"Параметр limit должен быть от 1 до {MAX_PAGE_SIZE}")
+        if offset < 0:
+            raise BadRequest("Параметр offset не может быть отрицательным")
+
+        applications, next_offset = db.search_applications(
+            token_data["user_id"], token_data["role"], text, limit, offset
+        )
+        if applications is None:
+            self._send_error("Ошибка поиска", 500)
+            return
+        self._send_json({"applications": applications, "next_offset": next_offset})
+
+    @router.route("GET", "/api/events")
+    def get_events(self, token_data):
+        """Поток событий о новых заявках и сменах статуса (text/event-stream)"""
+        if self.request_version != "HTTP/1.1":
+            raise BadRequest("Поток событий доступен только по HTTP/1.1")
+        if not event_hub.accepting():
+            self._send_body(
+                json.dumps(
+                    {"error": "Слишком много подписчиков, повторите позже"},
+                    ensure_ascii=False,
+                ).encode("utf-8"),
+                503,
+                {"Retry-After": "5"},
+            )
+            return
+
+        self._set_headers(
+            200,
+            "text/event-stream",
+            {"Cache-Control": "no-cache", "Transfer-Encoding": "chunked"},
+            content_length=None,
+        )
+        self._subscribe_events(token_data)
+
+    def _subscribe_events(self, token_data):
+        """Передать соединение хабу событий; поток пула сразу освобождается"""
+        self.close_connection = True
+        self.wfile.flush()
+        self.server.detach(self.connection)
+        subscriber = SocketSubscriber(
+            self.connection, token_data["user_id"], token_data["role"]
+        )
+        if not event_hub.subscribe(subscriber):
+            subscriber.close()
+
+    @router.route("GET", "/api/stats")
+    def get_stats(self, token_data):
+        """Число заявок по статусам (администратору - еще по типам и менеджерам)"""
+        if token_data["role"] == "admin":
+            stats = db.get_application_stats()
+        else:
+            stats = db.get_application_status_counts(
+                token_data["user_id"], token_data["role"]
+            )
+        if stats is None:
+            self._send_error("Ошибка получения статистики", 500)
+            return
+        self._send_json(stats)
+
+    @router.route("POST", "/api/stats/check", roles=("admin",))
+    def check_stats(self, token_data):
+        """Сверить сводку с заявками и пересобрать ее при расхождениях.
+
+        ?rebuild=0 только сообщает о расхождениях.
+        """
+        rebuild = self.query.get("rebuild", ["1"])[0] != "0"
+        mismatches = db.check_application_stats(rebuild)
+        self._send_json(
+            {"mismatches": mismatches, "rebuilt": bool(mismatches) and rebuild}
+        )
 
-                if result:
-                    self._send_json({"message": "Статус обновлен"})
-                else:
-                    self._send_error("Заявка не найдена", 404)
+    @router.route("GET", "/api/metrics", auth=not METRICS_PUBLIC, roles=("admin",))
+    def get_metrics(self, token_data):
+        """Метрики процесса в текстовом формате Prometheus.
 
-            elif path.startswith("/api/users/"):
-                user_id = int(path.split("/")[-1])
+        В режиме --processes у каждого процесса свои счетчики: ответ
+        описывает тот процесс, которому ядро отдало соединение.
+        """
+        self._send_body(
+            metrics.render().encode("utf-8"),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
 
-                if token_data["role"] != "admin" and token_data["user_id"] != user_id:
-                    self._send_error("Недостаточно прав", 403)
-                    return
+    @router.route("GET", "/api/query-stats", roles=("admin",))
+    def get_query_stats(self, token_data):
+        """Время SQL-запросов этого процесса и журнал медленных"""
+        self._send_json(
+            {
+                "slow_query_ms": db.query_stats.slow_ms,
+                "queries": db.query_stats.snapshot(),
+                "slow_queries": db.query_stats.slow_queries(),
+            }
+        )
 
-                update_fields = []
-                params = []
-
-                allowed_fields = [
-                    "full_name",
-                    "age",
-                    "phone",
-                    "email",
-                    "address",
-                    "passport_data",
-                ]
-
-                for field in allowed_fields:
-                    if field in data:
-                        update_fields.append(f"{field} = ?")
-                        params.append(data[field])
-
-                if token_data["role"] == "admin":
-                    if "role" in data:
-                        update_fields.append("role = ?")
-                        params.append(data["role"])
-                    if "manager_id" in data:
-                        update_fields.append("manager_id = ?")
-                        params.append(data["manager_id"])
-
-                if not update_fields:
-                    self._send_error("Нет данных для обновления", 400)
-                    return
+    @router.route("DELETE", "/api/query-stats", roles=("admin",))
+    def reset_query_stats(self, token_data):
+        """Начать сбор статистики запросов заново (например, перед замером)"""
+        db.query_stats.reset()
+        self._send_json({"message": "Статистика запросов сброшена"})
 
-                params.append(user_id)
-                query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = ?"
+    @router.route("POST", "/api/login", auth=False)
+    def login(self, token_data):
+        data = self._parse_body()
+        if not data.get("username") or not data.get("password"):
+            self._send_error("Необходимы логин и пароль", 400)
+            return
 
-                db.execute_query(query, tuple(params))
-                self._send_json({"message": "Данные обновлены"})
+        result, error = auth.login(data["username"], data["password"])
+        if error:
+            self._send_error(error, 401)
+        else:
+            self._send_json(result, 200)
+
+    @router.route("POST", "/api/register", auth=False)
+    def register(self, token_data):
+        data = self._parse_body()
+        required = ["username", "password", "full_name", "email", "role"]
+        for field in required:
+            if not data.get(field):
+                self._send_error(f"Поле {field} обязательно", 400)
+                return
 
+        result, error = auth.register(data)
+        if error:
+            self._send_error(error, 400)
+        else:
+            self._send_json(result, 201)
+
+    @router.route("POST", "/api/applications")
+    def create_application(self, token_data):
+        data = self._parse_body()
+        required = ["insurance_type_id", "insurance_subtype", "details"]
+        for field in required:
+            if not data.get(field):
+                self._send_error(f"Поле {field} обязательно", 400)
+                return
+        error = _validate_details(data["details"])
+        if error:
+            self._send_error(error, 400)
+            return
+
+        data["client_id"] = token_data["user_id"]
+        result = db.create_application(data)
+
+        if result:
+            self._send_json(
+                {"message": "Заявка создана", "application_id": result["id"]},
+                201,
+            )
+        else:
+            self._send_error("Ошибка создания заявки", 500)
+
+    @router.route("POST", "/api/applications/batch")
+    def create_applications_batch(self, token_data):
+        data = self._parse_body()
+        applications = data.get("applications") if isinstance(data, dict) else None
+        if not isinstance(applications, list) or not applications:
+            self._send_error("Поле applications должно быть непустым списком", 400)
+            return
+        if len(applications) > MAX_BATCH_SIZE:
+            self._send_error(f"Не больше {MAX_BATCH_SIZE} заявок за один запрос", 400)
+            return
+
+        # Проверяем весь пакет до вставки; некорректные заявки не мешают
+        # остальным, а попадают в результаты с описанием ошибки
+        insurance_type_ids = {t["id"] for t in db.get_insurance_types() or []}
+        results = []
+        valid = []
+        for index, application in enumerate(applications):
+            error = _validate_application(application, insurance_type_ids)
+            if error:
+                results.append({"index": index, "error": error})
             else:
-                self._send_error("Маршрут не найден", 404)
-
-        except Exception as e:
-            print(f"Ошибка обработки PUT {path}: {e}")
-            self._send_error("Внутренняя ошибка сервера", 500)
+                valid.append(index)
 
-    def do_DELETE(self):
-        path = urllib.parse.urlparse(self.path).path
+        ids = db.create_applications(
+            token_data["user_id"], [applications[index] for index in valid]
+        )
+        if ids is None:
+            self._send_error("Ошибка создания заявок", 500)
+            return
+
+        for index, application_id in zip(valid, ids):
+            results.append({"index": index, "application_id": application_id})
+        results.sort(key=lambda result: result["index"])
+
+        self._send_json(
+            {
+                "created": len(valid),
+                "failed": len(applications) - len(valid),
+                "results": results,
+            },
+            201 if valid else 400,
+        )
 
-        try:
-            token_data, error = self._authenticate()
-            if error:
-                self._send_error(error, 401)
+    @router.route("POST", "/api/logout", auth=False)
+    def logout(self, token_data):
+        token = self._get_token()
+        if token:
+            auth.logout(token)
+        self._send_json({"message": "Выход выполнен"})
+
+    @router.route(
+        "PUT", "/api/applications/<int:app_id>/status", roles=("admin", "manager")
+    )
+    def update_application_status(self, token_data, app_id):
+        data = self._parse_body()
+        new_status = data.get("status")
+
+        if new_status not in APPLICATION_STATUSES:
+            self._send_error("Неверный статус", 400)
+            return
+
+        result = db.update_application_status(app_id, new_status, token_data["user_id"])
+
+        if result:
+            self._send_json({"message": "Статус обновлен"})
+        else:
+            self._send_error("Заявка не найдена", 404)
+
+    @router.route("PUT", "/api/applications/status", roles=("admin", "manager"))
+    def update_applications_status(self, token_data):
+        data = self._parse_body()
+        items = data.get("items") if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            self._send_error("Поле items должно быть непустым списком", 400)
+            return
+        if len(items) > MAX_BATCH_SIZE:
+            self._send_error(f"Не больше {MAX_BATCH_SIZE} заявок за один запрос", 400)
+            return
+
+        # Пакет применяется целиком или не применяется вовсе, поэтому
+        # любая ошибка в нем отклоняет весь запрос
+        updates = {}
+        for item in items:
+            app_id = item.get("id") if isinstance(item, dict) else None
+            if not isinstance(app_id, int) or isinstance(app_id, bool):
+                self._send_error("Некорректный id заявки", 400)
                 return
+            if item.get("status") not in APPLICATION_STATUSES:
+                self._send_error("Неверный статус", 400)
+                return
+            if app_id in updates:
+                self._send_error(f"Заявка #{app_id} указана дважды", 400)
+                return
+            updates[app_id] = item["status"]
 
-            if path.startswith("/api/users/"):
-                if token_data["role"] != "admin":
-                    self._send_error("Недостаточно прав", 403)
-                    return
-
-                user_id = int(path.split("/")[-1])
-
-                if token_data["user_id"] == user_id:
-                    self._send_error("Нельзя удалить самого себя", 400)
-                    return
-
-                result = db.delete_user(user_id)
-                if result:
-                    self._send_json({"message": "Пользователь удален"})
-                else:
-                    self._send_error("Ошибка удаления", 500)
-
-            else:
-                self._send_error("Маршрут не найден", 404)
+        # Менеджер меняет только свои и еще не назначенные заявки
+        rows = db.update_applications_status(
+            list(updates.items()),
+            token_data["user_id"],
+            own_only=token_data["role"] == "manager",
+        )
+        if rows is None:
+            self._send_error("Ошибка обновления статусов", 500)
+            return
+
+        changed = {row["id"] for row in rows}
+        self._send_json(
+            {
+                "applications": rows,
+                "skipped": [app_id for app_id in updates if app_id not in changed],
+            }
+        )
 
-        except Exception as e:
-            print(f"Ошибка обработки DELETE {path}: {e}")
-            self._send_error("Внутренняя ошибка сервера", 500)
+    @router.route("PUT", "/api/users/<int:user_id>")
+    def update_user(self, token_data, user_id):
+        if token_data["role"] != "admin" and token_data["user_id"] != user_id:
+            self._send_error("Недостаточно прав", 403)
+            return
+
+        data = self._parse_body()
+        update_fields = []
+        params = []
+
+        allowed_fields = [
+            "full_name",
+            "age",
+            "phone",
+            "email",
+            "address",
+            "passport_data",
+        ]
+
+        for field in allowed_fields:
+            if field in data:
+                update_fields.append(f"{field} = ?")
+                params.append(data[field])
+
+        if token_data["role"] == "admin":
+            if "role" in data:
+                update_fields.append("role = ?")
+                params.append(data["role"])
+            if "manager_id" in data:
+                update_fields.append("manager_id = ?")
+                params.append(data["manager_id"])
+
+        if not update_fields:
+            self._send_error("Нет данных для обновления", 400)
+            return
+
+        params.append(user_id)
+        query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = ?"
+
+        db.execute_query(query, tuple(params))
+        # Роль записана в выданных токенах: старые токены отзываем
+        if token_data["role"] == "admin" and "role" in data:
+            auth.revoke_user(user_id)
+        self._send_json({"message": "Данные обновлены"})
+
+    @router.route("DELETE", "/api/users/<int:user_id>", roles=("admin",))
+    def delete_user(self, token_data, user_id):
+        if token_data["user_id"] == user_id:
+            self._send_error("Нельзя удалить самого себя", 400)
+            return
+
+        result = db.delete_user(user_id)
+        if result:
+            auth.revoke_user(user_id)
+            self._send_json({"message": "Пользователь удален"})
+        else:
+            self._send_error("Ошибка удаления", 500)
 
     def log_message(self, format, *args):
         pass
 
 
-def run_server(port=5000):
-    handler = APIHandler
-    httpd = socketserver.TCPServer(("", port), handler)
+class PooledHTTPServer(socketserver.TCPServer):
+    """TCP-сервер с ограниченным пулом рабочих потоков.
+
+    Принятые соединения попадают в очередь фиксированной длины и
+    разбираются рабочими потоками. Если очередь заполнена, клиент сразу
+    получает 503, а не ждет бесконечно. При остановке сервер перестает
+    принимать соединения и дожидается обработки уже принятых.
+
+    Постоянное соединение между запросами не занимает поток: обработчик
+    отдает его серверу (park), отдельный поток ждет следующего запроса в
+    selectors и возвращает соединение в очередь, а молчащие дольше
+    KEEPALIVE_TIMEOUT закрывает.
+    """
+
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        server_address,
+        handler_class,
+        workers=SERVER_WORKERS,
+        queue_size=SERVER_QUEUE_SIZE,
+        reuse_port=False,
+    ):
+        self.reuse_port = reuse_port
+        self.workers = max(1, workers)
+        self.request_queue_size = max(LISTEN_BACKLOG, queue_size)
+        self._requests = queue.Queue(maxsize=max(1, queue_size))
+        self._threads = []
+        self._stopping = False
+        self._idle_lock = threading.Lock()
+        # Соединения, которые обработчик передал хабу событий
+        self._detached = set()
+        # Соединения между запросами: отданные обработчиком (ждут конца
+        # обработки), ждущие в селекторе и число обслуженных запросов
+        self._parking = {}
+        self._idle = {}
+        self._handled = {}
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._new_idle = []
+        super().__init__(server_address, handler_class)
+
+        self._idle_thread = threading.Thread(
+            target=self._idle_loop, name="api-keepalive", daemon=True
+        )
+        self._idle_thread.start()
+
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker, name=f"api-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def server_bind(self):
+        # Несколько процессов слушают один порт, ядро делит между ними
+        # входящие соединения
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def process_request(self, request, client_address):
+        try:
+            self._requests.put_nowait((request, client_address))
+        except queue.Full:
+            self._reject(request)
+
+    def stopping(self):
+        """Сервер останавливается: новых запросов на соединениях не ждем"""
+        return self._stopping
+
+    def park(self, request, client_address, requests_handled):
+        """Вернуть соединение серверу до следующего запроса.
+
+        В селектор оно попадет в shutdown_request, когда обработчик
+        закончит с ним работу.
+        """
+        with self._idle_lock:
+            self._parking[request] = (client_address, requests_handled)
+
+    def resume(self, request):
+        """Сколько запросов уже обслужено на соединении"""
+        with self._idle_lock:
+            return self._handled.pop(request, 0)
+
+    def detach(self, request):
+        """Не закрывать соединение после обработчика: им владеет другой"""
+        with self._idle_lock:
+            self._detached.add(request)
+
+    def shutdown_request(self, request):
+        with self._idle_lock:
+            if request in self._detached:
+                self._detached.discard(request)
+                return
+            parked = self._parking.pop(request, None)
+            if parked is not None and not self._stopping:
+                client_address, requests_handled = parked
+                self._new_idle.append(
+                    (
+                        request,
+                        client_address,
+                        requests_handled,
+                        time.monotonic() + KEEPALIVE_TIMEOUT,
+                    )
+                )
+                self._wake()
+                return
+            self._handled.pop(request, None)
+        super().shutdown_request(request)
 
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            # Буфер полон: поток и так проснется
+            pass
+
+    def _idle_loop(self):
+        """Ждать запросов на постоянных соединениях и ставить их в очередь"""
+        while True:
+            with self._idle_lock:
+                new, self._new_idle = self._new_idle, []
+                stopping = self._stopping
+            if stopping:
+                break
+
+            # Таймаут у всех одинаковый, поэтому порядок добавления в
+            # self._idle совпадает с порядком сроков
+            for request, client_address, requests_handled, deadline in new:
+                self._selector.register(request, selectors.EVENT_READ)
+                self._idle[request] = (client_address, requests_handled, deadline)
+
+            timeout = None
+            if self._idle:
+                deadline = next(iter(self._idle.values()))[2]
+                timeout = max(0, deadline - time.monotonic())
+
+            for key, _ in self._selector.select(timeout):
+                if key.fileobj is self._wake_r:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+
+                request = key.fileobj
+                self._selector.unregister(request)
+                client_address, requests_handled, _ = self._idle.pop(request)
+                with self._idle_lock:
+                    self._handled[request] = requests_handled
+                self.process_request(request, client_address)
+
+            now = time.monotonic()
+            while self._idle:
+                request, (_, _, deadline) = next(iter(self._idle.items()))
+                if deadline > now:
+                    break
+                self._close_idle(request)
+
+        with self._idle_lock:
+            new, self._new_idle = self._new_idle, []
+        for request, *_ in new:
+            super().shutdown_request(request)
+        for request in list(self._idle):
+            self._close_idle(request)
+
+    def _close_idle(self, request):
+        self._selector.unregister(request)
+        del self._idle[request]
+        super().shutdown_request(request)
+
+    def _reject(self, request):
+        """Ответ 503, когда все обработчики заняты и очередь полна"""
+        body = json.dumps(
+            {"error": "Сервер перегружен, повторите запрос позже"},
+            ensure_ascii=False,
+        ).encode("utf-8")
+        try:
+            request.sendall(
+                b"HTTP/1.0 503 Service Unavailable\r\n"
+                b"Content-Type: application/json\r\n"
+                b"Retry-After: 1\r\n"
+                b"Connection: close\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode("ascii")
+                + body
+            )
+        except OSError:
+            pass
+        metrics.request_rejected()
+        self.shutdown_request(request)
+
+    def _worker(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                break
+
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self):
+        """Закрыть сокет и дождаться обработки уже принятых запросов"""
+        # Постоянные соединения закрываются после текущего ответа,
+        # а ждущие следующего запроса - сразу
+        with self._idle_lock:
+            self._stopping = True
+            self._wake()
+        self._idle_thread.join()
+        self._selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
+        super().server_close()
+        for _ in self._threads:
+            self._requests.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+def _print_banner(port, mode):
     print("=" * 50)
     print(f"🚀 Сервер 'Страховочка' запущен!")
     print(f"📡 Адрес: http://localhost:{port}")
+    print(f"🧵 {mode}")
     print("=" * 50)
     print("\n📊 Тестовые пользователи:")
     print("   Администратор: логин 'admin', пароль 'password123'")
@@ -314,14 +1233,187 @@ def run_server(port=5000):
     print("\n⚡ Для остановки сервера нажмите Ctrl+C")
     print("=" * 50)
 
+
+def _serve(httpd):
+    """Обслуживать запросы до Ctrl+C или SIGTERM, затем дождаться начатых"""
+
+    def handle_sigterm(signum, frame):
+        # shutdown() ждет выхода из serve_forever, поэтому не из этого потока
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    auth.start()
+    db.start_backfill()
+    event_hub.start()
+
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
-        print("\n\n🛑 Сервер остановлен")
+        pass
     finally:
-        db.close()
         httpd.server_close()
+        event_hub.stop()
+        auth.stop()
+        db.close()
+
+
+def run_server(
+    port=5000,
+    workers=SERVER_WORKERS,
+    queue_size=SERVER_QUEUE_SIZE,
+    processes=SERVER_PROCESSES,
+    engine=SERVER_ENGINE,
+):
+    if engine not in ENGINES:
+        raise ValueError(f"Неизвестный движок сервера: {engine}")
+
+    if processes > 1:
+        if hasattr(os, "fork") and hasattr(socket, "SO_REUSEPORT"):
+            run_prefork(port, processes, workers, queue_size, engine)
+            return
+        print("⚠️ Многопроцессный режим недоступен на этой платформе")
+
+    _print_banner(
+        port, f"Движок: {engine}, обработчиков: {workers}, очередь: {queue_size}"
+    )
+    # Пул хеширования паролей создается fork'ом до открытия сокета сервера,
+    # чтобы его процессы не унаследовали слушающий сокет
+    password_hasher.start()
+    if engine == "asyncio":
+        from async_server import serve_async
+
+        serve_async(port, workers, queue_size)
+    else:
+        _serve(PooledHTTPServer(("", port), APIHandler, workers, queue_size))
+    print("\n🛑 Сервер остановлен")
+
+
+def _run_worker(port, workers, queue_size, engine):
+    """Тело рабочего процесса: свой сокет на общем порту и свои соединения"""
+    # Ctrl+C получает главный процесс и пересылает SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Соединения SQLite нельзя переносить через fork: сбрасываем пул,
+    # потоки этого процесса откроют собственные
+    db.close()
+    password_hasher.start()
+
+    if engine == "asyncio":
+        from async_server import serve_async
+
+        serve_async(port, workers, queue_size, reuse_port=True)
+        return
+
+    httpd = PooledHTTPServer(
+        ("", port), APIHandler, workers, queue_size, reuse_port=True
+    )
+    _serve(httpd)
+
+
+def run_prefork(
+    port=5000,
+    processes=SERVER_PROCESSES,
+    workers=SERVER_WORKERS,
+    queue_size=SERVER_QUEUE_SIZE,
+    engine=SERVER_ENGINE,
+):
+    """Главный процесс: запускает рабочие процессы и следит за ними.
+
+    Упавший процесс перезапускается (с паузой, если он упал сразу после
+    старта). SIGTERM и Ctrl+C пересылаются рабочим как SIGTERM, и
+    главный процесс ждет, пока они доделают начатые запросы.
+    """
+    children = {}
+    stopping = False
+
+    def spawn():
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(port, workers, queue_size, engine)
+            except BaseException as e:
+                print(f"❌ Рабочий процесс {os.getpid()} упал: {e}")
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def handle_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    # Дочерние процессы не должны унаследовать открытые соединения
+    db.close()
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+
+    for _ in range(processes):
+        spawn()
+
+    _print_banner(
+        port,
+        f"Движок: {engine}, процессов: {processes}, "
+        f"обработчиков в каждом: {workers}, очередь: {queue_size}",
+    )
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+
+        started = children.pop(pid, None)
+        if stopping or started is None:
+            continue
+
+        print(f"⚠️ Рабочий процесс {pid} завершился (статус {status}), перезапуск")
+        if time.monotonic() - started < WORKER_RESTART_DELAY:
+            time.sleep(WORKER_RESTART_DELAY)
+        if not stopping:
+            spawn()
+
+    print("\n🛑 Сервер остановлен")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API системы 'Страховочка'")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=SERVER_PROCESSES,
+        help="число рабочих процессов на общем порту (SO_REUSEPORT)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=SERVER_WORKERS,
+        help="число потоков-обработчиков в каждом процессе",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=SERVER_QUEUE_SIZE,
+        help="длина очереди принятых соединений",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default=SERVER_ENGINE,
+        help="threads: пул потоков, asyncio: цикл событий",
+    )
+    args = parser.parse_args()
+
+    run_server(args.port, args.workers, args.queue_size, args.processes, args.engine)
 
 
 if __name__ == "__main__":
-    run_server(5000)
+    main()
@@ -236,6 +236,7 @@ async function handleLogin() {
         localStorage.setItem('user', JSON.stringify(currentUser));
         
         showNotification('Вход выполнен успешно!', 'success');
+        connectEvents();
         showPage('dashboard');
     }
 }
@@ -334,6 +335,7 @@ async function handleRegister() {
         localStorage.setItem('user', JSON.stringify(currentUser));
         
         showNotification('Регистрация успешна!', 'success');
+        connectEvents();
         showPage('dashboard');
     }
 }
@@ -397,22 +399,26 @@ function loadDashboardPage() {
 }
 
 async function loadDashboardData() {
-    const appsData = await apiRequest('/api/applications');
-    
-    if (appsData && appsData.applications) {
-        updateStats(appsData.applications);
-        updateRecentApplications(appsData.applications.slice(0, 5));
+    // Счетчики приходят готовыми из /api/stats, а последние заявки -
+    // первой страницей списка: весь список заявок панели не нужен
+    const [summary, appsData] = await Promise.all([
+        apiRequest('/api/stats'),
+        apiRequest('/api/applications?limit=5')
+    ]);
+    if (summary && appsData && appsData.applications) {
+        updateStats(appsData.applications, summary);
+        updateRecentApplications(appsData.applications);
     }
 }
 
-function updateStats(applications) {
+function updateStats(applications, summary) {
     const statsGrid = document.getElementById('stats-grid');
     
     const stats = {
-        total: applications.length,
-        processing: applications.filter(a => a.status === 'В процессе').length,
-        processed: applications.filter(a => a.status === 'Обработана').length,
-        rejected: applications.filter(a => a.status === 'Отклонена').length
+        total: summary.total,
+        processing: summary.by_status['В процессе'] || 0,
+        processed: summary.by_status['Обработана'] || 0,
+        rejected: summary.by_status['Отклонена'] || 0
     };
     
     let statsHTML = '';
@@ -549,18 +555,101 @@ function updateRecentApplications(applications) {
     container.innerHTML = tableHTML;
 }
 
+// Размер страницы для списков заявок и пользователей
+const PAGE_LIMIT = 50;
+let applicationsCursor = null;
+let usersCursor = null;
+// Строка поиска заявок; пока она задана, "Показать ещё" листает результаты поиска
+let applicationsSearch = null;
+// Номер последнего изменения заявок, которое уже есть в таблице
+let applicationsSeq = null;
+
+function canChangeStatus() {
+    return currentUser.role === 'manager' || currentUser.role === 'admin';
+}
+
+function renderApplicationRow(app) {
+    const date = new Date(app.created_at).toLocaleDateString('ru-RU');
+    const statusClass = getStatusClass(app.status);
+    
+    return `
+        <tr data-id="${app.id}">
+            ${canChangeStatus() ? `
+                <td>
+                    ${app.status === 'В процессе' ? `
+                        <input type="checkbox" class="application-select" value="${app.id}">
+                    ` : ''}
+                </td>
+            ` : ''}
+            <td>#${app.id}</td>
+            <td>${app.insurance_name || 'Не указан'}</td>
+            ${currentUser.role !== 'client' ? `<td>${app.client_name || '—'}</td>` : ''}
+            ${currentUser.role === 'admin' ? `<td>${app.manager_name || 'Не назначен'}</td>` : ''}
+            <td>${date}</td>
+            <td><span class="status-badge ${statusClass}">${app.status}</span></td>
+            <td>${app.price ? `${app.price} ₽` : '—'}</td>
+            <td>
+                <button class="btn btn-outline btn-sm" onclick="viewApplication(${app.id})">
+                    <i class="fas fa-eye"></i>
+                </button>
+                ${canChangeStatus() && app.status === 'В процессе' ? `
+                    <button class="btn btn-primary btn-sm" onclick="updateStatus(${app.id}, 'Обработана')">
+                        <i class="fas fa-check"></i>
+                    </button>
+                    <button class="btn btn-danger btn-sm" onclick="updateStatus(${app.id}, 'Отклонена')">
+                        <i class="fas fa-times"></i>
+                    </button>
+                ` : ''}
+            </td>
+        </tr>
+    `;
+}
+
+function renderLoadMoreButton(id, handler, cursor) {
+    if (!cursor) {
+        return '';
+    }
+    
+    return `
+        <div id="${id}" style="padding: 20px; text-align: center;">
+            <button class="btn btn-outline" onclick="${handler}()">
+                <i class="fas fa-chevron-down"></i> Показать ещё
+            </button>
+        </div>
+    `;
+}
+
 async function loadApplicationsPage() {
-    const data = await apiRequest('/api/applications');
+    const data = await apiRequest(`/api/applications?limit=${PAGE_LIMIT}`);
+    applicationsCursor = data ? data.next_cursor : null;
+    applicationsSearch = null;
+    applicationsSeq = data ? data.seq : null;
     
     let html = `
         <section class="page active">
             <div class="dashboard-header">
                 <h2><i class="fas fa-file-alt"></i> Управление заявками</h2>
+                <form class="search-form" onsubmit="searchApplications(event)">
+                    <input type="search" id="applications-search" placeholder="Модель, госномер или клиент">
+                    <button class="btn btn-outline" type="submit">
+                        <i class="fas fa-search"></i> Найти
+                    </button>
+                </form>
                 ${currentUser.role === 'client' ? `
                     <button class="btn btn-primary" onclick="showPage('new-application')">
                         <i class="fas fa-plus-circle"></i> Новая заявка
                     </button>
                 ` : ''}
+                ${canChangeStatus() ? `
+                    <div>
+                        <button class="btn btn-primary" onclick="bulkUpdateStatus('Обработана')">
+                            <i class="fas fa-check-double"></i> Обработать выбранные
+                        </button>
+                        <button class="btn btn-danger" onclick="bulkUpdateStatus('Отклонена')">
+                            <i class="fas fa-times"></i> Отклонить выбранные
+                        </button>
+                    </div>
+                ` : ''}
             </div>
             
             <div class="table-container">
@@ -573,6 +662,9 @@ async function loadApplicationsPage() {
             <table>
                 <thead>
                     <tr>
+                        ${canChangeStatus() ? `
+                            <th><input type="checkbox" onchange="toggleAllApplications(this.checked)"></th>
+                        ` : ''}
                         <th>ID</th>
                         <th>Тип страховки</th>
                         ${currentUser.role !== 'client' ? '<th>Клиент</th>' : ''}
@@ -583,42 +675,11 @@ async function loadApplicationsPage() {
                         <th>Действия</th>
                     </tr>
                 </thead>
-                <tbody>
-        `;
-        
-        data.applications.forEach(app => {
-            const date = new Date(app.created_at).toLocaleDateString('ru-RU');
-            const statusClass = getStatusClass(app.status);
-            
-            html += `
-                <tr>
-                    <td>#${app.id}</td>
-                    <td>${app.insurance_name || 'Не указан'}</td>
-                    ${currentUser.role !== 'client' ? `<td>${app.client_name || '—'}</td>` : ''}
-                    ${currentUser.role === 'admin' ? `<td>${app.manager_name || 'Не назначен'}</td>` : ''}
-                    <td>${date}</td>
-                    <td><span class="status-badge ${statusClass}">${app.status}</span></td>
-                    <td>${app.price ? `${app.price} ₽` : '—'}</td>
-                    <td>
-                        <button class="btn btn-outline btn-sm" onclick="viewApplication(${app.id})">
-                            <i class="fas fa-eye"></i>
-                        </button>
-                        ${(currentUser.role === 'manager' || currentUser.role === 'admin') && app.status === 'В процессе' ? `
-                            <button class="btn btn-primary btn-sm" onclick="updateStatus(${app.id}, 'Обработана')">
-                                <i class="fas fa-check"></i>
-                            </button>
-                            <button class="btn btn-danger btn-sm" onclick="updateStatus(${app.id}, 'Отклонена')">
-                                <i class="fas fa-times"></i>
-                            </button>
-                        ` : ''}
-                    </td>
-                </tr>
-            `;
-        });
-        
-        html += `
+                <tbody id="applications-body">
+                    ${data.applications.map(renderApplicationRow).join('')}
                 </tbody>
             </table>
+            ${renderLoadMoreButton('applications-more', 'loadMoreApplications', applicationsCursor)}
         `;
     }
     
@@ -630,6 +691,190 @@ async function loadApplicationsPage() {
     mainContent.innerHTML = html;
 }
 
+async function searchApplications(event) {
+    event.preventDefault();
+    const query = document.getElementById('applications-search').value.trim();
+    if (!query) {
+        loadApplicationsPage();
+        return;
+    }
+    
+    const data = await apiRequest(
+        `/api/applications/search?q=${encodeURIComponent(query)}&limit=${PAGE_LIMIT}`
+    );
+    const body = document.getElementById('applications-body');
+    if (!data || !data.applications || !body) {
+        return;
+    }
+    
+    applicationsSearch = query;
+    applicationsCursor = data.next_offset;
+    body.innerHTML = data.applications.length
+        ? data.applications.map(renderApplicationRow).join('')
+        : '<tr><td colspan="9" style="text-align: center; color: #666;">Ничего не найдено</td></tr>';
+    
+    const more = document.getElementById('applications-more');
+    if (more) {
+        more.remove();
+    }
+    body.closest('table').insertAdjacentHTML(
+        'afterend',
+        renderLoadMoreButton('applications-more', 'loadMoreApplications', applicationsCursor)
+    );
+}
+
+async function loadMoreApplications() {
+    if (!applicationsCursor) {
+        return;
+    }
+    
+    const endpoint = applicationsSearch
+        ? `/api/applications/search?q=${encodeURIComponent(applicationsSearch)}` +
+          `&limit=${PAGE_LIMIT}&offset=${applicationsCursor}`
+        : `/api/applications?limit=${PAGE_LIMIT}&cursor=${encodeURIComponent(applicationsCursor)}`;
+    const data = await apiRequest(endpoint);
+    if (!data || !data.applications) {
+        return;
+    }
+    
+    applicationsCursor = applicationsSearch ? data.next_offset : data.next_cursor;
+    document.getElementById('applications-body')
+        .insertAdjacentHTML('beforeend', data.applications.map(renderApplicationRow).join(''));
+    
+    if (!applicationsCursor) {
+        document.getElementById('applications-more').remove();
+    }
+}
+
+// Подтянуть в таблицу только заявки, изменившиеся с applicationsSeq,
+// вместо повторной загрузки всего списка
+async function syncApplications() {
+    const body = document.getElementById('applications-body');
+    if (!body || applicationsSeq === null) {
+        return false;
+    }
+    
+    const data = await apiRequest(`/api/applications?since=${applicationsSeq}`);
+    if (!data || !data.applications) {
+        return false;
+    }
+    
+    data.removed.forEach(id => {
+        const row = body.querySelector(`tr[data-id="${id}"]`);
+        if (row) {
+            row.remove();
+        }
+    });
+    const newest = body.querySelector('tr[data-id]');
+    const newestId = newest ? parseInt(newest.dataset.id) : 0;
+    data.applications.forEach(app => {
+        const row = body.querySelector(`tr[data-id="${app.id}"]`);
+        if (row) {
+            row.outerHTML = renderApplicationRow(app);
+        } else if (!applicationsSearch && app.id > newestId) {
+            // Новая заявка: в списке от новых к старым она первая. Изменения
+            // еще не загруженных страниц не добавляем
+            body.insertAdjacentHTML('afterbegin', renderApplicationRow(app));
+        }
+    });
+    applicationsSeq = data.seq;
+    
+    return data.more ? syncApplications() : true;
+}
+
+// Поток событий о заявках. fetch, а не EventSource: EventSource не умеет
+// передавать заголовок Authorization
+let eventsController = null;
+let eventsSyncTimer = null;
+const EVENTS_RECONNECT_DELAY = 5000;
+
+async function connectEvents() {
+    disconnectEvents();
+    if (!currentToken) {
+        return;
+    }
+    
+    const controller = new AbortController();
+    eventsController = controller;
+    try {
+        const response = await fetch(`${API_URL}/api/events`, {
+            headers: { 'Authorization': `Bearer ${currentToken}` },
+            signal: controller.signal
+        });
+        if (response.status === 401) {
+            eventsController = null;
+            return;
+        }
+        if (!response.ok || !response.body) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            let end;
+            while ((end = buffer.indexOf('\n\n')) !== -1) {
+                handleServerEvent(buffer.slice(0, end));
+                buffer = buffer.slice(end + 2);
+            }
+        }
+    } catch (error) {
+        if (controller.signal.aborted) {
+            return;
+        }
+        console.error('Поток событий:', error);
+    }
+    
+    // Соединение оборвалось: переподключаемся, пропущенное догонит since=
+    if (eventsController === controller) {
+        eventsController = null;
+        setTimeout(connectEvents, EVENTS_RECONNECT_DELAY);
+    }
+}
+
+function disconnectEvents() {
+    if (eventsController) {
+        const controller = eventsController;
+        eventsController = null;
+        controller.abort();
+    }
+}
+
+function handleServerEvent(text) {
+    let event = 'message';
+    let data = '';
+    text.split('\n').forEach(line => {
+        if (line.startsWith('event: ')) {
+            event = line.slice(7);
+        } else if (line.startsWith('data: ')) {
+            data += line.slice(6);
+        }
+    });
+    // Строки-комментарии без данных - пинги сервера
+    if (!data) {
+        return;
+    }
+    
+    const payload = JSON.parse(data);
+    if (event === 'application_status' && currentUser && currentUser.role === 'client') {
+        showNotification(`Заявка #${payload.id}: ${payload.status}`, 'info');
+    }
+    
+    // Несколько событий подряд - одна синхронизация таблицы
+    if (!eventsSyncTimer) {
+        eventsSyncTimer = setTimeout(() => {
+            eventsSyncTimer = null;
+            syncApplications();
+        }, 300);
+    }
+}
+
 async function updateStatus(appId, newStatus) {
     if (!confirm(`Изменить статус заявки #${appId} на "${newStatus}"?`)) {
         return;
@@ -642,8 +887,46 @@ async function updateStatus(appId, newStatus) {
     
     if (data) {
         showNotification('Статус обновлен', 'success');
-        loadApplicationsPage();
-        loadDashboardPage();
+        if (!await syncApplications()) {
+            loadDashboardPage();
+        }
+    }
+}
+
+function toggleAllApplications(checked) {
+    document.querySelectorAll('.application-select').forEach(box => {
+        box.checked = checked;
+    });
+}
+
+async function bulkUpdateStatus(newStatus) {
+    const ids = Array.from(document.querySelectorAll('.application-select:checked'))
+        .map(box => parseInt(box.value));
+    
+    if (ids.length === 0) {
+        showNotification('Выберите заявки', 'error');
+        return;
+    }
+    
+    if (!confirm(`Изменить статус ${ids.length} заявок на "${newStatus}"?`)) {
+        return;
+    }
+    
+    // Один запрос и одна транзакция на весь выбор вместо запроса на заявку
+    const data = await apiRequest('/api/applications/status', {
+        method: 'PUT',
+        body: JSON.stringify({ items: ids.map(id => ({ id, status: newStatus })) })
+    });
+    
+    if (data) {
+        let message = `Статус обновлен у ${data.applications.length} заявок`;
+        if (data.skipped.length > 0) {
+            message += `, пропущено: ${data.skipped.map(id => '#' + id).join(', ')}`;
+        }
+        showNotification(message, data.skipped.length > 0 ? 'info' : 'success');
+        if (!await syncApplications()) {
+            loadApplicationsPage();
+        }
     }
 }
 
@@ -652,6 +935,30 @@ async function viewApplication(appId) {
     alert(`Просмотр заявки #${appId}\n\nВ полной версии здесь будет детальная информация о заявке.`);
 }
 
+function renderUserRow(user) {
+    const date = new Date(user.created_at).toLocaleDateString('ru-RU');
+    
+    return `
+        <tr>
+            <td>${user.id}</td>
+            <td>${user.full_name}</td>
+            <td>${user.username}</td>
+            <td>${user.email}</td>
+            <td>${getRoleName(user.role)}</td>
+            <td>${user.phone || '—'}</td>
+            <td>${date}</td>
+            <td>
+                <button class="btn btn-outline btn-sm" onclick="editUser(${user.id})">
+                    <i class="fas fa-edit"></i>
+                </button>
+                <button class="btn btn-danger btn-sm" onclick="deleteUser(${user.id})" ${user.role === 'admin' ? 'disabled' : ''}>
+                    <i class="fas fa-trash"></i>
+                </button>
+            </td>
+        </tr>
+    `;
+}
+
 async function loadUsersPage() {
     if (currentUser.role !== 'admin') {
         showNotification('Недостаточно прав', 'error');
@@ -659,7 +966,8 @@ async function loadUsersPage() {
         return;
     }
     
-    const data = await apiRequest('/api/users');
+    const data = await apiRequest(`/api/users?limit=${PAGE_LIMIT}`);
+    usersCursor = data ? data.next_cursor : null;
     
     let html = `
         <section class="page active">
@@ -690,36 +998,11 @@ async function loadUsersPage() {
                         <th>Действия</th>
                     </tr>
                 </thead>
-                <tbody>
-        `;
-        
-        data.users.forEach(user => {
-            const date = new Date(user.created_at).toLocaleDateString('ru-RU');
-            
-            html += `
-                <tr>
-                    <td>${user.id}</td>
-                    <td>${user.full_name}</td>
-                    <td>${user.username}</td>
-                    <td>${user.email}</td>
-                    <td>${getRoleName(user.role)}</td>
-                    <td>${user.phone || '—'}</td>
-                    <td>${date}</td>
-                    <td>
-                        <button class="btn btn-outline btn-sm" onclick="editUser(${user.id})">
-                            <i class="fas fa-edit"></i>
-                        </button>
-                        <button class="btn btn-danger btn-sm" onclick="deleteUser(${user.id})" ${user.role === 'admin' ? 'disabled' : ''}>
-                            <i class="fas fa-trash"></i>
-                        </button>
-                    </td>
-                </tr>
-            `;
-        });
-        
-        html += `
+                <tbody id="users-body">
+                    ${data.users.map(renderUserRow).join('')}
                 </tbody>
             </table>
+            ${renderLoadMoreButton('users-more', 'loadMoreUsers', usersCursor)}
         `;
     }
     
@@ -731,6 +1014,26 @@ async function loadUsersPage() {
     mainContent.innerHTML = html;
 }
 
+async function loadMoreUsers() {
+    if (!usersCursor) {
+        return;
+    }
+    
+    const cursor = encodeURIComponent(usersCursor);
+    const data = await apiRequest(`/api/users?limit=${PAGE_LIMIT}&cursor=${cursor}`);
+    if (!data || !data.users) {
+        return;
+    }
+    
+    usersCursor = data.next_cursor;
+    document.getElementById('users-body')
+        .insertAdjacentHTML('beforeend', data.users.map(renderUserRow).join(''));
+    
+    if (!usersCursor) {
+        document.getElementById('users-more').remove();
+    }
+}
+
 async function deleteUser(userId) {
     if (!confirm('Вы уверены, что хотите удалить этого пользователя?')) {
         return;
@@ -956,6 +1259,7 @@ async function logout() {
         method: 'POST'
     });
     
+    disconnectEvents();
     currentUser = null;
     currentToken = null;
     localStorage.removeItem('token');
@@ -982,6 +1286,7 @@ async function checkAuth() {
             logout();
             return;
         }
+        connectEvents();
     }
     
     updateHeader();